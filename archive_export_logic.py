@@ -0,0 +1,234 @@
+import csv
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+
+from connection_manager import release_connection
+from database import iter_letters, shamsi_date_display
+from helpers import convert_numbers_to_persian
+
+# Rows written between two progress reports
+EXPORT_PROGRESS_ROWS = 1000
+PROGRESS_POLL_MS = 100
+
+# Exported field -> column header in CSV and Excel files (JSON Lines use the field names)
+LETTER_EXPORT_COLUMNS = {
+    'id': "شناسه",
+    'letter_code': "کد نامه",
+    'type': "نوع (کد)",
+    'type_name': "نوع نامه",
+    'date_shamsi': "تاریخ",
+    'date_gregorian': "تاریخ میلادی",
+    'subject': "موضوع",
+    'organization': "سازمان",
+    'contact': "مخاطب",
+    'contact_title': "سمت مخاطب",
+    'created_by': "ثبت‌کننده",
+    'created_at': "زمان ثبت",
+    'file_path': "مسیر فایل",
+    'body': "متن نامه",
+}
+# Extension -> format name, for the save dialog and error messages
+EXPORT_FORMATS = {
+    ".csv": "CSV",
+    ".jsonl": "JSON Lines",
+    ".xlsx": "Excel",
+}
+
+# Control characters an .xlsx file can't hold (tab and line breaks are fine)
+_XLSX_ILLEGAL_CHARACTERS = re.compile(r"[\000-\010\013\014\016-\037]")
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _export_record(row, letter_types_map):
+    """One letter (a database.iter_letters row) as {field of LETTER_EXPORT_COLUMNS: value}."""
+    contact = f"{row['first_name']} {row['last_name']}" if row['first_name'] and row['last_name'] else ""
+    return {
+        'id': row['id'],
+        'letter_code': row['letter_code_persian'],
+        'type': row['type'],
+        'type_name': letter_types_map.get(row['type'], row['type']) if letter_types_map else row['type'],
+        'date_shamsi': shamsi_date_display(row['date_shamsi']) or row['date_shamsi_persian'],
+        'date_gregorian': row['date_gregorian'],
+        'subject': row['subject'],
+        'organization': row['organization_name'] or "",
+        'contact': contact,
+        'contact_title': row['contact_title'] or "",
+        'created_by': row['created_by_username'] or "",
+        'created_at': row['created_at'],
+        'file_path': row['file_path'],
+        'body': row['body'],
+    }
+
+def _write_csv(path, records):
+    # utf-8-sig so Excel opens the Persian text correctly
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(LETTER_EXPORT_COLUMNS.values())
+        for record in records:
+            writer.writerow(record.values())
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+
+def _write_xlsx(path, records):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportError("برای خروجی اکسل بسته openpyxl لازم است (pip install openpyxl). می‌توانید خروجی CSV بگیرید.")
+    # A write-only workbook streams each row to the file instead of keeping the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("نامه‌ها")
+    sheet.append(list(LETTER_EXPORT_COLUMNS.values()))
+    for record in records:
+        sheet.append([_XLSX_ILLEGAL_CHARACTERS.sub("", value) if isinstance(value, str) else value for value in record.values()])
+    workbook.save(path)
+
+_WRITERS = {".csv": _write_csv, ".jsonl": _write_jsonl, ".xlsx": _write_xlsx}
+
+def export_letters(path, search_term="", filters=None, sort_column=None, descending=True, letter_types_map=None,
+                   progress_callback=None, cancel_event=None):
+    """
+    Writes the letters matching search_term and filters, in the archive's order (database.iter_letters
+    arguments, e.g. archive_logic.get_history_query), to path as CSV, JSON Lines or Excel, chosen by its
+    extension (EXPORT_FORMATS). Rows go from the database cursor straight to the file, so memory use
+    doesn't grow with the archive. The file is written next to path and renamed when complete.
+
+    progress_callback(rows written) is called every EXPORT_PROGRESS_ROWS rows; setting cancel_event
+    (a threading.Event) stops the export and raises ExportCancelled.
+    Returns {'path', 'rows', 'seconds', 'rows_per_second'}.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _WRITERS:
+        raise ValueError(f"قالب فایل پشتیبانی نمی‌شود: {extension} (فقط {'، '.join(EXPORT_FORMATS)})")
+    started = time.perf_counter()
+    rows = 0
+
+    def _records():
+        nonlocal rows
+        letters = iter_letters(search_term, filters, sort_column, descending)
+        try:
+            for row in letters:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                yield _export_record(row, letter_types_map)
+                rows += 1
+                if progress_callback and rows % EXPORT_PROGRESS_ROWS == 0:
+                    progress_callback(rows)
+        finally:
+            # Closes the cursor when cancelled or when writing failed
+            letters.close()
+
+    partial_path = path + ".part"
+    try:
+        _WRITERS[extension](partial_path, _records())
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    seconds = time.perf_counter() - started
+    print(f"DEBUG: خروجی آرشیو در {path}: {rows} نامه در {seconds:.2f} ثانیه")
+    return {'path': path, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0}
+
+
+def ask_export_path(parent):
+    """Asks where to save an export; returns the path or "" if cancelled."""
+    return filedialog.asksaveasfilename(
+        parent=parent, title="خروجی آرشیو نامه‌ها", defaultextension=".csv",
+        filetypes=[(label, f"*{extension}") for extension, label in EXPORT_FORMATS.items()]
+    )
+
+
+class ArchiveExportDialog(tk.Toplevel):
+    """Runs export_letters for the archive's current search on a background thread, with progress and a cancel button."""
+
+    def __init__(self, parent, path, query, letter_types_map=None, status_bar_ref=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.path = path
+        self.status_bar_ref = status_bar_ref
+        self._progress_queue = queue.Queue()
+        self._cancel_event = threading.Event()
+
+        self.title("خروجی آرشیو نامه‌ها")
+        self.geometry("450x130")
+        self.transient(parent)
+        self.grab_set()
+
+        main_frame = ttk.Frame(self, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(main_frame, text=os.path.basename(path)).pack(anchor=tk.E)
+        self.progressbar = ttk.Progressbar(main_frame, orient="horizontal", mode="indeterminate")
+        self.progressbar.pack(fill=tk.X, pady=5)
+        self.progress_label = ttk.Label(main_frame, text="در حال خواندن نامه‌ها...")
+        self.progress_label.pack(anchor=tk.E)
+        self.btn_cancel = ttk.Button(main_frame, text="لغو", command=self._on_cancel)
+        self.btn_cancel.pack(side=tk.LEFT, pady=5)
+        self.protocol("WM_DELETE_WINDOW", self._on_cancel)
+
+        self.progressbar.start(50)
+        self._worker = threading.Thread(target=self._run_export, args=(query, letter_types_map), name="archive-export", daemon=True)
+        self._worker.start()
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _run_export(self, query, letter_types_map):
+        # Runs on the worker thread; everything for the UI goes through _progress_queue
+        try:
+            result = export_letters(self.path, letter_types_map=letter_types_map, cancel_event=self._cancel_event,
+                                    progress_callback=lambda rows: self._progress_queue.put(('progress', rows)), **query)
+            self._progress_queue.put(('done', result))
+        except ExportCancelled:
+            self._progress_queue.put(('cancelled',))
+        except Exception as e:
+            traceback.print_exc()
+            self._progress_queue.put(('error', e))
+        finally:
+            release_connection()
+
+    def _poll_progress(self):
+        if not self.winfo_exists():
+            return
+        while True:
+            try:
+                message = self._progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                self.progress_label.config(text=f"{convert_numbers_to_persian(str(message[1]))} نامه نوشته شد")
+            else:
+                self._on_export_finished(message)
+                return
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _on_export_finished(self, message):
+        self.progressbar.stop()
+        self.destroy()
+        if message[0] == 'done':
+            result = message[1]
+            summary = f"{convert_numbers_to_persian(str(result['rows']))} نامه در فایل {result['path']} ذخیره شد."
+            if self.status_bar_ref:
+                self.status_bar_ref.config(text=f"خروجی آرشیو: {summary}")
+            messagebox.showinfo("خروجی آرشیو", summary, parent=self.parent)
+        elif message[0] == 'error':
+            messagebox.showerror("خطا در خروجی آرشیو", f"خطا در ذخیره خروجی آرشیو: {message[1]}", parent=self.parent)
+        elif self.status_bar_ref:
+            self.status_bar_ref.config(text="خروجی آرشیو لغو شد.")
+
+    def _on_cancel(self):
+        self._cancel_event.set()
+        self.btn_cancel.config(state="disabled")
+        self.progress_label.config(text="در حال لغو...")
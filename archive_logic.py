@@ -1,49 +1,257 @@
 import os
-from tkinter import messagebox, END
-from database import get_letters_from_db, get_letter_by_code
-from helpers import sort_column
+import re
+from tkinter import messagebox, END, ttk
+from database import (get_letter_by_code, get_letters_page, get_letter_facets, get_all_users,
+                      letters_fts_available, shamsi_date_number, shamsi_date_display, ARCHIVE_PAGE_SIZE, LETTER_FACETS)
+from helpers import show_sort_indicator, convert_numbers_to_persian
 import tkinter as tk # Needed for tk.END
+from query_executor import run_query, cancel_query
+from autocomplete import AutocompleteEntry, get_organization_index
 
-def update_history_treeview(search_term="", history_treeview_ref=None, status_bar_ref=None, letter_types_map=None):
+# How close (in rows) the bottom of the view may get to the end of the loaded rows
+# before the next page is fetched.
+PREFETCH_ROWS = 50
+
+
+class ArchivePager:
+    """
+    Loads the letter history Treeview page by page instead of all at once.
+    The first page fills the visible window plus a prefetch margin; further pages are
+    fetched with keyset pagination (database.get_letters_page) as the user scrolls
+    towards the end of what is already loaded. Pages are queried off the Tk thread;
+    a new search supersedes a page request that is still in flight.
+    When the previous search was fully loaded and the new term extends it, the loaded
+    rows are filtered in memory instead of being queried again.
+    A column header sort (set_sort) reloads from the first page, ordered by the query.
+    filters (database.LETTER_FILTER_KEYS) limit every search; on_facets, if set, receives the
+    facet counts (database.get_letter_facets) whenever the search or the filters change (counted
+    from the loaded rows when the search was narrowed in memory).
+    """
+
+    def __init__(self, treeview, status_bar_ref=None, letter_types_map=None, page_size=ARCHIVE_PAGE_SIZE):
+        self.treeview = treeview
+        self.status_bar_ref = status_bar_ref
+        self.letter_types_map = letter_types_map
+        self.page_size = page_size
+        self.search_term = ""
+        self.sort_column = None
+        self.descending = True
+        self.filters = {}
+        self.on_facets = None
+        self.next_after = None
+        self.exhausted = True
+        self.loaded_count = 0
+        self._rows = []
+        self._load_scheduled = False
+        self._loading = False
+        self._can_narrow = None
+        self._facets_key = None
+        self._channel = f"archive:{treeview}"
+
+        # Wrap the existing scroll command (normally the scrollbar's set) so scrolling can trigger loading
+        self._scroll_command = treeview.cget("yscrollcommand")
+        treeview.configure(yscrollcommand=self._on_yscroll)
+
+    def reset(self, search_term=""):
+        """Clears the Treeview and loads the first page for a new search term."""
+        if self._narrows_current_results(search_term):
+            cancel_query(self._channel)
+            rows = [letter_data for letter_data in self._rows if _letter_matches(letter_data, search_term)]
+            self.search_term = search_term
+            self.loaded_count = 0
+            self._rows = []
+            self.treeview.delete(*self.treeview.get_children())
+            self._append_rows(rows)
+            # Every match is loaded, so the counts come from the rows too
+            if self.on_facets is not None:
+                self._facets_key = self._search_key()
+                self.on_facets(_count_facets(rows))
+            return
+
+        self.search_term = search_term
+        self._load_facets()
+        self.next_after = None
+        self.exhausted = False
+        self.loaded_count = 0
+        self._rows = []
+        self._loading = False
+        self.treeview.delete(*self.treeview.get_children())
+        self.load_more()
+
+    def set_sort(self, column):
+        """
+        Sorts by column (a key of database.ARCHIVE_SORT_KEYS); choosing the current column again
+        reverses the order. Dates start newest first, the other columns in ascending order.
+        """
+        if column == self.sort_column:
+            self.descending = not self.descending
+        else:
+            self.sort_column = column
+            self.descending = column == "date"
+        show_sort_indicator(self.treeview, column, self.descending)
+        self.reset(self.search_term)
+
+    def set_filters(self, filters):
+        """Applies new filters (a dict, see database.LETTER_FILTER_KEYS) to the current search."""
+        self.filters = {key: value for key, value in filters.items() if value}
+        self.reset(self.search_term)
+
+    def invalidate_facets(self):
+        """Makes the next reset reload the facet counts even if the search and filters are the same (letters changed)."""
+        self._facets_key = None
+
+    def _search_key(self):
+        return self.search_term, tuple(sorted(self.filters.items()))
+
+    def _load_facets(self):
+        # Counts depend only on the search and the filters: a new sort or the same search again keeps them
+        if self.on_facets is None or self._search_key() == self._facets_key:
+            return
+        self._facets_key = self._search_key()
+        run_query(f"archive-facets:{self.treeview}", get_letter_facets, self.search_term, self.filters,
+                  on_done=self.on_facets, on_error=lambda error: print(f"DEBUG: Error loading archive facets: {error}"))
+
+    def _narrows_current_results(self, search_term):
+        # Only full-text results can be narrowed: _letter_matches mirrors the FTS prefix matching
+        if not (self.exhausted and not self._loading and self.search_term and search_term != self.search_term
+                and search_term.startswith(self.search_term)):
+            return False
+        if self._can_narrow is None:
+            self._can_narrow = letters_fts_available()
+        return self._can_narrow
+
+    def load_more(self):
+        """Requests the next page, if there is one and none is already on its way."""
+        self._load_scheduled = False
+        if self.exhausted or self._loading:
+            return
+        self._loading = True
+        run_query(self._channel, get_letters_page, self.search_term, self.next_after, self.page_size,
+                  self.sort_column, self.descending, self.filters, on_done=self._on_page_loaded, on_error=self._on_page_error)
+
+    def _on_page_loaded(self, page):
+        """Appends a fetched page to the Treeview (runs on the Tk thread)."""
+        self._loading = False
+        if not self.treeview.winfo_exists():
+            return
+        letters, self.next_after = page
+        self.exhausted = self.next_after is None
+        self._append_rows(letters)
+
+    def _append_rows(self, letters):
+        for letter_data in letters:
+            self.treeview.insert("", tk.END, values=_history_row_values(letter_data, self.letter_types_map), iid=letter_data['id'])
+        self._rows.extend(letters)
+        self.loaded_count += len(letters)
+        self._update_status()
+
+    def _on_page_error(self, error):
+        self._loading = False
+        print(f"DEBUG: Error loading archive page: {error}")
+        if self.status_bar_ref:
+            self.status_bar_ref.config(text=f"خطا در بازیابی نامه‌ها: {error}")
+
+    def _on_yscroll(self, first, last):
+        if self._scroll_command:
+            self.treeview.tk.eval(f"{self._scroll_command} {first} {last}")
+        remaining_rows = (1.0 - float(last)) * self.loaded_count
+        if not self.exhausted and not self._load_scheduled and remaining_rows < PREFETCH_ROWS:
+            self._load_scheduled = True
+            self.treeview.after_idle(self.load_more)
+
+    def _update_status(self):
+        if not self.status_bar_ref:
+            return
+        if self.exhausted:
+            self.status_bar_ref.config(text=f"نمایش {self.loaded_count} نامه.")
+        else:
+            self.status_bar_ref.config(text=f"نمایش {self.loaded_count} نامه (با پیمایش به پایین، نامه‌های بیشتری بارگذاری می‌شود).")
+
+
+_PERSIAN_TO_LATIN_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹", "0123456789")
+_LETTER_SEARCH_FIELDS = ('letter_code_persian', 'subject', 'body', 'organization_name', 'first_name', 'last_name')
+
+def _search_words(text):
+    return re.findall(r"\w+", text.lower().translate(_PERSIAN_TO_LATIN_DIGITS))
+
+def _letter_matches(letter_data, search_term):
+    """In-memory counterpart of database.build_fts_query: every word of search_term
+    must be the prefix of some word in the indexed fields of the letter."""
+    words = _search_words(" ".join(str(letter_data.get(field) or "") for field in _LETTER_SEARCH_FIELDS))
+    return all(any(word.startswith(term) for word in words) for term in _search_words(search_term))
+
+def _count_facets(letters):
+    """In-memory counterpart of database.get_letter_facets over fully loaded rows."""
+    facets = {facet: {} for facet in LETTER_FACETS}
+    for letter_data in letters:
+        values = {'type': letter_data['type'], 'month': letter_data['date_shamsi'] // 100 if letter_data['date_shamsi'] else None,
+                  'organization_id': letter_data['organization_id'], 'user_id': letter_data['user_id']}
+        for facet, value in values.items():
+            facets[facet][value] = facets[facet].get(value, 0) + 1
+    facets['total'] = len(letters)
+    return facets
+
+def _history_row_values(letter_data, letter_types_map):
+    """Builds the display values of one history Treeview row from a letter record."""
+    org_name = letter_data['organization_name'] if letter_data['organization_name'] else "---"
+    contact_name = f"{letter_data['first_name']} {letter_data['last_name']}" if (letter_data['first_name'] and letter_data['last_name']) else "---"
+
+    # Get the raw letter type from the database (e.g., "FIN", "HR")
+    # Ensure 'letter_type_raw' is correctly fetched by database.py
+    raw_letter_type = letter_data['letter_type_raw'] 
+    
+    # Convert to Persian display name using the provided map
+    # Use .get() with a fallback to raw_letter_type in case the key is not found
+    # This makes it robust even if letter_types_map is None or incomplete
+    display_letter_type = letter_types_map.get(raw_letter_type, raw_letter_type) if letter_types_map else raw_letter_type
+
+    return (
+        letter_data['letter_code_persian'],
+        display_letter_type, # Use the converted Persian type
+        # Formatted from the numeric date here; letters it couldn't be read for keep their text
+        shamsi_date_display(letter_data['date_shamsi']) or letter_data['date_shamsi_persian'],
+        letter_data['subject'],
+        org_name,
+        contact_name,
+        letter_data.get('snippet') or ""
+    )
+
+_pagers = {}
+
+def _get_pager(history_treeview_ref):
+    pager = _pagers.get(str(history_treeview_ref))
+    if pager is None:
+        pager = ArchivePager(history_treeview_ref)
+        _pagers[str(history_treeview_ref)] = pager
+    return pager
+
+def update_history_treeview(search_term="", history_treeview_ref=None, status_bar_ref=None, letter_types_map=None, letters_changed=True):
     """
     Populates the letter history Treeview with data from the database.
     Now accepts letter_types_map to convert raw letter types to Persian display names.
+    A non-empty search_term goes through the full-text index (best matches first, unless a column was sorted),
+    and the matched body fragment is shown in the 'snippet' column.
+    Only the first page is loaded here; the rest is fetched on scroll by the Treeview's ArchivePager.
+    letters_changed reloads the facet counts even for the same search (False for a search typed by the user).
     """
     if history_treeview_ref: # Ensure history_treeview_ref is initialized
-        for item in history_treeview_ref.get_children():
-            history_treeview_ref.delete(item)
-
-        letters = get_letters_from_db(search_term=search_term)
+        pager = _get_pager(history_treeview_ref)
+        pager.status_bar_ref = status_bar_ref
+        pager.letter_types_map = letter_types_map
+        # Called again after letters were generated, so the counts of the same search may have changed
+        if letters_changed:
+            pager.invalidate_facets()
+        pager.reset(search_term)
 
-        for letter_data in letters:
-            org_name = letter_data['organization_name'] if letter_data['organization_name'] else "---"
-            contact_name = f"{letter_data['first_name']} {letter_data['last_name']}" if (letter_data['first_name'] and letter_data['last_name']) else "---"
-
-            # Get the raw letter type from the database (e.g., "FIN", "HR")
-            # Ensure 'letter_type_raw' is correctly fetched by database.py
-            raw_letter_type = letter_data['letter_type_raw'] 
-            
-            # Convert to Persian display name using the provided map
-            # Use .get() with a fallback to raw_letter_type in case the key is not found
-            # This makes it robust even if letter_types_map is None or incomplete
-            display_letter_type = letter_types_map.get(raw_letter_type, raw_letter_type) if letter_types_map else raw_letter_type
-
-            display_values = (
-                letter_data['letter_code_persian'],
-                display_letter_type, # Use the converted Persian type
-                letter_data['date_shamsi_persian'],
-                letter_data['subject'],
-                org_name,
-                contact_name
-            )
-            history_treeview_ref.insert("", tk.END, values=display_values, iid=letter_data['id'])
-        if status_bar_ref: status_bar_ref.config(text=f"نمایش {len(letters)} نامه.")
+def sort_history_treeview(history_treeview_ref, column):
+    """Column header click on the letter history Treeview: sorts the archive by that column in the query."""
+    _get_pager(history_treeview_ref).set_sort(column)
 
 
 def on_search_archive_button(search_entry_text, history_treeview_ref, status_bar_ref, letter_types_map=None):
     """Handles the search button click for archive tab."""
     # Pass letter_types_map to update_history_treeview
-    update_history_treeview(search_term=search_entry_text, history_treeview_ref=history_treeview_ref, status_bar_ref=status_bar_ref, letter_types_map=letter_types_map)
+    update_history_treeview(search_term=search_entry_text, history_treeview_ref=history_treeview_ref, status_bar_ref=status_bar_ref, letter_types_map=letter_types_map, letters_changed=False)
 
 def on_open_letter_button(history_treeview_ref, root_window_ref, status_bar_ref):
     """Opens the selected letter file."""
@@ -71,3 +279,190 @@ def on_open_letter_button(history_treeview_ref, root_window_ref, status_bar_ref)
     else:
         messagebox.showwarning("انتخاب نشده", "برای باز کردن یک نامه، ابتدا آن را از لیست انتخاب کنید.", parent=root_window_ref)
 
+
+
+def filter_history_treeview(history_treeview_ref, filters):
+    """Applies filters (database.LETTER_FILTER_KEYS) to the letter history Treeview's current search."""
+    _get_pager(history_treeview_ref).set_filters(filters)
+
+def get_history_query(history_treeview_ref):
+    """The search shown in the letter history Treeview, as keyword arguments for database.iter_letters."""
+    pager = _get_pager(history_treeview_ref)
+    return {'search_term': pager.search_term, 'filters': dict(pager.filters),
+            'sort_column': pager.sort_column, 'descending': pager.descending}
+
+
+ALL_CHOICE = "همه"
+
+class ArchiveFilterPanel(ttk.LabelFrame):
+    """
+    Filter controls of the archive tab: letter type, Shamsi date range (or a whole month), organization
+    and author. Every choice shows how many letters of the current search and filters it has, from the
+    facet counts the history Treeview's ArchivePager loads with each search.
+    Type, month, organization and author apply as soon as they are chosen; dates with "اعمال فیلتر" or Return.
+    """
+
+    def __init__(self, parent, history_treeview, letter_types_map=None, status_bar_ref=None):
+        super().__init__(parent, text="فیلترها", padding="5")
+        self.history_treeview = history_treeview
+        self.letter_types_map = letter_types_map or {}
+        self.status_bar_ref = status_bar_ref
+        self._facets = None
+        self._type = None
+        self._user_id = None
+        self._organization = None
+        self._users = []
+        self._unknown_user_ids = set()
+        # Combobox label -> filter value, rebuilt with the counts of each facet update
+        self._type_choices = {}
+        self._month_choices = {}
+        self._user_choices = {}
+
+        first_row = ttk.Frame(self)
+        first_row.pack(fill=tk.X, pady=2)
+        ttk.Label(first_row, text="نوع:").pack(side=tk.RIGHT, padx=5)
+        self.type_var = tk.StringVar(value=ALL_CHOICE)
+        self.combo_type = ttk.Combobox(first_row, textvariable=self.type_var, state="readonly", width=20)
+        self.combo_type.pack(side=tk.RIGHT, padx=5)
+        self.combo_type.bind("<<ComboboxSelected>>", lambda event: self._on_type_selected())
+
+        ttk.Label(first_row, text="ماه:").pack(side=tk.RIGHT, padx=5)
+        self.month_var = tk.StringVar(value=ALL_CHOICE)
+        self.combo_month = ttk.Combobox(first_row, textvariable=self.month_var, state="readonly", width=18)
+        self.combo_month.pack(side=tk.RIGHT, padx=5)
+        self.combo_month.bind("<<ComboboxSelected>>", lambda event: self._on_month_selected())
+
+        ttk.Label(first_row, text="از تاریخ:").pack(side=tk.RIGHT, padx=5)
+        self.entry_date_from = ttk.Entry(first_row, width=12, justify=tk.CENTER)
+        self.entry_date_from.pack(side=tk.RIGHT, padx=5)
+        ttk.Label(first_row, text="تا تاریخ:").pack(side=tk.RIGHT, padx=5)
+        self.entry_date_to = ttk.Entry(first_row, width=12, justify=tk.CENTER)
+        self.entry_date_to.pack(side=tk.RIGHT, padx=5)
+        for entry in (self.entry_date_from, self.entry_date_to):
+            entry.bind("<Return>", lambda event: self._on_dates_entered())
+
+        second_row = ttk.Frame(self)
+        second_row.pack(fill=tk.X, pady=2)
+        ttk.Label(second_row, text="سازمان:").pack(side=tk.RIGHT, padx=5)
+        self.organization_entry = AutocompleteEntry(second_row, get_organization_index(), self._on_organization_selected,
+                                                    lambda row: row['name'], width=25)
+        self.organization_entry.pack(side=tk.RIGHT, padx=5)
+
+        ttk.Label(second_row, text="نویسنده:").pack(side=tk.RIGHT, padx=5)
+        self.user_var = tk.StringVar(value=ALL_CHOICE)
+        self.combo_user = ttk.Combobox(second_row, textvariable=self.user_var, state="readonly", width=20)
+        self.combo_user.pack(side=tk.RIGHT, padx=5)
+        self.combo_user.bind("<<ComboboxSelected>>", lambda event: self._on_user_selected())
+
+        ttk.Button(second_row, text="اعمال فیلتر", command=self._on_dates_entered).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(second_row, text="حذف فیلترها", command=self.clear).pack(side=tk.RIGHT, padx=5)
+        self.total_label = ttk.Label(second_row, text="")
+        self.total_label.pack(side=tk.LEFT, padx=5)
+
+        self._show_facets(None)
+        self.reload_users()
+        _get_pager(history_treeview).on_facets = self._show_facets
+
+    def filters(self):
+        """The chosen filters as a dict for database.get_letters_page; raises ValueError for an invalid date."""
+        organization_name = self.organization_entry.get().strip()
+        filters = {
+            'type': self._type,
+            'date_from': self.entry_date_from.get().strip(),
+            'date_to': self.entry_date_to.get().strip(),
+            'organization_id': self._organization['id'] if self._organization and self._organization['name'] == organization_name else None,
+            'user_id': self._user_id,
+        }
+        for key in ('date_from', 'date_to'):
+            if filters[key]:
+                shamsi_date_number(filters[key])
+        return filters
+
+    def apply(self):
+        try:
+            filters = self.filters()
+        except ValueError as e:
+            messagebox.showerror("خطا در فیلتر", f"{e}\nتاریخ را به شکل ۱۴۰۳/۰۱/۰۱ وارد کنید.", parent=self)
+            return
+        filter_history_treeview(self.history_treeview, filters)
+
+    def clear(self):
+        self._type = None
+        self._user_id = None
+        self._organization = None
+        self.type_var.set(ALL_CHOICE)
+        self.month_var.set(ALL_CHOICE)
+        self.user_var.set(ALL_CHOICE)
+        self.entry_date_from.delete(0, tk.END)
+        self.entry_date_to.delete(0, tk.END)
+        self.organization_entry.entry.delete(0, tk.END)
+        self.apply()
+
+    def _on_type_selected(self):
+        self._type = self._type_choices.get(self.type_var.get())
+        self.apply()
+
+    def _on_month_selected(self):
+        month = self._month_choices.get(self.month_var.get())
+        self.entry_date_from.delete(0, tk.END)
+        self.entry_date_to.delete(0, tk.END)
+        if month:
+            # The first six months have 31 days, the rest 30 (29 for Esfand of a common year)
+            self.entry_date_from.insert(0, shamsi_date_display(month * 100 + 1))
+            self.entry_date_to.insert(0, shamsi_date_display(month * 100 + (31 if month % 100 <= 6 else 30)))
+        self.apply()
+
+    def _on_dates_entered(self):
+        # Typed dates replace the month shortcut
+        self.month_var.set(ALL_CHOICE)
+        self.apply()
+
+    def _on_organization_selected(self, organization):
+        self._organization = organization
+        self.organization_entry.entry.delete(0, tk.END)
+        self.organization_entry.entry.insert(0, organization['name'])
+        self.apply()
+
+    def _on_user_selected(self):
+        self._user_id = self._user_choices.get(self.user_var.get())
+        self.apply()
+
+    def reload_users(self):
+        """Loads the authors' list in the background. Done once, and again when the counts name an author not in it."""
+        run_query(f"archive-users:{self}", get_all_users, on_done=self._on_users_loaded,
+                  on_error=lambda error: print(f"DEBUG: Error loading users for the archive filter: {error}"))
+
+    def _on_users_loaded(self, users):
+        self._users = users
+        self._show_facets(self._facets)
+
+    def _show_facets(self, facets):
+        """Rebuilds the choices with the counts of facets (None before the first counts arrive)."""
+        if not self.winfo_exists():
+            return
+        self._facets = facets
+        counts = facets or {}
+        unknown_user_ids = set(counts.get('user_id', {})) - {user['id'] for user in self._users} - {None}
+        if self._users and unknown_user_ids and unknown_user_ids != self._unknown_user_ids:
+            # An author added since the list was loaded (a deleted one stays unknown: asked once)
+            self._unknown_user_ids = unknown_user_ids
+            self.reload_users()
+        selected_month = self._month_choices.get(self.month_var.get())
+
+        def _label(name, count):
+            return f"{name} ({convert_numbers_to_persian(str(count))})" if facets else str(name)
+
+        type_names = dict(self.letter_types_map)
+        type_names.update((raw_type, raw_type) for raw_type in counts.get('type', {}) if raw_type not in type_names)
+        self._type_choices = {_label(name, counts.get('type', {}).get(raw_type, 0)): raw_type for raw_type, name in type_names.items()}
+        self._month_choices = {_label(shamsi_date_display(month), count): month
+                               for month, count in sorted(counts.get('month', {}).items(), reverse=True) if month}
+        self._user_choices = {_label(user['username'], counts.get('user_id', {}).get(user['id'], 0)): user['id'] for user in self._users}
+
+        for combo, var, choices, selected in ((self.combo_type, self.type_var, self._type_choices, self._type),
+                                              (self.combo_month, self.month_var, self._month_choices, selected_month),
+                                              (self.combo_user, self.user_var, self._user_choices, self._user_id)):
+            combo.configure(values=[ALL_CHOICE] + list(choices))
+            if selected is not None:
+                var.set(next((label for label, value in choices.items() if value == selected), ALL_CHOICE))
+        self.total_label.config(text=f"تعداد نامه‌ها: {convert_numbers_to_persian(str(counts['total']))}" if facets else "")
@@ -0,0 +1,183 @@
+import bisect
+import heapq
+import tkinter as tk
+from tkinter import ttk
+
+from persian_text import search_words, search_tokens
+
+AUTOCOMPLETE_LIMIT = 10
+
+# Sorts after every character, so (prefix + _PREFIX_END,) bounds the keys starting with prefix
+_PREFIX_END = "\U0010ffff"
+
+
+class AutocompleteIndex:
+    """
+    In-memory word-prefix index over organizations or contacts, for the selection dialogs.
+
+    Every word of an entry's search text is kept, normalized (persian_text), in one sorted list of
+    (word, id); the entries matching a prefix are a contiguous slice found with bisect, so a lookup
+    costs O(log n) plus the matches, with no query. A search term matches an entry when each of its
+    words is the start of some word of the entry ("علی محم" finds "علی محمدی").
+
+    App.populate_org_contact_combos fills the index at startup and App.apply_crm_change keeps it
+    up to date one row at a time.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._keys = []
+        self._entries = {}
+
+    def build(self, entries):
+        """Replaces the contents with entries, an iterable of (id, search text, sort key, row)."""
+        self.clear()
+        for entity_id, text, sort_key, row in entries:
+            tokens = search_tokens(text)
+            self._entries[entity_id] = (sort_key, tokens, row)
+            self._keys.extend((token, entity_id) for token in tokens)
+        self._keys.sort()
+
+    def add(self, entity_id, text, sort_key, row):
+        """Adds an entry, replacing any entry with the same id."""
+        self.remove(entity_id)
+        tokens = search_tokens(text)
+        self._entries[entity_id] = (sort_key, tokens, row)
+        for token in tokens:
+            bisect.insort(self._keys, (token, entity_id))
+
+    def remove(self, entity_id):
+        entry = self._entries.pop(entity_id, None)
+        if entry is None:
+            return
+        for token in entry[1]:
+            position = bisect.bisect_left(self._keys, (token, entity_id))
+            if position < len(self._keys) and self._keys[position] == (token, entity_id):
+                del self._keys[position]
+
+    def get(self, entity_id):
+        entry = self._entries.get(entity_id)
+        return entry[2] if entry else None
+
+    def search(self, term, limit=AUTOCOMPLETE_LIMIT, accept=None):
+        """
+        Returns the rows matching term, ordered by their sort key; at most limit rows (None for all).
+        accept(row), if given, filters the matches further (e.g. to one organization).
+        """
+        words = search_words(term)
+        if words:
+            # Candidates come from the longest word, the one with the fewest keys starting with it
+            longest = max(words, key=len)
+            start = bisect.bisect_left(self._keys, (longest,))
+            end = bisect.bisect_left(self._keys, (longest + _PREFIX_END,), start)
+            candidates = {entity_id for _, entity_id in self._keys[start:end]}
+        else:
+            candidates = self._entries.keys()
+
+        matches = []
+        for entity_id in candidates:
+            sort_key, tokens, row = self._entries[entity_id]
+            if accept is not None and not accept(row):
+                continue
+            if all(any(token.startswith(word) for token in tokens) for word in words):
+                matches.append((sort_key, entity_id, row))
+        if limit is None:
+            matches.sort(key=lambda match: match[:2])
+        else:
+            matches = heapq.nsmallest(limit, matches, key=lambda match: match[:2])
+        return [row for _, _, row in matches]
+
+
+class AutocompleteEntry(tk.Frame):
+    """
+    An Entry with a dropdown of the best matches from an AutocompleteIndex, refreshed on every
+    keystroke. Down moves into the list; Return or a double click picks the highlighted row and
+    calls on_select(row); Escape closes the list. self.entry is the Entry (for LiveSearch etc.).
+    """
+
+    def __init__(self, master, index, on_select, display, limit=AUTOCOMPLETE_LIMIT, accept=None, **entry_options):
+        super().__init__(master)
+        self.index = index
+        self.on_select = on_select
+        self.display = display
+        self.limit = limit
+        self.accept = accept
+        self._rows = []
+
+        self.entry = ttk.Entry(self, **entry_options)
+        self.entry.pack(fill=tk.X, expand=True)
+        # The list belongs to the window, so it can be drawn over the widgets below the entry
+        self.listbox = tk.Listbox(self.winfo_toplevel(), height=limit, exportselection=False, justify=tk.RIGHT)
+
+        self.entry.bind("<KeyRelease>", self._on_key_release, add="+")
+        self.entry.bind("<Down>", self._focus_list, add="+")
+        self.entry.bind("<Escape>", lambda event: self.hide(), add="+")
+        self.entry.bind("<FocusOut>", lambda event: self.after(150, self._hide_unless_focused), add="+")
+        self.listbox.bind("<Return>", lambda event: self._select_highlighted())
+        self.listbox.bind("<Double-1>", lambda event: self._select_highlighted())
+        self.listbox.bind("<Escape>", lambda event: (self.hide(), self.entry.focus_set()))
+        self.listbox.bind("<FocusOut>", lambda event: self.after(150, self._hide_unless_focused), add="+")
+
+    def get(self):
+        return self.entry.get()
+
+    def _on_key_release(self, event):
+        if event.keysym in ("Down", "Up", "Escape", "Return", "Tab"):
+            return
+        self.refresh()
+
+    def refresh(self):
+        """Shows the matches for the current text (hides the list when the text is empty)."""
+        term = self.entry.get().strip()
+        self._rows = self.index.search(term, self.limit, self.accept) if term else []
+        self.listbox.delete(0, tk.END)
+        for row in self._rows:
+            self.listbox.insert(tk.END, self.display(row))
+        if not self._rows:
+            self.hide()
+            return
+        self.listbox.configure(height=len(self._rows))
+        self.listbox.place(in_=self.entry, relx=0, rely=1, relwidth=1, anchor=tk.NW)
+        self.listbox.lift()
+
+    def hide(self):
+        self.listbox.place_forget()
+
+    def _hide_unless_focused(self):
+        if self.winfo_exists() and self.focus_get() not in (self.entry, self.listbox):
+            self.hide()
+
+    def _focus_list(self, event):
+        if not self._rows:
+            return
+        self.listbox.focus_set()
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(0)
+        self.listbox.activate(0)
+        return "break"
+
+    def _select_highlighted(self):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        row = self._rows[selection[0]]
+        self.hide()
+        self.on_select(row)
+
+
+_organization_index = AutocompleteIndex()
+_contact_index = AutocompleteIndex()
+
+def get_organization_index():
+    """Organizations by name: rows {'id', 'name', 'industry'}."""
+    return _organization_index
+
+def get_contact_index():
+    """Contacts by first/last name, title and organization name: rows {'id', 'first_name', 'last_name', 'title', 'org_name', 'organization_id'}."""
+    return _contact_index
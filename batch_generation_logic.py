@@ -0,0 +1,360 @@
+import os
+import queue
+import threading
+import traceback
+import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tkinter import ttk, messagebox
+
+import jdatetime
+
+from connection_manager import release_connection
+from database import get_organization_names, get_contact_full_names, get_organizations_from_db, get_contacts_from_db
+from generation_pipeline import reserve_journaled_letters, write_letter_file, finalize_letters, abandon_letters
+from helpers import convert_numbers_to_persian
+from letter_generation_logic import generate_letter_number
+from query_executor import run_query
+from settings_manager import company_name, full_company_name
+import settings_manager
+
+# Rendering is CPU bound, so the pool leaves one core for the UI
+BATCH_MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Below this many letters starting worker processes costs more than it saves
+PROCESS_POOL_MIN_BATCH = 8
+PROGRESS_POLL_MS = 100
+
+
+def _letter_type_abbr(letter_type_display, letter_types_map):
+    for abbr, full_name in letter_types_map.items():
+        if full_name == letter_type_display:
+            return abbr
+    return "GEN"
+
+def generate_letters_batch(recipients, letter_type_display, letter_types_map, subject, body_content, save_path, letterhead_template, user_id, progress_callback=None, max_workers=BATCH_MAX_WORKERS):
+    """
+    Generates the same letter for many recipients.
+
+    recipients is a list of (organization_id, contact_id) pairs; either may be None.
+    The letter numbers for the whole batch are reserved and journaled in one transaction, the .docx
+    files are rendered in parallel across a process pool, and the Letters rows of every letter that
+    was rendered are inserted together with executemany.
+    progress_callback(done, total, recipient, error) is called after each letter, from the
+    calling thread. Returns {'generated': [letter dicts], 'failed': [(recipient, error message)]}.
+    A letter that fails to render gives its number back if no later number was used, otherwise the
+    gap is recorded as an abandoned journal entry.
+    """
+    if not recipients:
+        return {'generated': [], 'failed': []}
+    if not letterhead_template or not os.path.exists(letterhead_template):
+        raise FileNotFoundError("مسیر فایل الگوی سربرگ (Word) در تنظیمات مشخص نشده یا فایل وجود ندارد.")
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    org_names = get_organization_names(org_id for org_id, _ in recipients)
+    contact_names = get_contact_full_names(contact_id for _, contact_id in recipients)
+
+    today_j = jdatetime.date.today()
+    date_shamsi_persian = convert_numbers_to_persian(f"{today_j.year}/{today_j.month:02d}/{today_j.day:02d}")
+    letter_type_abbr = _letter_type_abbr(letter_type_display, letter_types_map)
+    file_name_subject = "".join(c for c in subject if c.isalnum() or c in (' ', '-', '_')).strip()
+
+    def _build_letter(index, sequence_number):
+        organization_id, contact_id = recipients[index]
+        letter_code, letter_code_persian = generate_letter_number(letter_type_display, letter_types_map, sequence_number)
+        return {
+            'recipient': (organization_id, contact_id),
+            'letter_code_prefix': company_name,
+            'letter_code_number': sequence_number,
+            'letter_code_persian': letter_code_persian,
+            'type': letter_type_abbr,
+            'date_shamsi_persian': date_shamsi_persian,
+            'subject': subject,
+            'body': body_content,
+            'organization_id': organization_id,
+            'contact_id': contact_id,
+            'file_path': os.path.join(save_path, f"{letter_code} - {file_name_subject}.docx"),
+            'user_id': user_id,
+            'replacements': {
+                "[[DATE]]": date_shamsi_persian,
+                "[[CODE]]": letter_code_persian,
+                "[[ORGANIZATION_NAME]]": org_names.get(organization_id, ""),
+                "[[CONTACT_NAME]]": contact_names.get(contact_id, ""),
+                "[[SUBJECT]]": subject,
+                "[[BODY]]": body_content,
+                "[[COMPANY_NAME]]": full_company_name
+            },
+        }
+
+    # Numbers and journal rows for the whole batch in one transaction; after a crash the
+    # startup recovery finishes whatever letters were not stored yet (see generation_pipeline)
+    letters = reserve_journaled_letters(company_name, today_j.year, len(recipients), _build_letter, letterhead_template, settings_manager.docx_render_backend)
+
+    rendered = []
+    failed = []
+    failed_letters = []
+    total = len(letters)
+
+    def _finished(letter, error):
+        if error is None:
+            rendered.append(letter)
+        else:
+            failed.append((letter['recipient'], str(error)))
+            failed_letters.append((letter, error))
+        if progress_callback:
+            progress_callback(len(rendered) + len(failed), total, letter['recipient'], error)
+
+    if total < PROCESS_POOL_MIN_BATCH or max_workers <= 1:
+        for letter in letters:
+            try:
+                write_letter_file(letter)
+                _finished(letter, None)
+            except Exception as e:
+                _finished(letter, e)
+    else:
+        # Each worker process compiles the template once (docx_template's cache) and reuses it
+        with ProcessPoolExecutor(max_workers=min(max_workers, total)) as pool:
+            futures = {pool.submit(write_letter_file, letter): letter for letter in letters}
+            for future in as_completed(futures):
+                _finished(futures[future], future.exception())
+
+    if failed_letters:
+        abandon_letters(failed_letters)
+
+    # Keep the archive in the order of the letter numbers
+    rendered.sort(key=lambda letter: letter['letter_code_number'])
+    try:
+        finalize_letters(rendered)
+    except Exception as e:
+        # The files are complete and still journaled, so the next startup recovery stores them
+        traceback.print_exc()
+        for letter in rendered:
+            failed.append((letter['recipient'], f"ذخیره در پایگاه داده ناموفق بود (در اجرای بعدی برنامه بازیابی می‌شود): {e}"))
+        rendered = []
+
+    return {'generated': rendered, 'failed': failed}
+
+
+class BatchGenerationDialog(tk.Toplevel):
+    """
+    Picks the recipients for a batch of letters and runs generate_letters_batch on a background thread.
+    Every selected contact gets a letter; a selected organization with none of its contacts
+    selected gets one letter addressed to the organization itself.
+    """
+
+    def __init__(self, parent, letter_type_display, letter_types_map, subject, body_content, save_path, letterhead_template, user_id, status_bar_ref=None, on_finished_callback=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.letter_type_display = letter_type_display
+        self.letter_types_map = letter_types_map
+        self.subject = subject
+        self.body_content = body_content
+        self.save_path = save_path
+        self.letterhead_template = letterhead_template
+        self.user_id = user_id
+        self.status_bar_ref = status_bar_ref
+        self.on_finished_callback = on_finished_callback
+
+        self.contacts_by_org = {}
+        self._progress_queue = queue.Queue()
+        self._worker = None
+
+        self.title("تولید گروهی نامه")
+        self.geometry("800x600")
+        self.transient(parent)
+        self.grab_set()
+        self._center_window()
+
+        self._create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self._load_recipients()
+
+    def _center_window(self):
+        self.update_idletasks()
+        x = self.parent.winfo_x() + (self.parent.winfo_width() // 2) - (self.winfo_width() // 2)
+        y = self.parent.winfo_y() + (self.parent.winfo_height() // 2) - (self.winfo_height() // 2)
+        self.geometry(f"+{x}+{y}")
+
+    def _create_widgets(self):
+        main_frame = ttk.Frame(self, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(main_frame, text=f"موضوع نامه: {self.subject}").pack(anchor=tk.E, pady=2)
+        ttk.Label(main_frame, text="سازمان‌ها و مخاطبین گیرنده را انتخاب کنید (انتخاب چندتایی با Ctrl/Shift):").pack(anchor=tk.E, pady=2)
+
+        lists_frame = ttk.Frame(main_frame)
+        lists_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        self.org_treeview = ttk.Treeview(lists_frame, columns=("id", "name"), show="headings", selectmode="extended")
+        self.org_treeview.heading("id", text="شناسه")
+        self.org_treeview.heading("name", text="نام سازمان")
+        self.org_treeview.column("id", width=50, stretch=tk.NO)
+        self.org_treeview.column("name", width=200)
+        self.org_treeview.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=5)
+        self.org_treeview.bind("<<TreeviewSelect>>", self._on_org_selection_changed)
+
+        self.contact_treeview = ttk.Treeview(lists_frame, columns=("id", "name", "title", "org_name"), show="headings", selectmode="extended")
+        self.contact_treeview.heading("id", text="شناسه")
+        self.contact_treeview.heading("name", text="نام مخاطب")
+        self.contact_treeview.heading("title", text="عنوان")
+        self.contact_treeview.heading("org_name", text="سازمان")
+        self.contact_treeview.column("id", width=50, stretch=tk.NO)
+        self.contact_treeview.column("name", width=150)
+        self.contact_treeview.column("title", width=100)
+        self.contact_treeview.column("org_name", width=150)
+        self.contact_treeview.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=5)
+        self.contact_treeview.bind("<<TreeviewSelect>>", lambda event: self._update_count())
+
+        self.count_label = ttk.Label(main_frame, text="تعداد نامه‌ها: ۰")
+        self.count_label.pack(anchor=tk.E, pady=2)
+
+        self.progressbar = ttk.Progressbar(main_frame, orient="horizontal", mode="determinate")
+        self.progressbar.pack(fill=tk.X, pady=5)
+        self.progress_label = ttk.Label(main_frame, text="")
+        self.progress_label.pack(anchor=tk.E)
+
+        ttk.Label(main_frame, text="خطاها:").pack(anchor=tk.E)
+        self.failures_listbox = tk.Listbox(main_frame, height=5)
+        self.failures_listbox.pack(fill=tk.X, pady=5)
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=5)
+        self.btn_start = ttk.Button(button_frame, text="شروع تولید", command=self._on_start)
+        self.btn_start.pack(side=tk.LEFT, padx=5)
+        self.btn_close = ttk.Button(button_frame, text="بستن", command=self._on_close)
+        self.btn_close.pack(side=tk.LEFT, padx=5)
+
+    def _load_recipients(self):
+        def _fetch():
+            return get_organizations_from_db(), get_contacts_from_db()
+
+        def _render(result):
+            if not self.winfo_exists():
+                return
+            organizations, contacts = result
+            for org in organizations:
+                self.org_treeview.insert("", tk.END, iid=str(org['id']), values=(org['id'], org['name']))
+            for contact in contacts:
+                self.contacts_by_org.setdefault(contact['organization_id'], []).append(contact)
+
+        run_query("batch_recipients", _fetch, on_done=_render)
+
+    def _on_org_selection_changed(self, event=None):
+        # Show the contacts of the selected organizations, all selected by default
+        self.contact_treeview.delete(*self.contact_treeview.get_children())
+        for org_iid in self.org_treeview.selection():
+            for contact in self.contacts_by_org.get(int(org_iid), []):
+                self.contact_treeview.insert("", tk.END, iid=str(contact['id']), values=(
+                    contact['id'], f"{contact['first_name']} {contact['last_name']}", contact['title'], contact['organization_name']
+                ))
+        self.contact_treeview.selection_set(self.contact_treeview.get_children())
+        self._update_count()
+
+    def get_recipients(self):
+        """Returns the (organization_id, contact_id) pairs for the current selection."""
+        selected_contacts = {int(iid) for iid in self.contact_treeview.selection()}
+        recipients = []
+        for org_iid in self.org_treeview.selection():
+            org_id = int(org_iid)
+            org_contact_ids = [contact['id'] for contact in self.contacts_by_org.get(org_id, []) if contact['id'] in selected_contacts]
+            if org_contact_ids:
+                recipients.extend((org_id, contact_id) for contact_id in org_contact_ids)
+            else:
+                recipients.append((org_id, None))
+        return recipients
+
+    def _update_count(self):
+        self.count_label.config(text=f"تعداد نامه‌ها: {convert_numbers_to_persian(str(len(self.get_recipients())))}")
+
+    def _on_start(self):
+        recipients = self.get_recipients()
+        if not recipients:
+            messagebox.showwarning("انتخاب گیرنده", "لطفاً حداقل یک سازمان یا مخاطب را انتخاب کنید.", parent=self)
+            return
+        if not messagebox.askyesno("تایید", f"{convert_numbers_to_persian(str(len(recipients)))} نامه تولید شود؟", parent=self):
+            return
+
+        self.btn_start.config(state="disabled")
+        self.btn_close.config(state="disabled")
+        self.failures_listbox.delete(0, tk.END)
+        self.progressbar.config(maximum=len(recipients), value=0)
+        self.progress_label.config(text="در حال رزرو شماره نامه‌ها...")
+
+        self._worker = threading.Thread(target=self._run_batch, args=(recipients,), name="batch-generation", daemon=True)
+        self._worker.start()
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _run_batch(self, recipients):
+        # Runs on the worker thread; everything for the UI goes through _progress_queue
+        try:
+            result = generate_letters_batch(
+                recipients, self.letter_type_display, self.letter_types_map, self.subject, self.body_content,
+                self.save_path, self.letterhead_template, self.user_id,
+                progress_callback=lambda done, total, recipient, error: self._progress_queue.put(('progress', done, total, recipient, error))
+            )
+            self._progress_queue.put(('done', result))
+        except Exception as e:
+            traceback.print_exc()
+            self._progress_queue.put(('error', e))
+        finally:
+            release_connection()
+
+    def _recipient_label(self, recipient):
+        organization_id, contact_id = recipient
+        if contact_id is not None and self.contact_treeview.exists(str(contact_id)):
+            return self.contact_treeview.item(str(contact_id), 'values')[1]
+        if self.org_treeview.exists(str(organization_id)):
+            return self.org_treeview.item(str(organization_id), 'values')[1]
+        return str(recipient)
+
+    def _poll_progress(self):
+        if not self.winfo_exists():
+            return
+        while True:
+            try:
+                message = self._progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                _, done, total, recipient, error = message
+                self.progressbar.config(value=done)
+                self.progress_label.config(text=f"{convert_numbers_to_persian(str(done))} از {convert_numbers_to_persian(str(total))} نامه پردازش شد")
+                if error is not None:
+                    self.failures_listbox.insert(tk.END, f"{self._recipient_label(recipient)}: {error}")
+            elif message[0] == 'done':
+                self._on_batch_finished(message[1])
+                return
+            elif message[0] == 'error':
+                self._on_batch_finished(None, message[1])
+                return
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _on_batch_finished(self, result, error=None):
+        self.btn_start.config(state="normal")
+        self.btn_close.config(state="normal")
+        self._worker = None
+        if error is not None:
+            self.progress_label.config(text="تولید گروهی متوقف شد.")
+            messagebox.showerror("خطا در تولید گروهی", f"خطایی در تولید گروهی نامه‌ها رخ داد: {error}", parent=self)
+            return
+
+        generated, failed = len(result['generated']), len(result['failed'])
+        summary = f"{convert_numbers_to_persian(str(generated))} نامه تولید شد، {convert_numbers_to_persian(str(failed))} مورد ناموفق."
+        self.progress_label.config(text=summary)
+        if self.status_bar_ref:
+            self.status_bar_ref.config(text=f"تولید گروهی: {summary}")
+        if failed:
+            # Failures after rendering (e.g. the database insert) weren't reported per item yet
+            listed = self.failures_listbox.size()
+            for recipient, message in result['failed'][listed:]:
+                self.failures_listbox.insert(tk.END, f"{self._recipient_label(recipient)}: {message}")
+            messagebox.showwarning("تولید گروهی", summary, parent=self)
+        else:
+            messagebox.showinfo("تولید گروهی", summary, parent=self)
+        if self.on_finished_callback:
+            self.on_finished_callback()
+
+    def _on_close(self):
+        if self._worker is not None:
+            messagebox.showwarning("تولید گروهی", "تا پایان تولید نامه‌ها صبر کنید.", parent=self)
+            return
+        self.destroy()
@@ -0,0 +1 @@
+"""Performance benchmarks. Run a benchmark module with `python -m benchmarks.<name>` from the project root."""
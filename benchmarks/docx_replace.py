@@ -0,0 +1,128 @@
+"""
+Compares helpers.replace_text_in_docx with the per-placeholder implementation it replaced.
+
+    python -m benchmarks.docx_replace [--paragraphs 2000] [--repeat 3]
+
+Builds a synthetic letter with body paragraphs, a table and a header, with some placeholders
+split across differently formatted runs (as Word does after editing), then times both
+functions on copies of it and checks that the text matches and formatting survives.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from docx import Document
+
+from helpers import replace_text_in_docx
+
+PLACEHOLDERS = ["[[DATE]]", "[[CODE]]", "[[ORGANIZATION_NAME]]", "[[CONTACT_NAME]]", "[[SUBJECT]]", "[[BODY]]", "[[COMPANY_NAME]]"]
+
+
+def legacy_replace_text_in_docx(doc_path, replacements):
+    """The previous helpers.replace_text_in_docx (paragraphs x placeholders, rewrites paragraph.text)."""
+    document = Document(doc_path)
+
+    def _replace_in_paragraph(paragraph, replacements_dict):
+        full_text = paragraph.text
+        for old_text, new_text in replacements_dict.items():
+            if old_text in full_text:
+                for run in paragraph.runs:
+                    if old_text in run.text:
+                        run.text = run.text.replace(old_text, new_text)
+                paragraph.text = paragraph.text.replace(old_text, new_text)
+
+    for paragraph in document.paragraphs:
+        _replace_in_paragraph(paragraph, replacements)
+    for table in document.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    _replace_in_paragraph(paragraph, replacements)
+    for section in document.sections:
+        for part in (section.header, section.footer):
+            for paragraph in part.paragraphs:
+                _replace_in_paragraph(paragraph, replacements)
+            for table in part.tables:
+                for row in table.rows:
+                    for cell in row.cells:
+                        for paragraph in cell.paragraphs:
+                            _replace_in_paragraph(paragraph, replacements)
+    document.save(doc_path)
+    return True
+
+
+def build_sample_document(path, paragraph_count):
+    document = Document()
+    document.sections[0].header.paragraphs[0].add_run("[[COMPANY_NAME]] - ").bold = True
+    document.sections[0].header.paragraphs[0].add_run("[[CODE]]")
+
+    for i in range(paragraph_count):
+        paragraph = document.add_paragraph()
+        if i % 10 == 0:
+            # Placeholder split over three runs with different formatting
+            paragraph.add_run("تاریخ: [[DA")
+            paragraph.add_run("TE").italic = True
+            paragraph.add_run("]] شماره: [[CODE]]").bold = True
+        elif i % 10 == 5:
+            paragraph.add_run(f"بند {i}: ")
+            paragraph.add_run("[[ORGANIZATION_NAME]]").bold = True
+            paragraph.add_run(" / [[CONTACT_NAME]]")
+        else:
+            paragraph.add_run(f"متن ثابت نامه، بند شماره {i} بدون جای‌نگهدار. " * 3)
+
+    table = document.add_table(rows=3, cols=2)
+    for row in table.rows:
+        row.cells[0].paragraphs[0].add_run("[[SUBJECT]]").underline = True
+        row.cells[1].paragraphs[0].add_run("[[BODY]]")
+    document.save(path)
+
+
+def formatted_run_count(path):
+    document = Document(path)
+    return sum(1 for paragraph in document.paragraphs for run in paragraph.runs if run.bold or run.italic)
+
+
+def all_text(path):
+    document = Document(path)
+    texts = [paragraph.text for paragraph in document.paragraphs]
+    texts += [cell.text for table in document.tables for row in table.rows for cell in row.cells]
+    texts += [paragraph.text for paragraph in document.sections[0].header.paragraphs]
+    return texts
+
+
+def time_function(func, source_path, work_dir, replacements, repeat):
+    timings = []
+    for i in range(repeat):
+        target = os.path.join(work_dir, f"{func.__name__}_{i}.docx")
+        shutil.copyfile(source_path, target)
+        started = time.perf_counter()
+        func(target, replacements)
+        timings.append(time.perf_counter() - started)
+    return min(timings), target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    replacements = {placeholder: f"<{placeholder.strip('[]').lower()}>" for placeholder in PLACEHOLDERS}
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_path = os.path.join(work_dir, "sample.docx")
+        build_sample_document(source_path, args.paragraphs)
+
+        legacy_time, legacy_output = time_function(legacy_replace_text_in_docx, source_path, work_dir, replacements, args.repeat)
+        new_time, new_output = time_function(replace_text_in_docx, source_path, work_dir, replacements, args.repeat)
+
+        leftover = [text for text in all_text(new_output) if "[[" in text]
+        print(f"paragraphs: {args.paragraphs}, placeholders: {len(PLACEHOLDERS)}, best of {args.repeat}")
+        print(f"legacy replace_text_in_docx: {legacy_time * 1000:8.1f} ms, formatted runs kept: {formatted_run_count(legacy_output)}")
+        print(f"replace_text_in_docx:        {new_time * 1000:8.1f} ms, formatted runs kept: {formatted_run_count(new_output)}")
+        print(f"speedup: {legacy_time / new_time:.2f}x, same text: {all_text(legacy_output) == all_text(new_output)}, unreplaced placeholders: {len(leftover)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Checks the query plans of the application's hot queries.
+
+    python -m benchmarks.query_plans [--verbose]
+    python -m pytest tests/test_query_plans.py
+
+Builds a scratch database with the current schema (schema_migrations), calls each function in
+HOT_QUERIES against it, records the statements it runs (query_stats.record_statements) and runs
+EXPLAIN QUERY PLAN for each of them with the parameters it was given. A query regresses if its plan
+scans a whole table without an index or sorts in a temporary B-tree. tests/test_query_plans.py
+fails on a regression; this script lists the plans and exits with status 1 on one.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from connection_manager import get_connection, set_database_path, get_database_path, close_all_connections
+from database import (ARCHIVE_SORT_KEYS, ORGANIZATION_SORT_KEYS, CONTACT_SORT_KEYS, get_letters_page, iter_letters, get_letter_facets,
+                      get_letters_from_db, get_letter_by_code, peek_next_letter_number, claim_expired_journal_entries, renew_journal_leases,
+                      get_organizations_from_db, get_organization_choices, get_organization_names, get_organization_name_keys,
+                      get_contacts_from_db, get_contact_choices, get_contact_full_names, get_contact_name_keys, insert_contacts_bulk,
+                      get_all_users, get_user_by_username, _load_organization, _load_contact, _load_user)
+from query_stats import record_statements, _EXPLAINABLE
+from schema_migrations import migrate_database
+
+_SEARCH = "قرارداد"
+# Search results are only the matching rows; sorting those is accepted
+_SEARCH_SORT = ("USE TEMP B-TREE FOR ORDER BY",)
+
+
+def _trigger_lookup(trigger):
+    """Runs the Letters lookup in the body of trigger as the scratch database's schema has it (NEW.id / OLD.id bound to 1)."""
+    def call():
+        body = get_connection().execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (trigger,)).fetchone()[0]
+        lookup = re.search(r"SELECT id FROM Letters WHERE \w+ = (?:NEW|OLD)\.id", body).group(0)
+        get_connection().execute(re.sub(r"(?:NEW|OLD)\.id", "?", lookup), (1,)).fetchall()
+    return call
+
+# (name, where the query lives, function that runs it, plan patterns that are accepted for it)
+HOT_QUERIES = [
+    ("archive first page", "database.get_letters_page", lambda: get_letters_page(), ()),
+    ("archive next page", "database.get_letters_page", lambda: get_letters_page(after=(14030101, 1000)), ()),
+    ("archive full list", "database.get_letters_from_db", lambda: get_letters_from_db(), ()),
+    ("archive export", "database.iter_letters", lambda: list(iter_letters()), ()),
+    # Results are ordered by relevance, which only exists once the matches are found
+    ("archive full-text search", "database.get_letters_page", lambda: get_letters_page(_SEARCH), _SEARCH_SORT),
+    ("archive full-text search, next page", "database.get_letters_page", lambda: get_letters_page(_SEARCH, after=(-1.5, 1000)), _SEARCH_SORT),
+    ("archive export of a full-text search", "database.iter_letters", lambda: list(iter_letters(_SEARCH)), _SEARCH_SORT),
+    ("archive search without full-text index", "database.get_letters_from_db", lambda: get_letters_from_db(_SEARCH), _SEARCH_SORT),
+    ("letter by code", "database.get_letter_by_code", lambda: get_letter_by_code("NGRR-FIN-1403-001"), ()),
+    ("letters of an organization (renamed)", "trigger trg_organizations_fts_update", _trigger_lookup("trg_organizations_fts_update"), ()),
+    ("letters of an organization (deleted)", "trigger trg_organizations_fts_delete", _trigger_lookup("trg_organizations_fts_delete"), ()),
+    ("letters of a contact (renamed)", "trigger trg_contacts_fts_update", _trigger_lookup("trg_contacts_fts_update"), ()),
+    ("letters of a contact (deleted)", "trigger trg_contacts_fts_delete", _trigger_lookup("trg_contacts_fts_delete"), ()),
+    ("next letter number", "database.peek_next_letter_number", lambda: peek_next_letter_number("NGRR", 1403), ()),
+    # Rows of two states (pending, recovering) are merged into number order; only the unfinished letters are read
+    ("expired journal entries", "database.claim_expired_journal_entries", lambda: claim_expired_journal_entries(), _SEARCH_SORT),
+    ("journal lease renewal", "database.renew_journal_leases", lambda: renew_journal_leases(), ()),
+    ("organization search", "database.get_organizations_from_db", lambda: get_organizations_from_db("پارس"), _SEARCH_SORT),
+    ("organization names", "database.get_organization_choices", lambda: get_organization_choices(), ()),
+    ("organization names by id", "database.get_organization_names", lambda: get_organization_names([1, 2]), ()),
+    ("organization by id", "database.get_organization_by_id", lambda: _load_organization(1), ()),
+    ("contacts of an organization", "database.get_contacts_from_db", lambda: get_contacts_from_db(organization_id=1), ()),
+    ("contact search", "database.get_contacts_from_db", lambda: get_contacts_from_db(search_term="علی"), _SEARCH_SORT),
+    ("contact names", "database.get_contact_choices", lambda: get_contact_choices(), ()),
+    ("contact names by id", "database.get_contact_full_names", lambda: get_contact_full_names([1, 2]), ()),
+    ("contact by id", "database.get_contact_by_id", lambda: _load_contact(1), ()),
+    ("organization names for import", "database.get_organization_name_keys", lambda: get_organization_name_keys(), ()),
+    # Read once per import, to find the contacts already in the database
+    ("contact names for import", "database.get_contact_name_keys", lambda: get_contact_name_keys(), ("SCAN C",)),
+    # Looks up the organization of each contact that names one
+    ("contacts import", "database.insert_contacts_bulk",
+     lambda: insert_contacts_bulk([{'organization_id': None, 'organization_name': "پارس", 'first_name': "علی", 'last_name': "رضایی"}],
+                                  [{'name': "پارس"}]), ()),
+    ("user list", "database.get_all_users", lambda: get_all_users(), ()),
+    ("user by name", "database.get_user_by_username, verify_password", lambda: get_user_by_username("admin"), ()),
+    ("user by id", "database.get_user_by_id", lambda: _load_user(1), ()),
+]
+
+# Column header sorts (database.get_letters_page, get_organizations_from_db, get_contacts_from_db).
+# The CRM lists read their whole table, so a scan is expected there, and sorting it by a column
+# without an index is accepted; so is sorting the archive by a joined table's name.
+_JOIN_SORTS = {"organization", "contact"}
+_UNINDEXED_CRM_SORTS = {"organization_id", "phone", "email", "address", "description", "notes"}
+# idx_contacts_first_name carries more columns than the sort, so only same-name ties are sorted
+_PARTLY_INDEXED_CRM_SORTS = {"first_name": ("USE TEMP B-TREE FOR RIGHT PART OF ORDER BY",)}
+
+def _crm_sort_accepted(table_scan, column):
+    accepted = (table_scan,) + _PARTLY_INDEXED_CRM_SORTS.get(column, ())
+    return accepted + _SEARCH_SORT if column in _UNINDEXED_CRM_SORTS else accepted
+
+for _column, _keys in ARCHIVE_SORT_KEYS.items():
+    HOT_QUERIES.append((
+        f"archive sorted by {_column}", "database.get_letters_page",
+        lambda column=_column, keys=_keys: get_letters_page(sort_column=column, after=(0,) * (len(keys) + 1)),
+        _SEARCH_SORT if _column in _JOIN_SORTS else ()))
+    HOT_QUERIES.append((
+        f"archive full-text search sorted by {_column}", "database.get_letters_page",
+        lambda column=_column: get_letters_page(_SEARCH, sort_column=column), _SEARCH_SORT))
+
+for _column in ORGANIZATION_SORT_KEYS:
+    HOT_QUERIES.append((
+        f"organizations sorted by {_column}", "database.get_organizations_from_db",
+        lambda column=_column: get_organizations_from_db(sort_column=column), _crm_sort_accepted("SCAN Organizations", _column)))
+
+for _column in CONTACT_SORT_KEYS:
+    HOT_QUERIES.append((
+        f"contacts sorted by {_column}", "database.get_contacts_from_db",
+        lambda column=_column: get_contacts_from_db(sort_column=column), _crm_sort_accepted("SCAN C", _column)))
+
+# Archive filters (database.get_letters_page with filters), newest first, and their facet counts
+# (database.get_letter_facets), which group the matching letters: the groups are sorted, and without
+# a filter every letter is read.
+_FILTERS = {
+    "type": {'type': "FIN"},
+    "date range": {'date_from': "1403/01/01", 'date_to': "1403/06/31"},
+    "organization": {'organization_id': 1},
+    "author": {'user_id': 1},
+    "type and author": {'type': "FIN", 'user_id': 1},
+}
+_FACET_SORT = ("SCAN Matched", "USE TEMP B-TREE FOR GROUP BY")
+
+for _name, _filters in _FILTERS.items():
+    HOT_QUERIES.append((f"archive filtered by {_name}", "database.get_letters_page", lambda filters=_filters: get_letters_page(filters=filters), ()))
+    HOT_QUERIES.append((f"archive facets filtered by {_name}", "database.get_letter_facets", lambda filters=_filters: get_letter_facets(filters=filters), _FACET_SORT))
+HOT_QUERIES.append(("archive facets", "database.get_letter_facets", lambda: get_letter_facets(), _FACET_SORT + ("SCAN L",)))
+HOT_QUERIES.append(("archive facets of a full-text search", "database.get_letter_facets", lambda: get_letter_facets(_SEARCH, {'type': "FIN"}), _FACET_SORT))
+
+# A table scanned without an index ("SCAN L"), or a sort the query pays for on every run
+_REGRESSION_PATTERNS = (re.compile(r"^SCAN \w+$"), re.compile(r"USE TEMP B-TREE"))
+
+
+# Schema lookups (letters_fts_available) and PRAGMAs (the entity cache) are not checked
+_SCHEMA_TABLE = re.compile(r"\bsqlite_master\b")
+
+
+def query_plan(sql, params):
+    if params is None:
+        # executemany: the plan doesn't depend on the values
+        params = (None,) * sql.count("?")
+    rows = get_connection().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row['detail'] for row in rows]
+
+def recorded_queries(call):
+    """Calls call() and returns the (sql, parameters) of the checked statements it ran."""
+    with record_statements() as statements:
+        call()
+    return [(sql, params) for sql, params in statements
+            if sql.lstrip().upper().startswith(_EXPLAINABLE) and not _SCHEMA_TABLE.search(sql)]
+
+def plan_regressions(plan, accepted):
+    return [step for step in plan
+            if any(pattern.search(step) for pattern in _REGRESSION_PATTERNS)
+            and not any(accepted_step in step for accepted_step in accepted)]
+
+def hot_query_regressions(source, call, accepted):
+    """Runs one HOT_QUERIES entry; returns (the plans of its statements, the offending steps)."""
+    queries = recorded_queries(call)
+    if not queries:
+        return [], [f"{source} ran no query"]
+    plan = [step for sql, params in queries for step in query_plan(sql, params)]
+    return plan, plan_regressions(plan, accepted)
+
+def check_query_plans(verbose=False):
+    """Returns {query name: [offending plan steps]} for the queries whose plans regressed."""
+    failures = {}
+    for name, source, call, accepted in HOT_QUERIES:
+        plan, regressions = hot_query_regressions(source, call, accepted)
+        if regressions:
+            failures[name] = regressions
+        if verbose or regressions:
+            print(f"{'FAIL' if regressions else 'ok  '}  {name}  ({source})")
+            for step in plan or regressions:
+                print(f"        {step}")
+    return failures
+
+
+@contextmanager
+def scratch_database(path):
+    """Points the connections at a new database at path with the current schema for the duration of the block."""
+    previous_database = get_database_path()
+    set_database_path(path)
+    try:
+        migrate_database()
+        yield
+    finally:
+        close_all_connections()
+        set_database_path(previous_database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not only the regressions")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir, scratch_database(os.path.join(work_dir, "plans.db")):
+        failures = check_query_plans(args.verbose)
+
+    print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} query plans use indexes")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
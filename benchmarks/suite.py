@@ -0,0 +1,249 @@
+"""
+Times the application's database, numbering, document and Treeview code on a synthetic dataset
+and writes the results as JSON, so runs can be compared across releases.
+
+    python -m benchmarks.suite [--database bench.db] [--output results.json] [--repeat 5]
+                               [--organizations 500] [--contacts 5000] [--users 20] [--letters 50000]
+
+Without --database the dataset is generated (benchmarks.synthetic_data) in a temporary directory;
+with it, an existing file is reused as is and a missing one is generated there first. Benchmarks
+that write (insert_letter, import_organizations) add rows to that database; the letter numbers
+reserve_journaled_letters takes are given back afterwards.
+
+The Treeview benchmarks need a display; without one they are reported as skipped.
+Each result holds the best, median, mean and worst time in milliseconds over --repeat runs.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tkinter as tk
+from datetime import datetime
+from tkinter import ttk
+
+import archive_logic
+import crm_logic
+import crm_import_logic
+from archive_export_logic import export_letters
+from connection_manager import set_database_path, get_connection, close_all_connections
+from database import get_letters_from_db, get_contacts_from_db, get_letters_page, get_letter_facets, insert_letter
+from docx_template import RENDER_BACKEND_PYTHON_DOCX
+from helpers import replace_text_in_docx, convert_numbers_to_persian
+from letter_generation_logic import generate_letter_number
+from generation_pipeline import reserve_journaled_letters, abandon_letters
+from schema_migrations import migrate_database
+from benchmarks.docx_replace import build_sample_document, PLACEHOLDERS
+from benchmarks.synthetic_data import populate_database, add_dataset_arguments, COMPANY_PREFIX
+
+LETTER_TYPES_MAP = {"FIN": "مالی", "HR": "منابع انسانی", "GEN": "عمومی"}
+
+
+def time_benchmark(func, repeat, setup=None):
+    """Runs setup() (untimed) and then func(setup's result) repeat times; returns the timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        func(argument) if setup else func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def summarize(name, timings, **details):
+    result = {
+        'name': name,
+        'repeat': len(timings),
+        'min_ms': min(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+    }
+    result.update(details)
+    return result
+
+
+def database_benchmarks(repeat):
+    first_organization_id = get_connection().execute("SELECT MIN(organization_id) FROM Contacts").fetchone()[0]
+    results = [
+        summarize("get_letters_from_db", time_benchmark(get_letters_from_db, repeat)),
+        summarize("get_letters_from_db (search)", time_benchmark(lambda: get_letters_from_db("قرارداد"), repeat)),
+        summarize("get_letters_page (first page)", time_benchmark(get_letters_page, repeat)),
+        summarize("get_letters_page (full-text search)", time_benchmark(lambda: get_letters_page("قرارداد"), repeat)),
+        summarize("get_letters_page (filtered)", time_benchmark(lambda: get_letters_page(filters={'type': "FIN", 'date_from': "1402/01/01"}), repeat)),
+        summarize("get_letter_facets", time_benchmark(get_letter_facets, repeat)),
+        summarize("get_letter_facets (full-text search)", time_benchmark(lambda: get_letter_facets("قرارداد"), repeat)),
+        summarize("get_contacts_from_db", time_benchmark(get_contacts_from_db, repeat)),
+        summarize("get_contacts_from_db (organization)", time_benchmark(lambda: get_contacts_from_db(organization_id=first_organization_id), repeat)),
+        summarize("generate_letter_number (preview)", time_benchmark(lambda: generate_letter_number("مالی", LETTER_TYPES_MAP), repeat)),
+    ]
+    results.extend(numbering_benchmarks(repeat))
+
+    # Each run inserts a letter with a fresh number in a year the synthetic letters don't use
+    first_number = get_connection().execute("SELECT COALESCE(MAX(id), 0) + 1 FROM Letters").fetchone()[0]
+    numbers = iter(range(first_number, first_number + repeat))
+    def _insert_letter():
+        number = next(numbers)
+        letter_code = f"{COMPANY_PREFIX}-GEN-1499-{number:03d}"
+        insert_letter(COMPANY_PREFIX, number, convert_numbers_to_persian(letter_code), "GEN", None, "۱۴۹۹/۰۱/۰۱",
+                      "بنچمارک", None, None, "متن نامه", f"{letter_code}.docx", None)
+    results.append(summarize("insert_letter", time_benchmark(_insert_letter, repeat)))
+    return results
+
+def numbering_benchmarks(repeat, batch_size=100):
+    """
+    Times reserve_journaled_letters: the numbers allocated in an IMMEDIATE transaction and the letters
+    journaled, for one letter and for a batch. Uses a year the synthetic letters don't; every letter is
+    abandoned afterwards (untimed), highest number first, which gives the numbers back.
+    """
+    reserved = []
+    def _build_letter(index, sequence_number):
+        letter_code = f"{COMPANY_PREFIX}-GEN-1499-{sequence_number:03d}"
+        return {
+            'letter_code_prefix': COMPANY_PREFIX, 'letter_code_number': sequence_number,
+            'letter_code_persian': convert_numbers_to_persian(letter_code), 'type': "GEN", 'date_shamsi_persian': "۱۴۹۹/۰۱/۰۱",
+            'subject': "بنچمارک", 'body': "متن نامه", 'organization_id': None, 'contact_id': None,
+            'file_path': f"{letter_code}.docx", 'user_id': None, 'replacements': {},
+        }
+    def _reserve(count):
+        reserved.extend(reserve_journaled_letters(COMPANY_PREFIX, 1499, count, _build_letter, "letter_template.docx", RENDER_BACKEND_PYTHON_DOCX))
+
+    try:
+        return [
+            summarize("reserve_journaled_letters (1 letter)", time_benchmark(lambda: _reserve(1), repeat)),
+            summarize(f"reserve_journaled_letters ({batch_size} letters)", time_benchmark(lambda: _reserve(batch_size), repeat), letters=batch_size),
+        ]
+    finally:
+        abandon_letters([(letter, "benchmark") for letter in reserved])
+
+def docx_benchmarks(repeat, work_dir, paragraphs=200):
+    source_path = os.path.join(work_dir, "letter_template.docx")
+    build_sample_document(source_path, paragraphs)
+    target_path = os.path.join(work_dir, "letter.docx")
+    replacements = {placeholder: f"<{placeholder.strip('[]').lower()}>" for placeholder in PLACEHOLDERS}
+
+    def _fresh_copy():
+        shutil.copyfile(source_path, target_path)
+        return target_path
+    timings = time_benchmark(lambda path: replace_text_in_docx(path, replacements), repeat, setup=_fresh_copy)
+    return [summarize("replace_text_in_docx", timings, paragraphs=paragraphs)]
+
+def import_benchmarks(repeat, work_dir, rows=5000):
+    """Times importing a CSV of new organizations (a fresh file of new names for each run)."""
+    runs = iter(range(repeat))
+    def _write_csv():
+        path = os.path.join(work_dir, "organizations.csv")
+        run = next(runs)
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["نام سازمان", "صنعت", "تلفن", "ایمیل"])
+            for i in range(rows):
+                writer.writerow([f"سازمان وارداتی {time.time_ns()}-{run}-{i}", "بازرگانی", f"۰۲۱-{i:08d}", f"info{i}@example.com"])
+        return path
+    timings = time_benchmark(crm_import_logic.import_organizations, repeat, setup=_write_csv)
+    return [summarize("import_organizations (csv)", timings, rows=rows, rows_per_second=rows / statistics.median(timings))]
+
+def export_benchmarks(repeat, work_dir):
+    """Times exporting the whole archive, and one full-text search of it, to a file per format (Excel needs openpyxl)."""
+    results = []
+    for extension in (".csv", ".jsonl", ".xlsx"):
+        path = os.path.join(work_dir, f"letters{extension}")
+        try:
+            timings = time_benchmark(lambda: export_letters(path, letter_types_map=LETTER_TYPES_MAP), repeat)
+        except ImportError as e:
+            results.append({'name': f"export_letters ({extension})", 'skipped': str(e)})
+            continue
+        results.append(summarize(f"export_letters ({extension})", timings, bytes=os.path.getsize(path)))
+    path = os.path.join(work_dir, "search.csv")
+    results.append(summarize("export_letters (full-text search, .csv)", time_benchmark(lambda: export_letters(path, "قرارداد"), repeat)))
+    return results
+
+def treeview_benchmarks(repeat):
+    """Times the functions that fill the CRM and archive Treeviews (queries run synchronously here)."""
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return [{'name': name, 'skipped': f"no display: {e}"} for name in
+                ("populate_organizations_treeview", "populate_contacts_treeview", "update_history_treeview")]
+
+    try:
+        root.withdraw()
+        org_treeview = ttk.Treeview(root, columns=("id", "name", "industry", "phone", "email", "address", "description"), show="headings")
+        contact_treeview = ttk.Treeview(root, columns=("id", "first_name", "last_name", "organization", "title", "phone", "email", "notes"), show="headings")
+        history_treeview = ttk.Treeview(root, columns=("code", "type", "date", "subject", "organization", "contact", "snippet"), show="headings")
+
+        def _populate_organizations():
+            crm_logic.populate_organizations_treeview("", org_treeview)
+            root.update_idletasks()
+        def _populate_contacts():
+            crm_logic.populate_contacts_treeview(None, "", contact_treeview)
+            root.update_idletasks()
+        def _update_history():
+            archive_logic.update_history_treeview("", history_treeview, letter_types_map=LETTER_TYPES_MAP)
+            root.update_idletasks()
+
+        return [
+            summarize("populate_organizations_treeview", time_benchmark(_populate_organizations, repeat), rows=len(org_treeview.get_children())),
+            summarize("populate_contacts_treeview", time_benchmark(_populate_contacts, repeat), rows=len(contact_treeview.get_children())),
+            summarize("update_history_treeview", time_benchmark(_update_history, repeat), rows=len(history_treeview.get_children())),
+        ]
+    finally:
+        root.destroy()
+
+
+def run_suite(database_path, work_dir, repeat, dataset):
+    if os.path.exists(database_path):
+        set_database_path(database_path)
+        migrate_database()
+        dataset = None
+    else:
+        dataset = populate_database(database_path, **dataset)
+
+    results = (database_benchmarks(repeat) + docx_benchmarks(repeat, work_dir) + import_benchmarks(repeat, work_dir)
+               + export_benchmarks(repeat, work_dir) + treeview_benchmarks(repeat))
+    counts = {table: get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("Organizations", "Contacts", "Users", "Letters")}
+    close_all_connections()
+    return {
+        'created_at': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'database': database_path,
+        'rows': counts,
+        'dataset_seconds': dataset['seconds'] if dataset else None,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="database to benchmark (generated here if missing)")
+    parser.add_argument("--output", help="JSON file to write (default: standard output)")
+    parser.add_argument("--repeat", type=int, default=5)
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+    dataset = {'organizations': args.organizations, 'contacts': args.contacts, 'users': args.users, 'letters': args.letters, 'seed': args.seed}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        database_path = args.database or os.path.join(work_dir, "bench.db")
+        report = run_suite(database_path, work_dir, args.repeat, dataset)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        for result in report['results']:
+            timing = f"{result['median_ms']:10.2f} ms" if 'median_ms' in result else f"skipped ({result['skipped']})"
+            print(f"{result['name']:40} {timing}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Fills a CRM database with synthetic organizations, contacts, users and letters.
+
+    python -m benchmarks.synthetic_data --database bench.db [--organizations 500] [--contacts 5000]
+                                        [--users 20] [--letters 50000] [--seed 1]
+
+Names are drawn from Persian name lists, letters get Shamsi dates spread over several years and
+letter codes in the generate_letter_number format (COMPANY-TYPE-YEAR-NNN, Persian digits), numbered
+per year as the application numbers them. The schema is created with schema_migrations and
+LetterSequences is seeded from the generated letters. The same seed always produces the same data.
+"""
+import argparse
+import random
+import time
+
+from connection_manager import set_database_path, transaction
+from database import seed_letter_sequences, _hash_password, _letter_dates
+from helpers import convert_numbers_to_persian
+from persian_text import normalize_persian_text
+from schema_migrations import migrate_database
+
+COMPANY_PREFIX = "NGRR"
+LETTER_TYPES = ("FIN", "HR", "GEN")
+FIRST_YEAR = 1398
+LAST_YEAR = 1404
+
+FIRST_NAMES = ("علی", "محمد", "حسین", "رضا", "مهدی", "فاطمه", "زهرا", "مریم", "سارا", "نرگس", "امیر", "حمید",
+               "مجید", "سعید", "لیلا", "الهام", "نازنین", "پریسا", "کاوه", "بهرام", "شیرین", "آرش", "یاسمن", "مهسا")
+LAST_NAMES = ("محمدی", "حسینی", "احمدی", "رضایی", "کریمی", "موسوی", "جعفری", "صادقی", "رحیمی", "نوری", "کاظمی",
+              "اکبری", "قاسمی", "عباسی", "حیدری", "یوسفی", "مرادی", "شریفی", "طاهری", "نجفی", "زمانی", "فراهانی")
+TITLES = ("مدیرعامل", "مدیر مالی", "کارشناس فروش", "مدیر منابع انسانی", "مسئول خرید", "کارشناس فنی", "مدیر پروژه")
+ORG_KINDS = ("شرکت", "گروه صنعتی", "مؤسسه", "هلدینگ", "سازمان", "کارخانه")
+ORG_WORDS = ("پارس", "آریا", "سپهر", "البرز", "نوین", "پیشرو", "ایران", "دماوند", "خلیج فارس", "زاگرس", "آفتاب",
+             "مهر", "کیان", "ارغوان", "پایا", "توسعه", "فناوران", "صنعت", "تجارت", "سازه")
+INDUSTRIES = ("ساختمان", "نفت و گاز", "فناوری اطلاعات", "خودرو", "غذایی", "دارویی", "بانکداری", "حمل و نقل")
+SUBJECT_WORDS = ("درخواست", "پیشنهاد", "قرارداد", "صورتحساب", "پرداخت", "جلسه", "همکاری", "تمدید", "پیش‌فاکتور",
+                 "استخدام", "مرخصی", "گزارش", "پروژه", "تحویل", "بازدید", "سفارش")
+BODY_SENTENCES = ("احتراماً به استحضار می‌رساند",
+                  "با توجه به مذاکرات انجام‌شده در جلسه اخیر",
+                  "خواهشمند است دستور فرمایید اقدام لازم صورت پذیرد",
+                  "مدارک مربوطه به پیوست ارسال می‌گردد",
+                  "پیشاپیش از همکاری جنابعالی سپاسگزاریم",
+                  "مبلغ قرارداد طی دو قسط پرداخت خواهد شد",
+                  "زمان تحویل کالا تا پایان ماه جاری تعیین شده است")
+
+
+def _organization_names(count, rng):
+    names = set()
+    while len(names) < count:
+        name = f"{rng.choice(ORG_KINDS)} {rng.choice(ORG_WORDS)} {rng.choice(ORG_WORDS)}"
+        # Suffix a number once the combinations run out, so large datasets stay UNIQUE
+        names.add(name if name not in names else f"{name} {convert_numbers_to_persian(str(len(names)))}")
+    return sorted(names)
+
+def _phone(rng):
+    return convert_numbers_to_persian(f"021{rng.randrange(10 ** 7, 10 ** 8)}")
+
+def populate_database(database_path, organizations=500, contacts=5000, users=20, letters=50000, seed=1):
+    """
+    Creates (or extends) the database at database_path with synthetic data and returns
+    {'organizations', 'contacts', 'users', 'letters', 'seconds'}.
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    set_database_path(database_path)
+    migrate_database()
+
+    with transaction("IMMEDIATE") as conn:
+        conn.executemany("""
+            INSERT OR IGNORE INTO Organizations (name, industry, phone, email, address, description, name_normalized) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(name, rng.choice(INDUSTRIES), _phone(rng), f"info{i}@example.com", f"تهران، خیابان {rng.choice(ORG_WORDS)}، پلاک {convert_numbers_to_persian(str(i + 1))}", "",
+               normalize_persian_text(name))
+              for i, name in enumerate(_organization_names(organizations, rng))])
+        organization_ids = [row[0] for row in conn.execute("SELECT id FROM Organizations")]
+
+        contact_rows = []
+        for i in range(contacts):
+            organization_id = rng.choice(organization_ids) if organization_ids and rng.random() < 0.95 else None
+            first_name, last_name, title = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(TITLES)
+            contact_rows.append((organization_id, first_name, last_name, title, _phone(rng), f"contact{i}@example.com", "",
+                                 normalize_persian_text(first_name), normalize_persian_text(last_name), normalize_persian_text(title)))
+        conn.executemany("""
+            INSERT INTO Contacts (organization_id, first_name, last_name, title, phone, email, notes, first_name_normalized, last_name_normalized, title_normalized)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, contact_rows)
+        contacts_by_organization = {}
+        for contact_id, organization_id in conn.execute("SELECT id, organization_id FROM Contacts"):
+            contacts_by_organization.setdefault(organization_id, []).append(contact_id)
+
+        password_hash = _hash_password("benchmark")
+        conn.executemany("INSERT OR IGNORE INTO Users (username, password_hash, role) VALUES (?, ?, ?)",
+                         [(f"user{i}", password_hash, "admin" if i == 0 else "user") for i in range(users)])
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM Users")]
+
+        # Letters are numbered per (prefix, year), continuing after any letters already in the database
+        next_numbers = {year: 1 for year in range(FIRST_YEAR, LAST_YEAR + 1)}
+        for (year, highest) in conn.execute("SELECT year, last_number FROM LetterSequences WHERE prefix = ?", (COMPANY_PREFIX,)):
+            if year in next_numbers:
+                next_numbers[year] = highest + 1
+        dates = sorted((rng.randint(FIRST_YEAR, LAST_YEAR), rng.randint(1, 12), rng.randint(1, 29)) for _ in range(letters))
+        letter_rows = []
+        for year, month, day in dates:
+            number = next_numbers[year]
+            next_numbers[year] += 1
+            letter_type = rng.choice(LETTER_TYPES)
+            organization_id = rng.choice(organization_ids) if organization_ids else None
+            organization_contacts = contacts_by_organization.get(organization_id)
+            subject = " ".join(rng.sample(SUBJECT_WORDS, 3))
+            letter_code = f"{COMPANY_PREFIX}-{letter_type}-{year}-{number:03d}"
+            date_shamsi_persian = convert_numbers_to_persian(f"{year}/{month:02d}/{day:02d}")
+            letter_rows.append((
+                COMPANY_PREFIX, number, convert_numbers_to_persian(letter_code), letter_type,
+                date_shamsi_persian, subject,
+                "\n".join(rng.sample(BODY_SENTENCES, 4)), organization_id,
+                rng.choice(organization_contacts) if organization_contacts else None,
+                f"C:\\GeneratedLetters\\{letter_code} - {subject}.docx",
+                rng.choice(user_ids) if user_ids else None,
+                f"{year + 621}-{month:02d}-{day:02d} 10:00:00",
+                normalize_persian_text(subject), normalize_persian_text(letter_code),
+                *_letter_dates(date_shamsi_persian),
+            ))
+        conn.executemany("""
+            INSERT INTO Letters (letter_code_prefix, letter_code_number, letter_code_persian, type, date_shamsi_persian, subject, body, organization_id, contact_id, file_path, user_id, created_at,
+                                 subject_normalized, letter_code_normalized, date_shamsi, date_gregorian)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, letter_rows)
+
+    seed_letter_sequences()
+    return {'organizations': organizations, 'contacts': contacts, 'users': users, 'letters': letters, 'seconds': time.perf_counter() - started}
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument("--organizations", type=int, default=500)
+    parser.add_argument("--contacts", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--letters", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="database file to create or extend")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    summary = populate_database(args.database, args.organizations, args.contacts, args.users, args.letters, args.seed)
+    print(f"{args.database}: {summary['organizations']} organizations, {summary['contacts']} contacts, "
+          f"{summary['users']} users, {summary['letters']} letters in {summary['seconds']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+import itertools
+from contextlib import contextmanager
+
+from query_stats import InstrumentedConnection
+
+DATABASE_NAME = "crm.db"
+
+# Applied once per connection when it is opened, instead of on every call
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+)
+
+MAX_IDLE_CONNECTIONS = 4
+
+
+class ConnectionManager:
+    """
+    Keeps a small pool of long-lived SQLite connections.
+    Each thread gets its own connection on first use and keeps it until it calls release();
+    released connections are parked in an idle list and handed to the next thread that needs one.
+    """
+
+    def __init__(self, database_name=DATABASE_NAME, max_idle=MAX_IDLE_CONNECTIONS):
+        self.database_name = database_name
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._open_connections = set()
+        self._savepoint_ids = itertools.count(1)
+
+    def _open(self):
+        # isolation_level=None: transactions are controlled explicitly by transaction()
+        # InstrumentedConnection times every statement for the query stats (see query_stats)
+        conn = sqlite3.connect(self.database_name, timeout=5, isolation_level=None, check_same_thread=False, factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def get_connection(self):
+        """Returns the calling thread's connection, taking one from the pool or opening it if needed."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._open()
+                with self._lock:
+                    self._open_connections.add(conn)
+            self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Gives the calling thread's connection back to the pool (worker threads call this when they finish)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._open_connections.discard(conn)
+        conn.close()
+
+    @contextmanager
+    def transaction(self, mode="DEFERRED"):
+        """
+        Runs the enclosed block in a transaction on the thread's connection.
+        Commits on success and rolls back on any exception. Nested use becomes a SAVEPOINT,
+        so helpers that open their own transaction can be called from inside a larger one.
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            savepoint = f"sp_{next(self._savepoint_ids)}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+            return
+
+        conn.execute(f"BEGIN {mode}")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def close_all(self):
+        """Closes every connection opened by this manager (called on application exit)."""
+        with self._lock:
+            connections = list(self._open_connections)
+            self._open_connections.clear()
+            self._idle.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        self._local = threading.local()
+
+    def set_database(self, database_name):
+        """Points the manager at another database file, closing connections to the old one."""
+        self.close_all()
+        self.database_name = database_name
+
+
+_manager = ConnectionManager()
+
+
+def get_connection():
+    """Returns the pooled connection for the calling thread. Do not close it."""
+    return _manager.get_connection()
+
+
+def transaction(mode="DEFERRED"):
+    """Context manager for a transaction on the calling thread's pooled connection."""
+    return _manager.transaction(mode)
+
+
+def release_connection():
+    """Returns the calling thread's connection to the pool."""
+    _manager.release()
+
+
+def close_all_connections():
+    """Closes all pooled connections."""
+    _manager.close_all()
+
+
+def set_database_path(database_name):
+    """Switches the pool to another database file."""
+    _manager.set_database(database_name)
+
+
+def get_database_path():
+    """Returns the path of the database file the pool is connected to."""
+    return _manager.database_name
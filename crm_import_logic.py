@@ -0,0 +1,446 @@
+import codecs
+import csv
+import io
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+
+from connection_manager import release_connection
+from database import get_organization_name_keys, get_contact_name_keys, insert_organizations_bulk, insert_contacts_bulk
+from helpers import convert_numbers_to_persian
+from persian_text import normalize_persian_text, clean_persian_text
+
+# Rows inserted per transaction
+IMPORT_BATCH_SIZE = 1000
+PROGRESS_POLL_MS = 100
+# Errors kept in the result; the count goes on past it
+IMPORT_MAX_ERRORS = 1000
+
+# Field -> header texts accepted for it (compared after normalize_persian_text)
+ORGANIZATION_IMPORT_COLUMNS = {
+    'name': ("name", "organization", "company", "نام", "نام سازمان", "سازمان", "شرکت"),
+    'industry': ("industry", "صنعت", "حوزه فعالیت"),
+    'phone': ("phone", "tel", "تلفن", "شماره تماس"),
+    'email': ("email", "e-mail", "ایمیل", "پست الکترونیک"),
+    'address': ("address", "آدرس", "نشانی"),
+    'description': ("description", "notes", "توضیحات"),
+}
+CONTACT_IMPORT_COLUMNS = {
+    'first_name': ("first name", "first_name", "نام"),
+    'last_name': ("last name", "last_name", "نام خانوادگی"),
+    'organization_name': ("organization", "company", "سازمان", "نام سازمان", "شرکت"),
+    'title': ("title", "position", "عنوان", "سمت"),
+    'phone': ("phone", "mobile", "tel", "تلفن", "موبایل", "شماره تماس"),
+    'email': ("email", "e-mail", "ایمیل", "پست الکترونیک"),
+    'notes': ("notes", "description", "یادداشت", "یادداشت‌ها", "توضیحات"),
+}
+# Columns a file must have, with the name shown when one is missing
+_REQUIRED_IMPORT_COLUMNS = {'name': "نام سازمان", 'first_name': "نام", 'last_name': "نام خانوادگی"}
+IMPORT_KINDS = {
+    'organizations': ("سازمان‌ها", ORGANIZATION_IMPORT_COLUMNS),
+    'contacts': ("مخاطبین", CONTACT_IMPORT_COLUMNS),
+}
+
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_PHONE = re.compile(r"^[\d\s+\-()]+$")
+_ASCII_DIGITS = str.maketrans({**{chr(0x06f0 + digit): str(digit) for digit in range(10)},
+                               **{chr(0x0660 + digit): str(digit) for digit in range(10)}})
+# Enough of the file to tell its encoding and delimiter
+_SNIFF_BYTES = 64 * 1024
+
+
+class ImportFile:
+    """
+    Reads the rows of a .csv or .xlsx file one at a time, as lists of cell texts, so a file of any
+    size is imported in constant memory. progress() is the fraction of the file read so far.
+
+    CSV files may be UTF-8 (with or without BOM) or Windows-1256, as Excel saves them on Persian
+    Windows, with , ; or tab between fields. Excel files need openpyxl (optional dependency).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.is_excel = os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm")
+        self._size = os.path.getsize(path)
+        self._raw = None
+        self._rows_read = 0
+        self._row_count = None
+        self._finished = False
+
+    def __iter__(self):
+        return self._excel_rows() if self.is_excel else self._csv_rows()
+
+    def progress(self):
+        if self._finished:
+            return 1.0
+        if self.is_excel:
+            return min(1.0, self._rows_read / self._row_count) if self._row_count else None
+        if self._raw is None or self._raw.closed or not self._size:
+            return None
+        return min(1.0, self._raw.tell() / self._size)
+
+    def _csv_rows(self):
+        with open(self.path, "rb") as raw:
+            self._raw = raw
+            sample = raw.read(_SNIFF_BYTES)
+            raw.seek(0)
+            encoding = _detect_encoding(sample)
+            try:
+                dialect = csv.Sniffer().sniff(codecs.getincrementaldecoder(encoding)(errors="replace").decode(sample), delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            with io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="") as text:
+                for row in csv.reader(text, dialect):
+                    yield [_cell_text(value) for value in row]
+        self._finished = True
+
+    def _excel_rows(self):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportError("برای ورود فایل اکسل بسته openpyxl لازم است (pip install openpyxl). می‌توانید فایل را به صورت CSV ذخیره کنید.")
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            self._row_count = sheet.max_row
+            for row in sheet.iter_rows(values_only=True):
+                self._rows_read += 1
+                yield [_cell_text(value) for value in row]
+            self._finished = True
+        finally:
+            workbook.close()
+
+
+def _detect_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # The sample may end inside a character; only invalid bytes before that count
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1256"
+
+def _cell_text(value):
+    """Cell value as text; numbers Excel stored as floats (phone numbers, codes) lose the ".0"."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return clean_persian_text(value)
+
+
+def map_import_columns(header, columns):
+    """
+    Returns {field: column index} for a header row, matching each cell against the aliases in
+    columns (ORGANIZATION_IMPORT_COLUMNS or CONTACT_IMPORT_COLUMNS). Raises ValueError if a
+    required column is missing.
+    """
+    aliases = {normalize_persian_text(alias): field for field, names in columns.items() for alias in names}
+    mapping = {}
+    for index, cell in enumerate(header):
+        field = aliases.get(normalize_persian_text(cell))
+        if field and field not in mapping:
+            mapping[field] = index
+    missing = [field for field in _REQUIRED_IMPORT_COLUMNS if field in columns and field not in mapping]
+    if missing:
+        raise ValueError(f"ستون‌های لازم در سطر اول فایل پیدا نشد: {'، '.join(_REQUIRED_IMPORT_COLUMNS[field] for field in missing)}")
+    return mapping
+
+def _validate_contact_details(record):
+    """Normalizes the phone and email of record in place; returns an error message or None."""
+    phone = record.get('phone')
+    if phone:
+        phone = phone.translate(_ASCII_DIGITS)
+        if not _PHONE.match(phone):
+            return f"شماره تلفن نامعتبر: {record['phone']}"
+        record['phone'] = phone
+    email = record.get('email')
+    if email:
+        if not _EMAIL.match(email):
+            return f"ایمیل نامعتبر: {email}"
+        record['email'] = email.lower()
+    return None
+
+
+def _run_import(path, kind, progress_callback, batch_size, create_organizations=False):
+    started = time.perf_counter()
+    label, columns = IMPORT_KINDS[kind]
+    result = {'kind': kind, 'rows': 0, 'organizations': 0, 'contacts': 0, 'skipped': 0, 'errors': [], 'error_count': 0}
+
+    def _error(row_number, message):
+        result['error_count'] += 1
+        if len(result['errors']) < IMPORT_MAX_ERRORS:
+            result['errors'].append((row_number, message))
+
+    import_file = ImportFile(path)
+    rows = iter(import_file)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("فایل خالی است.")
+    mapping = map_import_columns(header, columns)
+
+    organization_keys = get_organization_name_keys()
+    contact_keys = get_contact_name_keys() if kind == 'contacts' else set()
+    batch, new_organizations = [], []
+
+    def _flush():
+        if kind == 'organizations':
+            result['organizations'] += insert_organizations_bulk(batch) if batch else 0
+        elif batch or new_organizations:
+            organizations_added, contacts_added = insert_contacts_bulk(batch, new_organizations)
+            result['organizations'] += organizations_added
+            result['contacts'] += contacts_added
+        batch.clear()
+        new_organizations.clear()
+        if progress_callback:
+            progress_callback(result, import_file.progress())
+
+    for row_number, row in enumerate(rows, start=2):
+        record = {field: (row[index] if index < len(row) else "") or None for field, index in mapping.items()}
+        if not any(record.values()):
+            continue
+        result['rows'] += 1
+
+        if kind == 'organizations':
+            if not record['name']:
+                _error(row_number, "نام سازمان خالی است.")
+                continue
+            key = normalize_persian_text(record['name'])
+            if key in organization_keys:
+                result['skipped'] += 1
+                continue
+        else:
+            if not record['first_name'] or not record['last_name']:
+                _error(row_number, "نام و نام خانوادگی مخاطب لازم است.")
+                continue
+            organization_key = normalize_persian_text(record.get('organization_name'))
+            new_organization = bool(organization_key) and organization_key not in organization_keys
+            if new_organization and not create_organizations:
+                _error(row_number, f"سازمان «{record['organization_name']}» وجود ندارد.")
+                continue
+            key = (organization_key, normalize_persian_text(record['first_name']), normalize_persian_text(record['last_name']))
+            if key in contact_keys:
+                result['skipped'] += 1
+                continue
+
+        message = _validate_contact_details(record)
+        if message:
+            _error(row_number, message)
+            continue
+        if kind == 'organizations':
+            organization_keys.add(key)
+        else:
+            contact_keys.add(key)
+            # Only once the contact is accepted: a rejected row creates no organization
+            if new_organization:
+                new_organizations.append({'name': record['organization_name']})
+                organization_keys.add(organization_key)
+        batch.append(record)
+        if len(batch) >= batch_size:
+            _flush()
+    _flush()
+
+    result['seconds'] = time.perf_counter() - started
+    result['rows_per_second'] = result['rows'] / result['seconds'] if result['seconds'] else 0.0
+    print(f"DEBUG: ورود {label} از {path}: {result['rows']} ردیف در {result['seconds']:.2f} ثانیه "
+          f"({result['rows_per_second']:.0f} ردیف در ثانیه)، {result['error_count']} خطا")
+    return result
+
+def import_organizations(path, progress_callback=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports organizations from a .csv or .xlsx file whose first row names the columns
+    (ORGANIZATION_IMPORT_COLUMNS). The file is streamed and the rows are inserted batch_size at a
+    time, one transaction per batch. Organizations whose normalized name is already in the
+    database, or earlier in the file, are skipped.
+
+    progress_callback(result so far, fraction of the file read or None) is called after each batch.
+    Returns {'rows', 'organizations' (added), 'contacts', 'skipped', 'errors' ([(row number, message)]),
+    'error_count', 'seconds', 'rows_per_second'}. Raises ValueError for a file without the required columns.
+    """
+    return _run_import(path, 'organizations', progress_callback, batch_size)
+
+def import_contacts(path, create_organizations=False, progress_callback=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports contacts like import_organizations (CONTACT_IMPORT_COLUMNS). Each contact is attached to
+    the organization named in its row, matched by normalized name; a name not in the database is an
+    error for that row, or, with create_organizations, adds the organization in the same batch.
+    A contact with the same name in the same organization as an existing one is skipped.
+    """
+    return _run_import(path, 'contacts', progress_callback, batch_size, create_organizations)
+
+
+class CrmImportDialog(tk.Toplevel):
+    """Picks a CSV/Excel file and imports organizations or contacts from it on a background thread."""
+
+    def __init__(self, parent, status_bar_ref=None, on_finished_callback=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.status_bar_ref = status_bar_ref
+        self.on_finished_callback = on_finished_callback
+        self._progress_queue = queue.Queue()
+        self._worker = None
+
+        self.title("ورود سازمان‌ها و مخاطبین از فایل")
+        self.geometry("600x450")
+        self.transient(parent)
+        self.grab_set()
+        self._center_window()
+
+        self._create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _center_window(self):
+        self.update_idletasks()
+        x = self.parent.winfo_x() + (self.parent.winfo_width() // 2) - (self.winfo_width() // 2)
+        y = self.parent.winfo_y() + (self.parent.winfo_height() // 2) - (self.winfo_height() // 2)
+        self.geometry(f"+{x}+{y}")
+
+    def _create_widgets(self):
+        main_frame = ttk.Frame(self, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        file_frame = ttk.Frame(main_frame)
+        file_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(file_frame, text="فایل:").pack(side=tk.RIGHT, padx=5)
+        self.entry_path = ttk.Entry(file_frame)
+        self.entry_path.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
+        ttk.Button(file_frame, text="انتخاب...", command=self._browse).pack(side=tk.RIGHT, padx=5)
+
+        kind_frame = ttk.Frame(main_frame)
+        kind_frame.pack(fill=tk.X, pady=5)
+        self.kind_var = tk.StringVar(value='organizations')
+        for kind, (label, _) in IMPORT_KINDS.items():
+            ttk.Radiobutton(kind_frame, text=label, value=kind, variable=self.kind_var, command=self._on_kind_changed).pack(side=tk.RIGHT, padx=5)
+        self.create_organizations_var = tk.BooleanVar(value=False)
+        self.check_create_organizations = ttk.Checkbutton(kind_frame, text="ایجاد سازمان‌های جدید", variable=self.create_organizations_var, state="disabled")
+        self.check_create_organizations.pack(side=tk.RIGHT, padx=15)
+
+        ttk.Label(main_frame, text="سطر اول فایل باید نام ستون‌ها باشد (مثلاً: نام سازمان، صنعت، تلفن / نام، نام خانوادگی، سازمان).").pack(anchor=tk.E, pady=2)
+
+        self.progressbar = ttk.Progressbar(main_frame, orient="horizontal", mode="determinate", maximum=1.0)
+        self.progressbar.pack(fill=tk.X, pady=5)
+        self.progress_label = ttk.Label(main_frame, text="")
+        self.progress_label.pack(anchor=tk.E)
+
+        ttk.Label(main_frame, text="خطاها:").pack(anchor=tk.E)
+        self.errors_listbox = tk.Listbox(main_frame, height=10, justify=tk.RIGHT)
+        self.errors_listbox.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=5)
+        self.btn_start = ttk.Button(button_frame, text="شروع ورود", command=self._on_start)
+        self.btn_start.pack(side=tk.LEFT, padx=5)
+        self.btn_close = ttk.Button(button_frame, text="بستن", command=self._on_close)
+        self.btn_close.pack(side=tk.LEFT, padx=5)
+
+    def _browse(self):
+        path = filedialog.askopenfilename(
+            parent=self, title="انتخاب فایل",
+            filetypes=[("CSV / Excel", "*.csv *.xlsx"), ("CSV", "*.csv"), ("Excel", "*.xlsx"), ("All files", "*.*")]
+        )
+        if path:
+            self.entry_path.delete(0, tk.END)
+            self.entry_path.insert(0, path)
+
+    def _on_kind_changed(self):
+        self.check_create_organizations.config(state="normal" if self.kind_var.get() == 'contacts' else "disabled")
+
+    def _on_start(self):
+        path = self.entry_path.get().strip()
+        if not path or not os.path.exists(path):
+            messagebox.showwarning("انتخاب فایل", "لطفاً یک فایل CSV یا اکسل را انتخاب کنید.", parent=self)
+            return
+
+        self.btn_start.config(state="disabled")
+        self.btn_close.config(state="disabled")
+        self.errors_listbox.delete(0, tk.END)
+        self.progressbar.config(value=0)
+        self.progress_label.config(text="در حال خواندن فایل...")
+
+        kind = self.kind_var.get()
+        self._worker = threading.Thread(target=self._run_import, args=(path, kind, self.create_organizations_var.get()), name="crm-import", daemon=True)
+        self._worker.start()
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _run_import(self, path, kind, create_organizations):
+        # Runs on the worker thread; everything for the UI goes through _progress_queue
+        reported = 0
+        def _progress(result, fraction):
+            # Only the errors of rows read since the last report
+            nonlocal reported
+            self._progress_queue.put(('progress', result['rows'], result['errors'][reported:], fraction))
+            reported = len(result['errors'])
+        try:
+            if kind == 'organizations':
+                result = import_organizations(path, progress_callback=_progress)
+            else:
+                result = import_contacts(path, create_organizations, progress_callback=_progress)
+            self._progress_queue.put(('done', result))
+        except Exception as e:
+            traceback.print_exc()
+            self._progress_queue.put(('error', e))
+        finally:
+            release_connection()
+
+    def _poll_progress(self):
+        if not self.winfo_exists():
+            return
+        while True:
+            try:
+                message = self._progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                _, rows, errors, fraction = message
+                if fraction is not None:
+                    self.progressbar.config(value=fraction)
+                self.progress_label.config(text=f"{convert_numbers_to_persian(str(rows))} ردیف خوانده شد")
+                self._show_errors(errors)
+            elif message[0] == 'done':
+                self._on_import_finished(message[1])
+                return
+            elif message[0] == 'error':
+                self._on_import_finished(None, message[1])
+                return
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def _show_errors(self, errors):
+        for row_number, message in errors:
+            self.errors_listbox.insert(tk.END, f"ردیف {convert_numbers_to_persian(str(row_number))}: {message}")
+
+    def _on_import_finished(self, result, error=None):
+        self.btn_start.config(state="normal")
+        self.btn_close.config(state="normal")
+        self._worker = None
+        if error is not None:
+            self.progress_label.config(text="ورود اطلاعات متوقف شد.")
+            messagebox.showerror("خطا در ورود اطلاعات", f"خطا در ورود اطلاعات از فایل: {error}", parent=self)
+            return
+
+        self.progressbar.config(value=1.0)
+        summary = (f"{convert_numbers_to_persian(str(result['organizations']))} سازمان و "
+                   f"{convert_numbers_to_persian(str(result['contacts']))} مخاطب اضافه شد، "
+                   f"{convert_numbers_to_persian(str(result['skipped']))} تکراری، "
+                   f"{convert_numbers_to_persian(str(result['error_count']))} خطا "
+                   f"({convert_numbers_to_persian(str(int(result['rows_per_second'])))} ردیف در ثانیه).")
+        self.progress_label.config(text=summary)
+        if self.status_bar_ref:
+            self.status_bar_ref.config(text=f"ورود از فایل: {summary}")
+        if result['error_count']:
+            messagebox.showwarning("ورود از فایل", summary, parent=self)
+        else:
+            messagebox.showinfo("ورود از فایل", summary, parent=self)
+        if self.on_finished_callback and (result['organizations'] or result['contacts']):
+            self.on_finished_callback()
+
+    def _on_close(self):
+        if self._worker is not None:
+            messagebox.showwarning("ورود از فایل", "تا پایان ورود اطلاعات صبر کنید.", parent=self)
+            return
+        self.destroy()
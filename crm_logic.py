@@ -2,7 +2,6 @@ import tkinter as tk
 from tkinter import messagebox, ttk, simpledialog
 
 from database import (
-    get_db_connection,
     get_organizations_from_db,
     insert_organization,
     update_organization,
@@ -14,6 +13,10 @@ from database import (
     get_organization_by_id,
     get_contact_by_id
 )
+from query_executor import run_query, cancel_query
+from live_search import LiveSearch, NarrowingCache, prefix_matcher
+from autocomplete import AutocompleteEntry, get_organization_index
+from helpers import show_sort_indicator
 
 # Assuming BASE_FONT is defined globally or passed. For now, define locally if not available.
 try:
@@ -21,67 +24,146 @@ try:
 except NameError:
     BASE_FONT = ("Arial", 10)
 
+# Last complete result of each CRM Treeview's search, keyed by widget path, so that
+# search-as-you-type can narrow it in memory (see live_search.NarrowingCache)
+_org_search_caches = {}
+_contact_search_caches = {}
+
+# Sort chosen with each CRM Treeview's column headers, keyed by widget path: (sort column, descending).
+# The rows are sorted by the query (database.ORGANIZATION_SORT_KEYS / CONTACT_SORT_KEYS); sort_treeview
+# re-runs the Treeview's last populate call through _treeview_refreshers.
+_treeview_sorts = {}
+_treeview_refreshers = {}
+
+# Record field shown in each column of the Treeviews, in column order
+_ORGANIZATION_VALUE_FIELDS = ("id", "name", "industry", "phone", "email", "address", "description")
+_CONTACT_VALUE_FIELDS = ("id", "first_name", "last_name", "organization_id", "title", "phone", "email", "notes")
+
 
 def populate_organizations_treeview(search_term="", org_treeview_ref=None, status_bar_ref=None):
-    """Populates the organizations Treeview with data from the database."""
+    """Populates the organizations Treeview with data from the database.
+    The query runs in the background; the Treeview is refilled when its result arrives.
+    If search_term extends the previous search, the previous result is filtered in memory instead."""
     if org_treeview_ref:
-        for item in org_treeview_ref.get_children():
-            org_treeview_ref.delete(item)
-        
-        organizations = get_organizations_from_db(search_term)
-        for org in organizations:
-            org_treeview_ref.insert("", tk.END, values=(
-                org['id'],
-                org['name'],
-                org['industry'],
-                org['phone'],
-                org['email'],
-                org['address'],
-                org['description']
-            ), iid=org['id'])
-        if status_bar_ref: status_bar_ref.config(text=f"نمایش {len(organizations)} سازمان.")
+        channel = f"organizations:{org_treeview_ref}"
+        cache = _org_search_caches.setdefault(str(org_treeview_ref), NarrowingCache(prefix_matcher('name')))
+        sort_column, descending = _treeview_sorts.get(str(org_treeview_ref), ("name", False))
+        _treeview_refreshers[str(org_treeview_ref)] = (
+            _ORGANIZATION_VALUE_FIELDS, lambda: populate_organizations_treeview(search_term, org_treeview_ref, status_bar_ref))
+
+        def _render(organizations):
+            if not org_treeview_ref.winfo_exists():
+                return
+            for item in org_treeview_ref.get_children():
+                org_treeview_ref.delete(item)
+            
+            for org in organizations:
+                org_treeview_ref.insert("", tk.END, values=(
+                    org['id'],
+                    org['name'],
+                    org['industry'],
+                    org['phone'],
+                    org['email'],
+                    org['address'],
+                    org['description']
+                ), iid=org['id'])
+            if status_bar_ref: status_bar_ref.config(text=f"نمایش {len(organizations)} سازمان.")
+
+        def _store_and_render(organizations):
+            cache.store(search_term, organizations)
+            _render(organizations)
+
+        narrowed = cache.narrow(search_term)
+        if narrowed is not None:
+            cancel_query(channel)
+            _render(narrowed)
+            return
+        run_query(channel, get_organizations_from_db, search_term, sort_column, descending, on_done=_store_and_render)
 
 def populate_contacts_treeview(organization_id=None, search_term="", contact_treeview_ref=None, status_bar_ref=None):
-    """Populates the contacts Treeview with data from the database."""
+    """Populates the contacts Treeview with data from the database.
+    The query runs in the background; the Treeview is refilled when its result arrives.
+    If search_term extends the previous search, the previous result is filtered in memory instead."""
     if contact_treeview_ref:
-        for item in contact_treeview_ref.get_children():
-            contact_treeview_ref.delete(item)
-        
-        contacts = get_contacts_from_db(organization_id=organization_id, search_term=search_term)
-        for contact in contacts:
-            org_name = contact['organization_name'] if contact['organization_name'] else "---"
-            contact_treeview_ref.insert("", tk.END, values=(
-                contact['id'],
-                contact['first_name'],
-                contact['last_name'],
-                org_name, # Display organization name
-                contact['title'],
-                contact['phone'],
-                contact['email'],
-                contact['notes']
-            ), iid=contact['id'])
-        if status_bar_ref: status_bar_ref.config(text=f"نمایش {len(contacts)} مخاطب.")
+        channel = f"contacts:{contact_treeview_ref}"
+        cache = _contact_search_caches.setdefault(str(contact_treeview_ref), NarrowingCache(prefix_matcher('first_name', 'last_name', 'title', 'organization_name')))
+        sort_column, descending = _treeview_sorts.get(str(contact_treeview_ref), ("last_name", False))
+        _treeview_refreshers[str(contact_treeview_ref)] = (
+            _CONTACT_VALUE_FIELDS, lambda: populate_contacts_treeview(organization_id, search_term, contact_treeview_ref, status_bar_ref))
+
+        def _render(contacts):
+            if not contact_treeview_ref.winfo_exists():
+                return
+            for item in contact_treeview_ref.get_children():
+                contact_treeview_ref.delete(item)
+            
+            for contact in contacts:
+                org_name = contact['organization_name'] if contact['organization_name'] else "---"
+                contact_treeview_ref.insert("", tk.END, values=(
+                    contact['id'],
+                    contact['first_name'],
+                    contact['last_name'],
+                    org_name, # Display organization name
+                    contact['title'],
+                    contact['phone'],
+                    contact['email'],
+                    contact['notes']
+                ), iid=contact['id'])
+            if status_bar_ref: status_bar_ref.config(text=f"نمایش {len(contacts)} مخاطب.")
+
+        def _store_and_render(contacts):
+            cache.store(search_term, contacts, scope=organization_id)
+            _render(contacts)
+
+        narrowed = cache.narrow(search_term, scope=organization_id)
+        if narrowed is not None:
+            cancel_query(channel)
+            _render(narrowed)
+            return
+        run_query(channel, get_contacts_from_db, organization_id=organization_id, search_term=search_term,
+                  sort_column=sort_column, descending=descending, on_done=_store_and_render)
+
+def sort_treeview(treeview, column):
+    """
+    Column header click on a CRM Treeview: sorts by that column, ascending first and reversed on
+    the next click, by re-running the Treeview's query with the new ORDER BY.
+    """
+    refresher = _treeview_refreshers.get(str(treeview))
+    if refresher is None:
+        return
+    value_fields, refresh = refresher
+    sort_column = value_fields[list(treeview["columns"]).index(column)]
+    previous = _treeview_sorts.get(str(treeview))
+    descending = not previous[1] if previous and previous[0] == sort_column else False
+    _treeview_sorts[str(treeview)] = (sort_column, descending)
+    # Cached results are in the old order
+    for caches in (_org_search_caches, _contact_search_caches):
+        if str(treeview) in caches:
+            caches[str(treeview)].clear()
+    show_sort_indicator(treeview, column, descending)
+    refresh()
 
 
 # --- Organization Management Functions (now called by dialogs) ---
 # These functions are simplified as dialogs will handle data collection
-def on_add_organization(name, industry, phone, email, address, description, org_treeview_ref, status_bar_ref, populate_org_contact_combos_callback, root_window_ref):
+def on_add_organization(name, industry, phone, email, address, description, org_treeview_ref, status_bar_ref, crm_changed_callback, root_window_ref):
     """Handles adding a new organization from dialog data."""
     if not name:
         messagebox.showwarning("ورودی ناقص", "لطفاً نام سازمان را وارد کنید.", parent=root_window_ref)
         return False
 
-    if insert_organization(name, industry, phone, email, address, description):
+    org_id = insert_organization(name, industry, phone, email, address, description)
+    if org_id:
         messagebox.showinfo("موفقیت", "سازمان با موفقیت اضافه شد.", parent=root_window_ref)
         populate_organizations_treeview(org_treeview_ref=org_treeview_ref, status_bar_ref=status_bar_ref)
-        populate_org_contact_combos_callback()
+        crm_changed_callback("Organizations", org_id)
         if status_bar_ref: status_bar_ref.config(text=f"سازمان '{name}' اضافه شد.")
         return True
     else:
         messagebox.showerror("خطا", "خطا در افزودن سازمان.", parent=root_window_ref)
         return False
 
-def on_edit_organization_button(root_window_ref, entry_name, entry_industry, entry_phone, entry_email, entry_address, text_description, org_treeview_ref, contact_treeview_ref, status_bar_ref, populate_org_contact_combos_callback):
+def on_edit_organization_button(root_window_ref, entry_name, entry_industry, entry_phone, entry_email, entry_address, text_description, org_treeview_ref, contact_treeview_ref, status_bar_ref, crm_changed_callback):
     """Handles editing an existing organization."""
     selected_items = org_treeview_ref.selection()
     if selected_items:
@@ -101,14 +183,14 @@ def on_edit_organization_button(root_window_ref, entry_name, entry_industry, ent
             messagebox.showinfo("موفقیت", "سازمان با موفقیت ویرایش شد.", parent=root_window_ref)
             populate_organizations_treeview(org_treeview_ref=org_treeview_ref, status_bar_ref=status_bar_ref)
             populate_contacts_treeview(org_treeview_ref.item(org_treeview_ref.selection()[0], 'iid') if org_treeview_ref.selection() else None, "", contact_treeview_ref, status_bar_ref)
-            populate_org_contact_combos_callback() # Refresh combos in main app
+            crm_changed_callback("Organizations", org_id) # Update the app's organization map
             if status_bar_ref: status_bar_ref.config(text=f"سازمان '{name}' ویرایش شد.")
         else:
             messagebox.showerror("خطا", "خطا در ویرایش سازمان.", parent=root_window_ref)
     else:
         messagebox.showwarning("انتخاب نشده", "برای ویرایش یک سازمان، ابتدا آن را از لیست انتخاب کنید.", parent=root_window_ref)
 
-def on_delete_organization_button(root_window_ref, org_treeview_ref, contact_treeview_ref, status_bar_ref, populate_org_contact_combos_callback):
+def on_delete_organization_button(root_window_ref, org_treeview_ref, contact_treeview_ref, status_bar_ref, crm_changed_callback):
     """Handles deleting an organization."""
     selected_items = org_treeview_ref.selection()
     if selected_items:
@@ -121,7 +203,7 @@ def on_delete_organization_button(root_window_ref, org_treeview_ref, contact_tre
                 messagebox.showinfo("موفقیت", "سازمان با موفقیت حذف شد.", parent=root_window_ref)
                 populate_organizations_treeview(org_treeview_ref=org_treeview_ref, status_bar_ref=status_bar_ref)
                 populate_contacts_treeview(None, "", contact_treeview_ref, status_bar_ref)
-                populate_org_contact_combos_callback() # Refresh combos in main app
+                crm_changed_callback("Organizations", org_id, deleted=True) # Update the app's organization and contact maps
                 if status_bar_ref: status_bar_ref.config(text=f"سازمان '{org_name}' حذف شد.")
             else:
                 messagebox.showerror("خطا", "خطا در حذف سازمان.", parent=root_window_ref)
@@ -129,23 +211,24 @@ def on_delete_organization_button(root_window_ref, org_treeview_ref, contact_tre
         messagebox.showwarning("انتخاب نشده", "برای حذف یک سازمان، ابتدا آن را از لیست انتخاب کنید.", parent=root_window_ref)
 
 # --- Contact Management Functions (now called by dialogs) ---
-def on_add_contact(organization_id, first_name, last_name, title, phone, email, notes, contact_treeview_ref, status_bar_ref, populate_org_contact_combos_callback, root_window_ref):
+def on_add_contact(organization_id, first_name, last_name, title, phone, email, notes, contact_treeview_ref, status_bar_ref, crm_changed_callback, root_window_ref):
     """Handles adding a new contact from dialog data."""
     if not first_name or not last_name:
         messagebox.showwarning("ورودی ناقص", "لطفاً نام و نام خانوادگی مخاطب را وارد کنید.", parent=root_window_ref)
         return False
     
-    if insert_contact(organization_id, first_name, last_name, title, phone, email, notes):
+    contact_id = insert_contact(organization_id, first_name, last_name, title, phone, email, notes)
+    if contact_id:
         messagebox.showinfo("موفقیت", "مخاطب با موفقیت اضافه شد.", parent=root_window_ref)
         populate_contacts_treeview(organization_id, "", contact_treeview_ref, status_bar_ref)
-        populate_org_contact_combos_callback()
+        crm_changed_callback("Contacts", contact_id)
         if status_bar_ref: status_bar_ref.config(text=f"مخاطب '{first_name} {last_name}' اضافه شد.")
         return True
     else:
         messagebox.showerror("خطا", "خطا در افزودن مخاطب.", parent=root_window_ref)
         return False
 
-def on_edit_contact_button(root_window_ref, entry_org_id, entry_first_name, entry_last_name, entry_title, entry_phone, entry_email, text_notes, contact_treeview_ref, status_bar_ref, populate_org_contact_combos_callback):
+def on_edit_contact_button(root_window_ref, entry_org_id, entry_first_name, entry_last_name, entry_title, entry_phone, entry_email, text_notes, contact_treeview_ref, status_bar_ref, crm_changed_callback):
     """Handles editing an existing contact."""
     selected_items = contact_treeview_ref.selection()
     if selected_items:
@@ -167,14 +250,14 @@ def on_edit_contact_button(root_window_ref, entry_org_id, entry_first_name, entr
         if update_contact(contact_id, organization_id, first_name, last_name, title, phone, email, notes):
             messagebox.showinfo("موفقیت", "مخاطب با موفقیت ویرایش شد.", parent=root_window_ref)
             populate_contacts_treeview(organization_id, "", contact_treeview_ref, status_bar_ref)
-            populate_org_contact_combos_callback() # Refresh combos in main app
+            crm_changed_callback("Contacts", contact_id) # Update the app's contact map
             if status_bar_ref: status_bar_ref.config(text=f"مخاطب '{first_name} {last_name}' ویرایش شد.")
         else:
             messagebox.showerror("خطا", "خطا در ویرایش مخاطب.", parent=root_window_ref)
     else:
         messagebox.showwarning("انتخاب نشده", "برای ویرایش یک مخاطب، ابتدا آن را از لیست انتخاب کنید.", parent=root_window_ref)
 
-def on_delete_contact_button(root_window_ref, contact_treeview_ref, status_bar_ref, populate_org_contact_combos_callback):
+def on_delete_contact_button(root_window_ref, contact_treeview_ref, status_bar_ref, crm_changed_callback):
     """Handles deleting a contact."""
     selected_items = contact_treeview_ref.selection()
     if selected_items:
@@ -186,7 +269,7 @@ def on_delete_contact_button(root_window_ref, contact_treeview_ref, status_bar_r
             if delete_contact(contact_id):
                 messagebox.showinfo("موفقیت", "مخاطب با موفقیت حذف شد.", parent=root_window_ref)
                 populate_contacts_treeview(None, "", contact_treeview_ref, status_bar_ref)
-                populate_org_contact_combos_callback() # Refresh combos in main app
+                crm_changed_callback("Contacts", contact_id, deleted=True) # Update the app's contact map
                 if status_bar_ref: status_bar_ref.config(text=f"مخاطب '{contact_name}' حذف شد.")
             else:
                 messagebox.showerror("خطا", "خطا در حذف مخاطب.", parent=root_window_ref)
@@ -263,11 +346,11 @@ def on_contact_select(event, contact_treeview_ref, entry_org_id, entry_first_nam
 
 
 class AddOrganizationDialog(tk.Toplevel):
-    def __init__(self, parent, populate_organizations_callback, populate_all_combos_callback, org_treeview_ref, status_bar_ref):
+    def __init__(self, parent, populate_organizations_callback, crm_changed_callback, org_treeview_ref, status_bar_ref):
         super().__init__(parent)
         self.parent = parent
         self.populate_organizations_callback = populate_organizations_callback
-        self.populate_all_combos_callback = populate_all_combos_callback
+        self.crm_changed_callback = crm_changed_callback
         self.org_treeview_ref = org_treeview_ref
         self.status_bar_ref = status_bar_ref
 
@@ -330,16 +413,16 @@ class AddOrganizationDialog(tk.Toplevel):
         address = self.entry_address.get().strip()
         description = self.text_description.get("1.0", tk.END).strip()
 
-        if on_add_organization(name, industry, phone, email, address, description, self.org_treeview_ref, self.status_bar_ref, self.populate_all_combos_callback, self.parent):
+        if on_add_organization(name, industry, phone, email, address, description, self.org_treeview_ref, self.status_bar_ref, self.crm_changed_callback, self.parent):
             self.destroy()
 
 
 class AddContactDialog(tk.Toplevel):
-    def __init__(self, parent, populate_contacts_callback, populate_all_combos_callback, contact_treeview_ref, status_bar_ref):
+    def __init__(self, parent, populate_contacts_callback, crm_changed_callback, contact_treeview_ref, status_bar_ref):
         super().__init__(parent)
         self.parent = parent
         self.populate_contacts_callback = populate_contacts_callback
-        self.populate_all_combos_callback = populate_all_combos_callback
+        self.crm_changed_callback = crm_changed_callback
         self.contact_treeview_ref = contact_treeview_ref
         self.status_bar_ref = status_bar_ref
 
@@ -420,9 +503,13 @@ class AddContactDialog(tk.Toplevel):
         search_frame = ttk.Frame(dialog_frame)
         search_frame.pack(fill=tk.X, pady=5)
         ttk.Label(search_frame, text="جستجو:").pack(side=tk.RIGHT, padx=5)
-        org_dialog_search_entry = ttk.Entry(search_frame)
-        org_dialog_search_entry.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
-        
+        # Typing shows the best matches in a dropdown at once; the treeview below follows after a pause
+        org_autocomplete = AutocompleteEntry(search_frame, get_organization_index(),
+                                             on_select=lambda org: _choose_org(org['id'], org['name']),
+                                             display=lambda org: org['name'])
+        org_autocomplete.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
+        org_dialog_search_entry = org_autocomplete.entry
+
         # Treeview for organizations
         tree_frame = ttk.Frame(dialog_frame)
         tree_frame.pack(fill=tk.BOTH, expand=True, pady=5)
@@ -442,39 +529,31 @@ class AddContactDialog(tk.Toplevel):
         org_dialog_treeview.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         def _populate_org_dialog_treeview_internal(search_term=""):
+            if not org_dialog_treeview.winfo_exists():
+                return
             for i in org_dialog_treeview.get_children():
                 org_dialog_treeview.delete(i)
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            query = "SELECT id, name, industry FROM Organizations"
-            params = []
-            if search_term:
-                query += " WHERE name LIKE ?"
-                params.append(f"%{search_term}%")
-            query += " ORDER BY name"
-
-            cursor.execute(query, params)
-            organizations = cursor.fetchall()
-            conn.close()
-
-            for org in organizations:
+            for org in get_organization_index().search(search_term, limit=None):
                 org_dialog_treeview.insert("", tk.END, values=(org['id'], org['name'], org['industry']))
 
-        org_dialog_search_entry.bind("<Return>", lambda event: _populate_org_dialog_treeview_internal(org_dialog_search_entry.get()))
-        ttk.Button(search_frame, text="جستجو", command=lambda: _populate_org_dialog_treeview_internal(org_dialog_search_entry.get())).pack(side=tk.RIGHT, padx=5)
+        org_live_search = LiveSearch(org_dialog_search_entry, _populate_org_dialog_treeview_internal)
+        ttk.Button(search_frame, text="جستجو", command=org_live_search.fire_now).pack(side=tk.RIGHT, padx=5)
+
+        def _choose_org(org_id, org_name):
+            self.selected_org_id = org_id
+            self.selected_org_name = org_name
+            self.entry_org_name.config(state="normal")
+            self.entry_org_name.delete(0, tk.END)
+            self.entry_org_name.insert(0, self.selected_org_name)
+            self.entry_org_name.config(state="readonly")
+            dialog.destroy()
 
         def _select_org():
             selected_item = org_dialog_treeview.focus()
             if selected_item:
                 values = org_dialog_treeview.item(selected_item, 'values')
-                self.selected_org_id = values[0]
-                self.selected_org_name = values[1]
-                self.entry_org_name.config(state="normal")
-                self.entry_org_name.delete(0, tk.END)
-                self.entry_org_name.insert(0, self.selected_org_name)
-                self.entry_org_name.config(state="readonly")
-                dialog.destroy()
+                _choose_org(values[0], values[1])
             else:
                 messagebox.showwarning("انتخاب سازمان", "لطفاً یک سازمان را انتخاب کنید.", parent=dialog)
 
@@ -497,7 +576,7 @@ class AddContactDialog(tk.Toplevel):
         email = self.entry_email.get().strip()
         notes = self.text_notes.get("1.0", tk.END).strip()
 
-        if on_add_contact(self.selected_org_id, first_name, last_name, title, phone, email, notes, self.contact_treeview_ref, self.status_bar_ref, self.populate_all_combos_callback, self.parent):
+        if on_add_contact(self.selected_org_id, first_name, last_name, title, phone, email, notes, self.contact_treeview_ref, self.status_bar_ref, self.crm_changed_callback, self.parent):
             self.destroy()
 
 # --- Organization and Contact functions (existing, simplified for dialog interaction) ---
@@ -1,87 +1,533 @@
 import sqlite3
 import os
-import hashlib 
-from tkinter import messagebox 
-from datetime import datetime 
+import hashlib
+import re
+import json
+import socket
+import time
+import jdatetime
+from tkinter import messagebox
+from datetime import datetime
 
-DATABASE_NAME = "crm.db" 
+from connection_manager import get_connection, transaction
+from query_stats import instrument_module_functions
+from entity_cache import cached_entity, invalidate_entity
+from persian_text import normalize_persian_text, parse_shamsi_date
 
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row  
-    return conn
-
-def create_tables():
-    """Creates necessary tables in the database if they don't exist,
-    and adds missing columns to existing tables."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Create Organizations table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Organizations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            industry TEXT,
-            phone TEXT,
-            email TEXT,
-            address TEXT,
-            description TEXT
-        )
-    """)
+    """Returns the pooled SQLite connection for the calling thread.
+    The connection is long-lived and shared, so callers must not close it."""
+    return get_connection()
+
+# --- Full-text search index for the letter archive ---
+# LettersFTS holds one row per letter (rowid = Letters.id) with the searchable text,
+# including the organization and contact names, so archive searches don't need LIKE scans over joins.
+LETTERS_FTS_COLUMNS = ("letter_code", "subject", "body", "organization_name", "contact_name")
+# bm25 weights, in LETTERS_FTS_COLUMNS order: a hit in the code or subject counts more than one in the body
+LETTERS_FTS_WEIGHTS = (10.0, 5.0, 1.0, 3.0, 3.0)
+
+_LETTERS_FTS_SOURCE = """
+    SELECT L.id, L.letter_code_persian, L.subject, L.body,
+           COALESCE(O.name, ''), COALESCE(C.first_name || ' ' || C.last_name, '')
+    FROM Letters L
+    LEFT JOIN Organizations O ON L.organization_id = O.id
+    LEFT JOIN Contacts C ON L.contact_id = C.id
+"""
+
+_LETTERS_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_letters_fts_insert AFTER INSERT ON Letters BEGIN
+        INSERT INTO LettersFTS (rowid, letter_code, subject, body, organization_name, contact_name)
+        VALUES (NEW.id, NEW.letter_code_persian, NEW.subject, NEW.body,
+                COALESCE((SELECT name FROM Organizations WHERE id = NEW.organization_id), ''),
+                COALESCE((SELECT first_name || ' ' || last_name FROM Contacts WHERE id = NEW.contact_id), ''));
+    END
+    """,
+    # Only the indexed columns: updates of other columns (e.g. the normalized shadow columns) leave LettersFTS alone
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_letters_fts_update AFTER UPDATE OF letter_code_persian, subject, body, organization_id, contact_id ON Letters BEGIN
+        DELETE FROM LettersFTS WHERE rowid = OLD.id;
+        INSERT INTO LettersFTS (rowid, letter_code, subject, body, organization_name, contact_name)
+        VALUES (NEW.id, NEW.letter_code_persian, NEW.subject, NEW.body,
+                COALESCE((SELECT name FROM Organizations WHERE id = NEW.organization_id), ''),
+                COALESCE((SELECT first_name || ' ' || last_name FROM Contacts WHERE id = NEW.contact_id), ''));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_letters_fts_delete AFTER DELETE ON Letters BEGIN
+        DELETE FROM LettersFTS WHERE rowid = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_organizations_fts_update AFTER UPDATE OF name ON Organizations BEGIN
+        UPDATE LettersFTS SET organization_name = NEW.name
+        WHERE rowid IN (SELECT id FROM Letters WHERE organization_id = NEW.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_organizations_fts_delete AFTER DELETE ON Organizations BEGIN
+        UPDATE LettersFTS SET organization_name = ''
+        WHERE rowid IN (SELECT id FROM Letters WHERE organization_id = OLD.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_contacts_fts_update AFTER UPDATE OF first_name, last_name ON Contacts BEGIN
+        UPDATE LettersFTS SET contact_name = NEW.first_name || ' ' || NEW.last_name
+        WHERE rowid IN (SELECT id FROM Letters WHERE contact_id = NEW.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_contacts_fts_delete AFTER DELETE ON Contacts BEGIN
+        UPDATE LettersFTS SET contact_name = ''
+        WHERE rowid IN (SELECT id FROM Letters WHERE contact_id = OLD.id);
+    END
+    """,
+)
+
+def _create_letters_fts(cursor):
+    """Creates the LettersFTS table and its sync triggers, and fills it from existing letters
+    the first time. Does nothing if this SQLite build has no FTS5 (searches then fall back to LIKE)."""
+    existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'LettersFTS'").fetchone()
+    try:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS LettersFTS USING fts5(
+                {', '.join(LETTERS_FTS_COLUMNS)},
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"DEBUG: FTS5 در دسترس نیست، جستجوی آرشیو از LIKE استفاده می‌کند: {e}")
+        return
+    for trigger_sql in _LETTERS_FTS_TRIGGERS:
+        cursor.execute(trigger_sql)
+    if not existed:
+        rebuild_letters_fts()
+
+def rebuild_letters_fts():
+    """Re-fills LettersFTS from the Letters, Organizations and Contacts tables."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM LettersFTS")
+        conn.execute(f"INSERT INTO LettersFTS (rowid, {', '.join(LETTERS_FTS_COLUMNS)}) {_LETTERS_FTS_SOURCE}")
+
+def letters_fts_available():
+    """True if the LettersFTS index exists in the database."""
+    row = get_connection().execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'LettersFTS'").fetchone()
+    return row is not None
+
+_LATIN_TO_PERSIAN_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+_PERSIAN_TO_LATIN_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹", "0123456789")
+
+def build_fts_query(search_term):
+    """
+    Turns free text typed by the user into an FTS5 MATCH expression.
+    Every word must match (AND) and is treated as a prefix; words containing digits
+    match both their Latin and Persian digit forms, since letter codes store Persian digits.
+    Returns None if the text contains no searchable words.
+    """
+    terms = []
+    for token in re.findall(r"\w+", search_term or ""):
+        variants = {token, token.translate(_LATIN_TO_PERSIAN_DIGITS), token.translate(_PERSIAN_TO_LATIN_DIGITS)}
+        quoted = [f'"{variant}"*' for variant in sorted(variants)]
+        terms.append(quoted[0] if len(quoted) == 1 else "(" + " OR ".join(quoted) + ")")
+    return " AND ".join(terms) if terms else None
+
+# --- Normalized search columns ---
+# Each searchable text column has a shadow column holding normalize_persian_text() of it (one ی/ک
+# spelling, ASCII digits, no ZWNJ, case-folded), written together with the column and indexed.
+# Searches normalize the term the same way and match it as a prefix of the shadow column, which is
+# an index range scan: column >= term AND column < term + _PREFIX_END.
+NORMALIZED_COLUMNS = {
+    "Organizations": (("name", "name_normalized"),),
+    "Contacts": (("first_name", "first_name_normalized"), ("last_name", "last_name_normalized"), ("title", "title_normalized")),
+    "Letters": (("subject", "subject_normalized"), ("letter_code_persian", "letter_code_normalized")),
+}
+
+# Sorts after every character, so it closes the range of values starting with a prefix
+_PREFIX_END = "\U0010ffff"
+
+def _add_normalized_columns(cursor):
+    """Adds the NORMALIZED_COLUMNS shadow columns, fills them for existing rows and indexes them."""
+    # Databases from before this step have an update trigger that re-indexes a letter in LettersFTS
+    # whatever column changed; replace it with the current one before filling Letters.
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_letters_fts_update'").fetchone():
+        cursor.execute("DROP TRIGGER trg_letters_fts_update")
+        cursor.execute(next(trigger_sql for trigger_sql in _LETTERS_FTS_TRIGGERS if "trg_letters_fts_update" in trigger_sql))
+    for table, columns in NORMALIZED_COLUMNS.items():
+        existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        for _, normalized_column in columns:
+            if normalized_column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {normalized_column} TEXT")
+
+        source_columns = [source for source, _ in columns]
+        rows = cursor.execute(f"SELECT id, {', '.join(source_columns)} FROM {table}").fetchall()
+        assignments = ", ".join(f"{normalized} = ?" for _, normalized in columns)
+        cursor.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?",
+                           [tuple(normalize_persian_text(value) for value in row[1:]) + (row[0],) for row in rows])
+
+        for _, normalized_column in columns:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_{normalized_column} ON {table} ({normalized_column});")
+
+def _prefix_condition(column, search_term):
+    """
+    Returns (SQL condition, params) matching rows whose normalized column starts with the normalized
+    search_term, or None if the term has nothing to search for.
+    """
+    prefix = normalize_persian_text(search_term)
+    if not prefix:
+        return None
+    return f"({column} >= ? AND {column} < ?)", [prefix, prefix + _PREFIX_END]
+
+def _any_prefix_condition(columns, search_term):
+    """Like _prefix_condition, for a match in any of columns (OR); SQLite answers it with one range scan per column."""
+    prefix = normalize_persian_text(search_term)
+    if not prefix:
+        return None
+    condition = " OR ".join(f"({column} >= ? AND {column} < ?)" for column in columns)
+    return f"({condition})", [prefix, prefix + _PREFIX_END] * len(columns)
+
+def _letter_search_condition(search_term):
+    """
+    The archive search used when the full-text index is unavailable: the term is a prefix of the
+    letter code, the type code, the subject, the organization name, the contact's first or last name
+    or the author's username (all normalized).
+    Returns (SQL condition on Letters L, params), or None if the term has nothing to search for.
+    """
+    prefix = normalize_persian_text(search_term)
+    if not prefix:
+        return None
+    prefix_range = [prefix, prefix + _PREFIX_END]
+    # Type codes are stored upper case (FIN, HR, ...); the range stays on idx_letters_type_date
+    type_range = [prefix.upper(), prefix.upper() + _PREFIX_END]
+    # Users has no normalized column; the table is small enough to match its names here
+    user_ids = [row['id'] for row in get_connection().execute("SELECT id, username FROM Users")
+                if normalize_persian_text(row['username']).startswith(prefix)]
+    condition = f"""(
+        (L.letter_code_normalized >= ? AND L.letter_code_normalized < ?)
+        OR (L.type >= ? AND L.type < ?)
+        OR (L.subject_normalized >= ? AND L.subject_normalized < ?)
+        OR L.organization_id IN (SELECT id FROM Organizations WHERE name_normalized >= ? AND name_normalized < ?)
+        OR L.contact_id IN (SELECT id FROM Contacts WHERE (first_name_normalized >= ? AND first_name_normalized < ?)
+                                                       OR (last_name_normalized >= ? AND last_name_normalized < ?))
+        OR L.user_id IN ({", ".join("?" * len(user_ids)) or "NULL"})
+    )"""
+    return condition, prefix_range + type_range + prefix_range * 4 + user_ids
+
+# --- Letter dates ---
+# Letters.date_shamsi holds the Shamsi date as the integer yyyymmdd, which sorts and compares as a
+# date, and Letters.date_gregorian the Gregorian date as ISO text (yyyy-mm-dd). date_shamsi_persian
+# keeps the text printed in the letter; the archive formats date_shamsi for display (shamsi_date_display).
+def shamsi_date_number(text):
+    """Returns a Shamsi date (year/month/day, any digits) as yyyymmdd; raises ValueError if it is invalid."""
+    year, month, day = parse_shamsi_date(text)
+    return year * 10000 + month * 100 + day
+
+def shamsi_date_display(number):
+    """Returns a date_shamsi value (yyyymmdd, or yyyymm for a month) as Persian-digit text: ۱۴۰۳/۰۵/۰۱."""
+    if not number:
+        return ""
+    parts = (number // 10000, number // 100 % 100, number % 100) if number > 999999 else (number // 100, number % 100)
+    return "/".join(f"{part:02d}" for part in parts).translate(_LATIN_TO_PERSIAN_DIGITS)
+
+def _letter_dates(date_shamsi_persian, date_gregorian=None):
+    """
+    Returns the (date_shamsi, date_gregorian) columns of a letter dated date_shamsi_persian; date_gregorian,
+    if given (a date, datetime or ISO text), is kept, otherwise it is converted. None where the date is invalid.
+    """
+    try:
+        year, month, day = parse_shamsi_date(date_shamsi_persian)
+    except ValueError:
+        return None, None
+    if date_gregorian is None:
+        try:
+            date_gregorian = jdatetime.date(year, month, day).togregorian()
+        except ValueError:  # e.g. Esfand 30 of a common year
+            pass
+    if hasattr(date_gregorian, "isoformat"):
+        date_gregorian = date_gregorian.isoformat()[:10]
+    return year * 10000 + month * 100 + day, date_gregorian
+
+def _add_letter_date_columns(cursor):
+    """Adds Letters.date_shamsi and date_gregorian, fills them from date_shamsi_persian and moves the date indexes onto date_shamsi."""
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(Letters)")}
+    for column, column_type in (("date_shamsi", "INTEGER"), ("date_gregorian", "TEXT")):
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE Letters ADD COLUMN {column} {column_type}")
+    rows = cursor.execute("SELECT id, date_shamsi_persian FROM Letters").fetchall()
+    cursor.executemany("UPDATE Letters SET date_shamsi = ?, date_gregorian = ? WHERE id = ?",
+                       [_letter_dates(row[1]) + (row[0],) for row in rows])
+
+    for index in ("idx_letters_date_shamsi", "idx_letters_type_date", "idx_letters_organization_date", "idx_letters_user_date", "idx_letters_code_order"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index};")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_date ON Letters (date_shamsi);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_type_date ON Letters (type, date_shamsi);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_organization_date ON Letters (organization_id, date_shamsi);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_user_date ON Letters (user_id, date_shamsi);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_code_order ON Letters (letter_code_prefix, type, date_shamsi / 10000, letter_code_number);")
+
+# Letters whose date could not be parsed have date_shamsi NULL. The archive orders, pages and filters
+# on LETTER_DATE_KEY instead, so they sort as the oldest letters and a keyset comparison never meets a NULL.
+LETTER_DATE_KEY = "COALESCE(L.date_shamsi, 0)"
+
+def _index_letter_date_key(cursor):
+    """Moves the date indexes from date_shamsi onto LETTER_DATE_KEY."""
+    for index in ("idx_letters_date", "idx_letters_type_date", "idx_letters_organization_date", "idx_letters_user_date", "idx_letters_code_order"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index};")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_date ON Letters (COALESCE(date_shamsi, 0));")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_type_date ON Letters (type, COALESCE(date_shamsi, 0));")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_organization_date ON Letters (organization_id, COALESCE(date_shamsi, 0));")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_user_date ON Letters (user_id, COALESCE(date_shamsi, 0));")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_code_order ON Letters (letter_code_prefix, type, COALESCE(date_shamsi, 0) / 10000, letter_code_number);")
 
-    # Create Contacts table
+# --- Structured archive filters ---
+# A filter is a dict with any of these keys; missing or empty values don't filter:
+#   'type'            raw letter type ("FIN", "HR", ...)
+#   'date_from'       Shamsi date, inclusive, in any digits ("1403/01/01")
+#   'date_to'         Shamsi date, inclusive
+#   'organization_id' Organizations.id
+#   'user_id'         Users.id of the letter's author
+LETTER_FILTER_KEYS = ("type", "date_from", "date_to", "organization_id", "user_id")
+
+def _letter_filter_conditions(filters):
+    """
+    Returns ([SQL conditions on Letters L], params) for a filter dict (LETTER_FILTER_KEYS).
+    Each condition has an index (type, date, organization and author lead an index of Letters).
+    Raises ValueError for an invalid date.
+    """
+    conditions = []
+    params = []
+    filters = filters or {}
+    if filters.get('type'):
+        conditions.append("L.type = ?")
+        params.append(filters['type'])
+    # Letters without a date (LETTER_DATE_KEY 0) are in no date range
+    if filters.get('date_from'):
+        conditions.append(f"{LETTER_DATE_KEY} >= ?")
+        params.append(shamsi_date_number(filters['date_from']))
+    if filters.get('date_to'):
+        conditions.append(f"{LETTER_DATE_KEY} BETWEEN 1 AND ?")
+        params.append(shamsi_date_number(filters['date_to']))
+    if filters.get('organization_id'):
+        conditions.append("L.organization_id = ?")
+        params.append(filters['organization_id'])
+    if filters.get('user_id'):
+        conditions.append("L.user_id = ?")
+        params.append(filters['user_id'])
+    return conditions, params
+
+def _create_filter_indexes(cursor):
+    """Indexes for the archive filters by organization and author, in date order (they replace the single-column ones)."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_organization_date ON Letters (organization_id, date_shamsi_persian);")
+    cursor.execute("DROP INDEX IF EXISTS idx_letters_organization_id;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_user_date ON Letters (user_id, date_shamsi_persian);")
+    cursor.execute("DROP INDEX IF EXISTS idx_letters_user_id;")
+
+# --- Letter number sequences ---
+# LetterSequences keeps the last issued sequence number per (prefix, Shamsi year),
+# so the next number is a single-row update instead of a scan over Letters.
+def _create_letter_sequences(cursor):
+    """Creates the LetterSequences table and, when it is new, seeds it from existing letters."""
+    existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'LetterSequences'").fetchone()
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            organization_id INTEGER,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            title TEXT,
-            phone TEXT,
-            email TEXT,
-            notes TEXT,
-            FOREIGN KEY (organization_id) REFERENCES Organizations(id) ON DELETE SET NULL
-        )
+        CREATE TABLE IF NOT EXISTS LetterSequences (
+            prefix TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            last_number INTEGER NOT NULL,
+            PRIMARY KEY (prefix, year)
+        ) WITHOUT ROWID
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_organization_id ON Contacts (organization_id);")
+    if not existed:
+        seed_letter_sequences()
+
+def parse_letter_code(letter_code):
+    """
+    Splits a letter code such as 'NGRR-FIN-۱۴۰۳-۰۰۷' (Persian or Latin digits) into
+    (prefix, type, year, number). Returns None if the code does not have that shape.
+    """
+    parts = letter_code.translate(_PERSIAN_TO_LATIN_DIGITS).rsplit('-', 3)
+    if len(parts) != 4 or not parts[2].isdigit() or not parts[3].isdigit():
+        return None
+    return parts[0], parts[1], int(parts[2]), int(parts[3])
+
+def seed_letter_sequences():
+    """Raises each (prefix, year) counter to at least the highest number already used in Letters."""
+    highest = {}
+    cursor = get_connection().execute("SELECT letter_code_persian FROM Letters")
+    for (letter_code,) in cursor:
+        parsed = parse_letter_code(letter_code)
+        if parsed:
+            prefix, _, year, number = parsed
+            highest[(prefix, year)] = max(number, highest.get((prefix, year), 0))
+
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT INTO LetterSequences (prefix, year, last_number) VALUES (?, ?, ?)
+            ON CONFLICT (prefix, year) DO UPDATE SET last_number = MAX(last_number, excluded.last_number)
+        """, [(prefix, year, number) for (prefix, year), number in highest.items()])
+
+def peek_next_letter_number(prefix, year):
+    """Returns the number the next letter for (prefix, year) would get, without reserving it."""
+    row = get_connection().execute("SELECT last_number FROM LetterSequences WHERE prefix = ? AND year = ?", (prefix, year)).fetchone()
+    return (row['last_number'] if row else 0) + 1
+
+def allocate_letter_numbers(prefix, year, count):
+    """
+    Reserves count consecutive sequence numbers for (prefix, year) in one short transaction
+    and returns the first of them. Used by batch generation, which renders the letters after
+    the numbers are committed instead of holding the write lock for the whole batch.
+    """
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("""
+            INSERT INTO LetterSequences (prefix, year, last_number) VALUES (?, ?, ?)
+            ON CONFLICT (prefix, year) DO UPDATE SET last_number = last_number + excluded.last_number
+        """, (prefix, year, count))
+        row = conn.execute("SELECT last_number FROM LetterSequences WHERE prefix = ? AND year = ?", (prefix, year)).fetchone()
+    return row['last_number'] - count + 1
+
+# --- Generation journal ---
+# Every letter is written to GenerationJournal (state 'pending') in the same transaction that
+# reserves its number, before its file is written. The row is deleted in the transaction that
+# inserts the Letters row, so a pending row is a letter whose file and/or record may be missing
+# after a crash, and recover_generation_journal() (generation_pipeline) can finish it.
+#
+# Several instances of the application may share the database, so each row names the process that
+# owns it and a lease its owner keeps renewing (renew_journal_leases). Only rows whose lease has run
+# out, i.e. whose owner has died, are recovered, and a recovering instance claims each row first.
+JOURNAL_PENDING = "pending"
+JOURNAL_RECOVERING = "recovering"
+JOURNAL_ABANDONED = "abandoned"
+JOURNAL_LEASE_SECONDS = 120
+# This process, as the owner of its journal rows
+JOURNAL_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Keys of a journaled letter dict that go into Letters (see insert_letters_bulk)
+_JOURNAL_LETTER_FIELDS = ("letter_code_prefix", "letter_code_number", "letter_code_persian", "type", "date_shamsi_persian",
+                          "subject", "body", "organization_id", "contact_id", "file_path", "user_id")
 
-    # Create Letters table - Ensure this matches the columns being inserted
+def _create_generation_journal(cursor):
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Letters (
+        CREATE TABLE IF NOT EXISTS GenerationJournal (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             letter_code_prefix TEXT NOT NULL,
+            letter_year INTEGER NOT NULL,
             letter_code_number INTEGER NOT NULL,
-            letter_code_persian TEXT NOT NULL UNIQUE, 
-            type TEXT NOT NULL,
-            date_shamsi_persian TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            body TEXT NOT NULL,
-            organization_id INTEGER,
-            contact_id INTEGER,
+            letter_code_persian TEXT NOT NULL UNIQUE,
             file_path TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            user_id INTEGER, 
-            FOREIGN KEY (organization_id) REFERENCES Organizations(id) ON DELETE SET NULL,
-            FOREIGN KEY (contact_id) REFERENCES Contacts(id) ON DELETE SET NULL,
-            FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE SET NULL 
+            template_path TEXT NOT NULL,
+            render_backend TEXT NOT NULL,
+            letter_data TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            created_at TEXT NOT NULL
         )
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_user_id ON Letters (user_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_journal_state ON GenerationJournal (state);")
 
+def _add_journal_leases(cursor):
+    """Adds GenerationJournal.owner and lease_expires (time.time() seconds); rows journaled before have neither and are recoverable."""
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(GenerationJournal)")}
+    for column, column_type in (("owner", "TEXT"), ("lease_expires", "REAL")):
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE GenerationJournal ADD COLUMN {column} {column_type}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_journal_owner ON GenerationJournal (owner, state);")
 
-    # Create Users table 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL, 
-            role TEXT NOT NULL DEFAULT 'user' 
-        )
-    """)
-    conn.commit()
-    conn.close()
+def add_journal_entries(letters, year, template_path, render_backend):
+    """
+    Journals letters (dicts with the Letters fields plus 'replacements') as pending, owned by this
+    process, and sets letter['journal_id'] on each. Call it inside the transaction that reserved their numbers.
+    """
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    lease_expires = time.time() + JOURNAL_LEASE_SECONDS
+    with transaction() as conn:
+        for letter in letters:
+            letter_data = {field: letter[field] for field in _JOURNAL_LETTER_FIELDS}
+            letter_data['replacements'] = letter['replacements']
+            cursor = conn.execute("""
+                INSERT INTO GenerationJournal (letter_code_prefix, letter_year, letter_code_number, letter_code_persian, file_path, template_path,
+                                               render_backend, letter_data, state, created_at, owner, lease_expires)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (letter['letter_code_prefix'], year, letter['letter_code_number'], letter['letter_code_persian'], letter['file_path'],
+                  template_path, render_backend, json.dumps(letter_data, ensure_ascii=False), JOURNAL_PENDING, created_at,
+                  JOURNAL_OWNER, lease_expires))
+            letter['journal_id'] = cursor.lastrowid
+
+def renew_journal_leases():
+    """Extends the lease of every unfinished journal row this process owns. Returns the number of rows."""
+    with transaction() as conn:
+        cursor = conn.execute("UPDATE GenerationJournal SET lease_expires = ? WHERE owner = ? AND state IN (?, ?)",
+                              (time.time() + JOURNAL_LEASE_SECONDS, JOURNAL_OWNER, JOURNAL_PENDING, JOURNAL_RECOVERING))
+    return cursor.rowcount
+
+def _expired_journal_condition():
+    # Pending or being recovered, and the owner has stopped renewing the lease (or the row predates leases)
+    return "state IN (?, ?) AND (lease_expires IS NULL OR lease_expires < ?)", [JOURNAL_PENDING, JOURNAL_RECOVERING, time.time()]
+
+def claim_expired_journal_entries():
+    """
+    Takes over the journaled letters whose owner is gone (lease expired) for recovery by this
+    process. Each row is claimed on its own, with a conditional update, so two instances never
+    recover the same letter. Returns the claimed letters, in number order, as dicts ready for generation_pipeline.
+    """
+    condition, params = _expired_journal_condition()
+    rows = get_connection().execute(f"""
+        SELECT id, letter_year, template_path, render_backend, letter_data FROM GenerationJournal
+        WHERE {condition} ORDER BY letter_code_prefix, letter_year, letter_code_number
+    """, params).fetchall()
+    letters = []
+    for row in rows:
+        condition, params = _expired_journal_condition()
+        with transaction() as conn:
+            claimed = conn.execute(f"UPDATE GenerationJournal SET state = ?, owner = ?, lease_expires = ? WHERE id = ? AND {condition}",
+                                   [JOURNAL_RECOVERING, JOURNAL_OWNER, time.time() + JOURNAL_LEASE_SECONDS, row['id']] + params).rowcount
+        if not claimed:
+            continue
+        letter = json.loads(row['letter_data'])
+        letter.update(journal_id=row['id'], letter_year=row['letter_year'], template_path=row['template_path'], render_backend=row['render_backend'])
+        letters.append(letter)
+    return letters
+
+def release_journal_entries(letters):
+    """Hands claimed letters that could not be recovered back as pending, free for the next recovery."""
+    with transaction() as conn:
+        conn.executemany("UPDATE GenerationJournal SET state = ?, lease_expires = NULL WHERE id = ? AND owner = ?",
+                         [(JOURNAL_PENDING, letter['journal_id'], JOURNAL_OWNER) for letter in letters])
+
+def count_expired_journal_entries():
+    condition, params = _expired_journal_condition()
+    return get_connection().execute(f"SELECT COUNT(*) FROM GenerationJournal WHERE {condition}", params).fetchone()[0]
+
+def commit_journal_entries(letters):
+    """
+    Inserts the Letters rows of journaled letters whose files are in place and clears their journal
+    rows, atomically. Raises RuntimeError, storing nothing, if this process no longer owns all of
+    them (another instance took them over after the lease ran out).
+    """
+    with transaction() as conn:
+        owned = conn.executemany("DELETE FROM GenerationJournal WHERE id = ? AND owner = ? AND state != ?",
+                                 [(letter['journal_id'], JOURNAL_OWNER, JOURNAL_ABANDONED) for letter in letters]).rowcount
+        if owned != len(letters):
+            raise RuntimeError("نامه‌ها توسط نمونه دیگری از برنامه بازیابی شده‌اند.")
+        insert_letters_bulk(letters)
+
+def abandon_journal_entry(letter, year, error):
+    """
+    Gives up on a journaled letter that could not be written. If its number is still the last one
+    issued, the journal row is removed and the counter stepped back, so no number is skipped;
+    otherwise the row is kept as 'abandoned' to account for the gap.
+    Returns False, changing nothing, if this process doesn't own the row (any more).
+    """
+    with transaction("IMMEDIATE") as conn:
+        deleted = conn.execute("""
+            DELETE FROM GenerationJournal
+            WHERE id = ? AND owner = ? AND state != ?
+              AND (SELECT last_number FROM LetterSequences WHERE prefix = ? AND year = ?) = ?
+        """, (letter['journal_id'], JOURNAL_OWNER, JOURNAL_ABANDONED, letter['letter_code_prefix'], year, letter['letter_code_number'])).rowcount
+        if deleted:
+            conn.execute("UPDATE LetterSequences SET last_number = last_number - 1 WHERE prefix = ? AND year = ?",
+                         (letter['letter_code_prefix'], year))
+            return True
+        return conn.execute("UPDATE GenerationJournal SET state = ?, error = ? WHERE id = ? AND owner = ? AND state != ?",
+                            (JOURNAL_ABANDONED, str(error), letter['journal_id'], JOURNAL_OWNER, JOURNAL_ABANDONED)).rowcount > 0
 
 # --- User Management Functions ---
 def _hash_password(password):
@@ -90,65 +536,50 @@ def _hash_password(password):
 
 def get_user_by_username(username):
     """Retrieves a user by username."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, password_hash, role FROM Users WHERE username = ?", (username,))
+    cursor = get_connection().execute("SELECT id, username, password_hash, role FROM Users WHERE username = ?", (username,))
     user = cursor.fetchone()
-    conn.close()
     return dict(user) if user else None
 
 def get_user_by_id(user_id):
-    """Retrieves a user by ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, role, password_hash FROM Users WHERE id = ?", (user_id,)) 
+    """Retrieves a user by ID (through the entity cache)."""
+    return cached_entity("Users", user_id, _load_user)
+
+def _load_user(user_id):
+    cursor = get_connection().execute("SELECT id, username, role, password_hash FROM Users WHERE id = ?", (user_id,))
     user = cursor.fetchone()
-    conn.close()
     return dict(user) if user else None
 
 def add_user(username, password, role):
     """Adds a new user to the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     hashed_password = _hash_password(password)
     try:
-        cursor.execute("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, ?)",
-                       (username, hashed_password, role))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, ?)",
+                         (username, hashed_password, role))
         return True
-    except sqlite3.IntegrityError: 
+    except sqlite3.IntegrityError:
         messagebox.showerror("خطا", "نام کاربری از قبل موجود است.")
         return False
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در افزودن کاربر: {e}")
         return False
-    finally:
-        conn.close()
 
 def verify_password(username, password):
     """Verifies a user's password."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT password_hash FROM Users WHERE username = ?", (username,))
+    cursor = get_connection().execute("SELECT password_hash FROM Users WHERE username = ?", (username,))
     user_data = cursor.fetchone()
-    conn.close()
     if user_data:
         return user_data['password_hash'] == _hash_password(password)
     return False
 
 def get_all_users():
     """Retrieves all users from the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, role FROM Users ORDER BY username")
+    cursor = get_connection().execute("SELECT id, username, role FROM Users ORDER BY username")
     users = cursor.fetchall()
-    conn.close()
     return [dict(user) for user in users]
 
 def update_user(user_id, username=None, role=None):
     """Updates an existing user's username or role."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     updates = []
     params = []
     if username:
@@ -157,16 +588,16 @@ def update_user(user_id, username=None, role=None):
     if role:
         updates.append("role = ?")
         params.append(role)
-    
+
     if not updates:
-        conn.close()
-        return False 
+        return False
 
     query = f"UPDATE Users SET {', '.join(updates)} WHERE id = ?"
     params.append(user_id)
     try:
-        cursor.execute(query, tuple(params))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute(query, tuple(params))
+        invalidate_entity("Users", user_id)
         return True
     except sqlite3.IntegrityError:
         messagebox.showerror("خطا", "نام کاربری از قبل موجود است.")
@@ -174,48 +605,38 @@ def update_user(user_id, username=None, role=None):
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در ویرایش کاربر: {e}")
         return False
-    finally:
-        conn.close()
 
 def update_user_password(user_id, new_password):
     """Updates a user's password."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     hashed_password = _hash_password(new_password)
     try:
-        cursor.execute("UPDATE Users SET password_hash = ? WHERE id = ?", (hashed_password, user_id))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("UPDATE Users SET password_hash = ? WHERE id = ?", (hashed_password, user_id))
+        invalidate_entity("Users", user_id)
         return True
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در تغییر رمز عبور: {e}")
         return False
-    finally:
-        conn.close()
 
 def delete_user(user_id):
     """Deletes a user from the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM Users WHERE id = ?", (user_id,))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("DELETE FROM Users WHERE id = ?", (user_id,))
+        invalidate_entity("Users", user_id)
         return True
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در حذف کاربر: {e}")
         return False
-    finally:
-        conn.close()
 
 # --- Letter Management Functions ---
-# Modified insert_letter to accept individual parameters
-def insert_letter(letter_code_prefix, letter_code_number, letter_code_persian, type, date_gregorian, date_shamsi_persian, subject, organization_id, contact_id, body, file_path, user_id):
-    """Inserts a new letter record into the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO Letters (letter_code_prefix, letter_code_number, letter_code_persian, type, date_shamsi_persian, subject, body, organization_id, contact_id, file_path, user_id, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+def save_letter_record(letter_code_prefix, letter_code_number, letter_code_persian, type, date_gregorian, date_shamsi_persian, subject, organization_id, contact_id, body, file_path, user_id):
+    """Inserts a new letter record and raises on failure (for callers off the Tk thread)."""
+    with transaction() as conn:
+        conn.execute("""
+            INSERT INTO Letters (letter_code_prefix, letter_code_number, letter_code_persian, type, date_shamsi_persian, subject, body, organization_id, contact_id, file_path, user_id, created_at,
+                                 subject_normalized, letter_code_normalized, date_shamsi, date_gregorian)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             letter_code_prefix,
             letter_code_number,
@@ -228,28 +649,60 @@ def insert_letter(letter_code_prefix, letter_code_number, letter_code_persian, t
             contact_id,
             file_path,
             user_id,
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S") # Add created_at
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"), # Add created_at
+            normalize_persian_text(subject),
+            normalize_persian_text(letter_code_persian),
+            *_letter_dates(date_shamsi_persian, date_gregorian)
         ))
-        conn.commit()
+
+# Modified insert_letter to accept individual parameters
+def insert_letter(letter_code_prefix, letter_code_number, letter_code_persian, type, date_gregorian, date_shamsi_persian, subject, organization_id, contact_id, body, file_path, user_id):
+    """Inserts a new letter record into the database."""
+    try:
+        save_letter_record(letter_code_prefix, letter_code_number, letter_code_persian, type, date_gregorian, date_shamsi_persian, subject, organization_id, contact_id, body, file_path, user_id)
         return True
     except Exception as e:
         messagebox.showerror("خطا در ذخیره نامه", f"خطا در ذخیره نامه در دیتابیس: {e}")
         return False
-    finally:
-        conn.close()
-
-def get_letters_from_db(search_term=""):
-    """Retrieves letter records from the database, optionally filtered by search term."""
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+
+def insert_letters_bulk(letters):
+    """
+    Inserts many letter records (dicts with the insert_letter() arguments) with one executemany
+    in a single transaction. Raises on failure instead of showing a message box, since batch
+    generation calls it off the Tk thread.
+    """
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT INTO Letters (letter_code_prefix, letter_code_number, letter_code_persian, type, date_shamsi_persian, subject, body, organization_id, contact_id, file_path, user_id, created_at,
+                                 subject_normalized, letter_code_normalized, date_shamsi, date_gregorian)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(
+            letter['letter_code_prefix'],
+            letter['letter_code_number'],
+            letter['letter_code_persian'],
+            letter['type'],
+            letter['date_shamsi_persian'],
+            letter['subject'],
+            letter['body'],
+            letter['organization_id'],
+            letter['contact_id'],
+            letter['file_path'],
+            letter['user_id'],
+            created_at,
+            normalize_persian_text(letter['subject']),
+            normalize_persian_text(letter['letter_code_persian']),
+            *_letter_dates(letter['date_shamsi_persian'], letter.get('date_gregorian'))
+        ) for letter in letters])
+
+def get_letters_from_db(search_term="", filters=None):
+    """Retrieves letter records from the database, optionally filtered by search term and a filter dict (LETTER_FILTER_KEYS)."""
     query = """
-        SELECT 
-            L.*, 
+        SELECT
+            L.*,
             L.type AS letter_type_raw, -- Explicitly select and alias the 'type' column
-            O.name AS organization_name, 
-            C.first_name, 
+            O.name AS organization_name,
+            C.first_name,
             C.last_name,
             C.title AS contact_title,
             U.username AS created_by_username
@@ -258,123 +711,330 @@ def get_letters_from_db(search_term=""):
         LEFT JOIN Contacts C ON L.contact_id = C.id
         LEFT JOIN Users U ON L.user_id = U.id
     """
-    
-    params = []
-    conditions = []
 
-    if search_term:
-        search_pattern = f"%{search_term}%"
-        conditions.append("(L.letter_code_persian LIKE ? OR L.type LIKE ? OR L.subject LIKE ? OR O.name LIKE ? OR C.first_name LIKE ? OR C.last_name LIKE ? OR U.username LIKE ?)")
-        params.extend([search_pattern, search_pattern, search_pattern, search_pattern, search_pattern, search_pattern, search_pattern])
+    conditions, params = _letter_filter_conditions(filters)
+
+    search = _letter_search_condition(search_term)
+    if search:
+        conditions.append(search[0])
+        params.extend(search[1])
 
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
-    
-    query += " ORDER BY L.date_shamsi_persian DESC, L.id DESC"
 
-    cursor.execute(query, tuple(params))
+    query += f" ORDER BY {LETTER_DATE_KEY} DESC, L.id DESC"
+
+    cursor = get_connection().execute(query, tuple(params))
     letters = cursor.fetchall()
-    conn.close()
     return [dict(letter) for letter in letters]
 
 def get_letter_by_code(letter_code_display):
-    """Retrieves a single letter record by its letter code (Persian)."""
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+    """Retrieves a single letter record by its letter code (Persian or Latin digits)."""
     query = """
-        SELECT 
-            L.*, 
+        SELECT
+            L.*,
             L.type AS letter_type_raw, -- Explicitly select and alias the 'type' column
-            O.name AS organization_name, 
-            C.first_name, 
+            O.name AS organization_name,
+            C.first_name,
             C.last_name,
             C.title AS contact_title,
-            U.username AS created_by_username 
+            U.username AS created_by_username
         FROM Letters L
         LEFT JOIN Organizations O ON L.organization_id = O.id
         LEFT JOIN Contacts C ON L.contact_id = C.id
-        LEFT JOIN Users U ON L.user_id = U.id 
-        WHERE L.letter_code_persian = ?
+        LEFT JOIN Users U ON L.user_id = U.id
+        WHERE L.letter_code_normalized = ?
     """
     try:
-        cursor.execute(query, (letter_code_display,))
+        cursor = get_connection().execute(query, (normalize_persian_text(letter_code_display),))
         letter = cursor.fetchone()
         return dict(letter) if letter else None
     except Exception as e:
         messagebox.showerror("خطا در بازیابی نامه", f"خطا در بازیابی نامه با کد {letter_code_display}: {e}")
         return None
+
+ARCHIVE_PAGE_SIZE = 100
+
+# Archive column -> the expressions it is ordered by (L.id breaks ties). Each sort is served by an index,
+# except organization and contact, whose names are in the joined tables.
+ARCHIVE_SORT_KEYS = {
+    "date": (LETTER_DATE_KEY,),
+    # PREFIX-TYPE-YEAR-NUMBER compared part by part, the number as an integer (the code's year is the
+    # year of the letter's date); idx_letters_code_order
+    "code": ("L.letter_code_prefix", "L.type", f"{LETTER_DATE_KEY} / 10000", "L.letter_code_number"),
+    "type": ("L.type", LETTER_DATE_KEY),
+    "subject": ("L.subject_normalized",),
+    "organization": ("COALESCE(O.name_normalized, '')",),
+    "contact": ("COALESCE(C.first_name_normalized, '')", "COALESCE(C.last_name_normalized, '')"),
+}
+
+def _create_sort_indexes(cursor):
+    """Indexes for the archive and CRM column sorts (ARCHIVE_SORT_KEYS, ORGANIZATION_SORT_KEYS, CONTACT_SORT_KEYS)."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_code_order ON Letters (letter_code_prefix, type, substr(date_shamsi_persian, 1, 4), letter_code_number);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_type_date ON Letters (type, date_shamsi_persian);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_organizations_industry ON Organizations (industry, name);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_title ON Contacts (title, last_name, first_name);")
+
+def _order_by(expressions, descending):
+    direction = " DESC" if descending else ""
+    return " ORDER BY " + ", ".join(f"{expression}{direction}" for expression in expressions)
+
+def _letter_match_source(search_term, filters):
+    """
+    How the archive finds the letters matching search_term and filters (LETTER_FILTER_KEYS):
+    returns (FROM clause naming Letters L, conditions, params, full_text). With full_text the FROM
+    clause is the LettersFTS match and the first condition and parameter are its MATCH.
+    """
+    conditions, params = _letter_filter_conditions(filters)
+    match_expression = build_fts_query(search_term)
+    if match_expression is not None and letters_fts_available():
+        # CROSS JOIN keeps the match as the outer loop: driven by a filter's index instead, SQLite
+        # would run the whole MATCH again for every letter of that filter
+        return "FROM LettersFTS CROSS JOIN Letters L ON L.id = LettersFTS.rowid", ["LettersFTS MATCH ?"] + conditions, [match_expression] + params, True
+    search = _letter_search_condition(search_term) if match_expression else None
+    if search:
+        conditions.append(search[0])
+        params.extend(search[1])
+    return "FROM Letters L", conditions, params, False
+
+def get_letters_page(search_term="", after=None, limit=ARCHIVE_PAGE_SIZE, sort_column=None, descending=True, filters=None):
+    """
+    Retrieves one page of the letter archive using keyset pagination, limited to the letters matching
+    filters (a dict, see LETTER_FILTER_KEYS).
+    Rows are ordered by sort_column (a key of ARCHIVE_SORT_KEYS), descending or not. Without it, a search
+    term gives the full-text matches best first, and no search term gives the newest letters first (date DESC).
+    Full-text results carry a 'snippet' field.
+    'after' is the key returned with the previous page (None for the first page).
+    Returns (letters, next_after); next_after is None when there are no more rows.
+    Each page costs an index range scan, however deep into the archive it is.
+    """
+    letter_columns = """
+            L.*,
+            L.type AS letter_type_raw,
+            O.name AS organization_name,
+            C.first_name,
+            C.last_name,
+            C.title AS contact_title,
+            U.username AS created_by_username
+    """
+    joins = """
+        LEFT JOIN Organizations O ON L.organization_id = O.id
+        LEFT JOIN Contacts C ON L.contact_id = C.id
+        LEFT JOIN Users U ON L.user_id = U.id
+    """
+    from_clause, conditions, params, full_text = _letter_match_source(search_term, filters)
+    from_clause += joins
+
+    if full_text:
+        rank_expression = f"bm25(LettersFTS, {', '.join(str(w) for w in LETTERS_FTS_WEIGHTS)})"
+        letter_columns += f""",
+                {rank_expression} AS rank,
+                snippet(LettersFTS, 2, '«', '»', '…', 12) AS snippet
+        """
+
+    if full_text and sort_column is None:
+        if after is not None:
+            conditions.append(f"({rank_expression} > ? OR ({rank_expression} = ? AND L.id < ?))")
+            params.extend([after[0], after[0], after[1]])
+        order_by = " ORDER BY rank, L.id DESC"
+        key_fields = ('rank', 'id')
+    else:
+        key_expressions = ARCHIVE_SORT_KEYS[sort_column or "date"] + ("L.id",)
+        letter_columns += "".join(f", {expression} AS sort_key_{i}" for i, expression in enumerate(key_expressions))
+        if after is not None:
+            operator = "<" if descending else ">"
+            # The bound on the first key alone lets SQLite range-scan an expression index (LETTER_DATE_KEY),
+            # which it doesn't do for the row value
+            conditions.append(f"{key_expressions[0]} {operator}= ? AND ({', '.join(key_expressions)}) {operator} ({', '.join('?' * len(key_expressions))})")
+            params.extend((after[0],) + tuple(after))
+        order_by = _order_by(key_expressions, descending)
+        key_fields = tuple(f"sort_key_{i}" for i in range(len(key_expressions)))
+
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    if full_text and sort_column is not None:
+        # snippet() would otherwise run for every match before the sort: pick the page's ids first
+        # (same MATCH, keyset and order), then build the rows of that page only
+        query = (f"SELECT {letter_columns} {from_clause} WHERE LettersFTS MATCH ? AND L.id IN "
+                 f"(SELECT L.id {from_clause}{where}{order_by} LIMIT ?){order_by}")
+        params = params[:1] + params + [limit]
+    else:
+        query = f"SELECT {letter_columns} {from_clause}{where}{order_by} LIMIT ?"
+        params.append(limit)
+
+    letters = [dict(letter) for letter in get_connection().execute(query, params).fetchall()]
+    next_after = None
+    if len(letters) == limit:
+        next_after = tuple(letters[-1][field] for field in key_fields)
+    return letters, next_after
+
+def iter_letters(search_term="", filters=None, sort_column=None, descending=True):
+    """
+    Yields the letters matching search_term and filters as sqlite3.Row, in the order of the archive
+    (as get_letters_page: full-text matches best first unless sorted by a column), for exports.
+    The rows are stepped from the cursor one at a time, so any number of letters is read in
+    constant memory. Uses the calling thread's connection; iterate on one thread, and close() the
+    generator when stopping before the end.
+    """
+    from_clause, conditions, params, full_text = _letter_match_source(search_term, filters)
+    if full_text and sort_column is None:
+        order_by = f" ORDER BY bm25(LettersFTS, {', '.join(str(w) for w in LETTERS_FTS_WEIGHTS)}), L.id DESC"
+    else:
+        order_by = _order_by(ARCHIVE_SORT_KEYS[sort_column or "date"] + ("L.id",), descending)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    query = f"""
+        SELECT L.id, L.letter_code_persian, L.type, L.date_shamsi, L.date_shamsi_persian, L.date_gregorian,
+               L.subject, L.body, L.file_path, L.created_at,
+               O.name AS organization_name, C.first_name, C.last_name, C.title AS contact_title,
+               U.username AS created_by_username
+        {from_clause}
+        LEFT JOIN Organizations O ON L.organization_id = O.id
+        LEFT JOIN Contacts C ON L.contact_id = C.id
+        LEFT JOIN Users U ON L.user_id = U.id
+        {where}{order_by}
+    """
+    cursor = get_connection().execute(query, params)
+    try:
+        yield from cursor
     finally:
-        conn.close()
+        # Also when the caller stops early (generator closed): frees the statement at once
+        cursor.close()
+
+# Facets: grouped counts of the matching letters per value of each filter
+LETTER_FACETS = ("type", "month", "organization_id", "user_id")
+
+def get_letter_facets(search_term="", filters=None):
+    """
+    Counts the letters matching search_term and filters per type, per month (yyyymm, see
+    shamsi_date_display), per organization and per author, in one grouped query over the matches.
+    Returns {'total': n, 'type': {type: n}, 'month': {month: n}, 'organization_id': {id: n}, 'user_id': {id: n}}.
+    """
+    from_clause, conditions, params, _ = _letter_match_source(search_term, filters)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    grouped = " UNION ALL ".join(f"SELECT '{facet}' AS facet, {facet} AS value, COUNT(*) AS count FROM Matched GROUP BY {facet}"
+                                 for facet in LETTER_FACETS)
+    query = f"""
+        WITH Matched AS MATERIALIZED (
+            SELECT L.type, L.date_shamsi / 100 AS month, L.organization_id, L.user_id
+            {from_clause}{where}
+        )
+        {grouped}
+    """
+    facets = {facet: {} for facet in LETTER_FACETS}
+    for row in get_connection().execute(query, params):
+        facets[row['facet']][row['value']] = row['count']
+    facets['total'] = sum(facets['type'].values())
+    return facets
 
 # --- Organization and Contact functions ---
-def get_organizations_from_db(search_term=""): 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# Treeview column -> ORDER BY expressions (id breaks ties)
+ORGANIZATION_SORT_KEYS = {
+    "id": (),
+    "name": ("name",),
+    "industry": ("industry", "name"),
+    "phone": ("phone",),
+    "email": ("email",),
+    "address": ("address",),
+    "description": ("description",),
+}
+
+def get_organizations_from_db(search_term="", sort_column="name", descending=False):
+    """
+    Returns the organizations ordered by sort_column (a key of ORGANIZATION_SORT_KEYS);
+    with search_term, those whose name starts with it (normalized).
+    """
     query = "SELECT id, name, industry, phone, email, address, description FROM Organizations"
     params = []
-    if search_term:
-        query += " WHERE name LIKE ?"
-        params.append(f"%{search_term}%")
-    query += " ORDER BY name"
-    cursor.execute(query, params)
+    search = _prefix_condition("name_normalized", search_term)
+    if search:
+        query += " WHERE " + search[0]
+        params.extend(search[1])
+    query += _order_by(ORGANIZATION_SORT_KEYS[sort_column] + ("id",), descending)
+    cursor = get_connection().execute(query, params)
     orgs = cursor.fetchall()
-    conn.close()
     return [dict(org) for org in orgs]
 
+def get_organization_choices():
+    """Returns every organization's id, name and industry, by name (the selection dialogs' lists)."""
+    return get_connection().execute("SELECT id, name, industry FROM Organizations ORDER BY name").fetchall()
+
 def get_organization_by_id(org_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, industry, phone, email, address, description FROM Organizations WHERE id = ?", (org_id,))
+    """Retrieves an organization by ID (through the entity cache)."""
+    return cached_entity("Organizations", org_id, _load_organization)
+
+def _load_organization(org_id):
+    cursor = get_connection().execute("SELECT id, name, industry, phone, email, address, description FROM Organizations WHERE id = ?", (org_id,))
     org = cursor.fetchone()
-    conn.close()
     return dict(org) if org else None
 
+# Stays below SQLite's default limit on host parameters in one statement
+_ID_CHUNK_SIZE = 500
+
+def _select_by_ids(query_template, ids):
+    ids = list(dict.fromkeys(i for i in ids if i is not None))
+    rows = []
+    for chunk_start in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[chunk_start:chunk_start + _ID_CHUNK_SIZE]
+        placeholders = ", ".join("?" * len(chunk))
+        rows.extend(get_connection().execute(query_template.format(placeholders=placeholders), chunk).fetchall())
+    return rows
+
+def get_organization_names(organization_ids):
+    """Returns {id: name} for the given organization ids in as few queries as possible."""
+    rows = _select_by_ids("SELECT id, name FROM Organizations WHERE id IN ({placeholders})", organization_ids)
+    return {row['id']: row['name'] for row in rows}
+
+def get_contact_full_names(contact_ids):
+    """Returns {id: 'first last'} for the given contact ids in as few queries as possible."""
+    rows = _select_by_ids("SELECT id, first_name, last_name FROM Contacts WHERE id IN ({placeholders})", contact_ids)
+    return {row['id']: f"{row['first_name']} {row['last_name']}" for row in rows}
+
 def insert_organization(name, industry, phone, email, address, description):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Adds an organization. Returns its id, or False if it could not be added."""
     try:
-        cursor.execute("INSERT INTO Organizations (name, industry, phone, email, address, description) VALUES (?, ?, ?, ?, ?, ?)",
-                       (name, industry, phone, email, address, description))
-        conn.commit()
-        return True
+        with transaction() as conn:
+            cursor = conn.execute("INSERT INTO Organizations (name, industry, phone, email, address, description, name_normalized) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (name, industry, phone, email, address, description, normalize_persian_text(name)))
+        return cursor.lastrowid
     except sqlite3.IntegrityError:
         messagebox.showerror("خطا", "سازمانی با این نام از قبل موجود است.")
         return False
-    finally:
-        conn.close()
 
 def update_organization(org_id, name, industry, phone, email, address, description):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE Organizations SET name=?, industry=?, phone=?, email=?, address=?, description=? WHERE id=?",
-                       (name, industry, phone, email, address, description, org_id))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("UPDATE Organizations SET name=?, industry=?, phone=?, email=?, address=?, description=?, name_normalized=? WHERE id=?",
+                         (name, industry, phone, email, address, description, normalize_persian_text(name), org_id))
+        invalidate_entity("Organizations", org_id)
         return True
     except sqlite3.IntegrityError:
         messagebox.showerror("خطا", "سازمانی با این نام از قبل موجود است.")
         return False
-    finally:
-        conn.close()
 
 def delete_organization(org_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM Organizations WHERE id=?", (org_id,))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("DELETE FROM Organizations WHERE id=?", (org_id,))
+        invalidate_entity("Organizations", org_id)
+        # ON DELETE SET NULL cleared the organization of its contacts
+        invalidate_entity("Contacts")
         return True
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در حذف سازمان: {e}")
         return False
-    finally:
-        conn.close()
 
-def get_contacts_from_db(organization_id=None, search_term=""): 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+CONTACT_SORT_KEYS = {
+    "id": (),
+    "organization_id": ("O.name", "C.last_name", "C.first_name"),
+    "first_name": ("C.first_name", "C.last_name"),
+    "last_name": ("C.last_name", "C.first_name"),
+    "title": ("C.title", "C.last_name", "C.first_name"),
+    "phone": ("C.phone",),
+    "email": ("C.email",),
+    "notes": ("C.notes",),
+}
+
+def get_contacts_from_db(organization_id=None, search_term="", sort_column="last_name", descending=False):
+    """Returns the contacts (optionally of one organization) ordered by sort_column (a key of CONTACT_SORT_KEYS)."""
     query = """
         SELECT C.id, C.organization_id, C.first_name, C.last_name, C.title, C.phone, C.email, C.notes, O.name AS organization_name
         FROM Contacts C
@@ -386,67 +1046,132 @@ def get_contacts_from_db(organization_id=None, search_term=""):
     if organization_id is not None:
         conditions.append("C.organization_id = ?")
         params.append(organization_id)
-    
-    if search_term:
-        search_pattern = f"%{search_term}%"
-        conditions.append("(C.first_name LIKE ? OR C.last_name LIKE ? OR C.title LIKE ? OR O.name LIKE ?)")
-        params.extend([search_pattern, search_pattern, search_pattern, search_pattern])
+
+    # The term is a prefix of the first or last name, the title or the organization's name (normalized)
+    search = _any_prefix_condition(("C.first_name_normalized", "C.last_name_normalized", "C.title_normalized"), search_term)
+    if search:
+        organization_search = _prefix_condition("name_normalized", search_term)
+        conditions.append(f"({search[0]} OR C.organization_id IN (SELECT id FROM Organizations WHERE {organization_search[0]}))")
+        params.extend(search[1] + organization_search[1])
 
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
-    
-    query += " ORDER BY C.last_name, C.first_name"
-    
-    cursor.execute(query, params)
+
+    query += _order_by(CONTACT_SORT_KEYS[sort_column] + ("C.id",), descending)
+
+    cursor = get_connection().execute(query, params)
     contacts = cursor.fetchall()
-    conn.close()
     return [dict(contact) for contact in contacts]
 
+def get_contact_choices():
+    """Returns every contact's id, name, organization and title, by first name (the selection dialogs' lists)."""
+    return get_connection().execute("SELECT id, first_name, last_name, organization_id, title FROM Contacts ORDER BY first_name, last_name").fetchall()
+
 def get_contact_by_id(contact_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, organization_id, first_name, last_name, title, phone, email, notes FROM Contacts WHERE id = ?", (contact_id,))
+    """Retrieves a contact by ID (through the entity cache)."""
+    return cached_entity("Contacts", contact_id, _load_contact)
+
+def _load_contact(contact_id):
+    cursor = get_connection().execute("SELECT id, organization_id, first_name, last_name, title, phone, email, notes FROM Contacts WHERE id = ?", (contact_id,))
     contact = cursor.fetchone()
-    conn.close()
     return dict(contact) if contact else None
 
 def insert_contact(organization_id, first_name, last_name, title, phone, email, notes):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Adds a contact. Returns its id, or False if it could not be added."""
     try:
-        cursor.execute("INSERT INTO Contacts (organization_id, first_name, last_name, title, phone, email, notes) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                       (organization_id, first_name, last_name, title, phone, email, notes))
-        conn.commit()
-        return True
+        with transaction() as conn:
+            cursor = conn.execute("""
+                INSERT INTO Contacts (organization_id, first_name, last_name, title, phone, email, notes, first_name_normalized, last_name_normalized, title_normalized)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (organization_id, first_name, last_name, title, phone, email, notes,
+                  normalize_persian_text(first_name), normalize_persian_text(last_name), normalize_persian_text(title)))
+        return cursor.lastrowid
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در افزودن مخاطب: {e}")
         return False
-    finally:
-        conn.close()
 
 def update_contact(contact_id, organization_id, first_name, last_name, title, phone, email, notes):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE Contacts SET organization_id=?, first_name=?, last_name=?, title=?, phone=?, email=?, notes=? WHERE id=?",
-                       (organization_id, first_name, last_name, title, phone, email, notes, contact_id))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("""
+                UPDATE Contacts SET organization_id=?, first_name=?, last_name=?, title=?, phone=?, email=?, notes=?,
+                                    first_name_normalized=?, last_name_normalized=?, title_normalized=?
+                WHERE id=?
+            """, (organization_id, first_name, last_name, title, phone, email, notes,
+                  normalize_persian_text(first_name), normalize_persian_text(last_name), normalize_persian_text(title), contact_id))
+        invalidate_entity("Contacts", contact_id)
         return True
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در ویرایش مخاطب: {e}")
         return False
-    finally:
-        conn.close()
 
 def delete_contact(contact_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM Contacts WHERE id=?", (contact_id,))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("DELETE FROM Contacts WHERE id=?", (contact_id,))
+        invalidate_entity("Contacts", contact_id)
         return True
     except Exception as e:
         messagebox.showerror("خطا", f"خطا در حذف مخاطب: {e}")
         return False
-    finally:
-        conn.close()
+
+# --- Bulk import (crm_import_logic) ---
+# These raise instead of showing a message box: the import runs off the Tk thread.
+
+def get_organization_name_keys():
+    """Returns the set of normalized names of all organizations, for deduplicating and resolving imported rows."""
+    cursor = get_connection().execute("SELECT name_normalized FROM Organizations")
+    return {row[0] for row in cursor}
+
+def get_contact_name_keys():
+    """Returns the set of (normalized organization name or "", normalized first name, normalized last name) of all contacts."""
+    cursor = get_connection().execute("""
+        SELECT COALESCE(O.name_normalized, ''), C.first_name_normalized, C.last_name_normalized
+        FROM Contacts C
+        LEFT JOIN Organizations O ON C.organization_id = O.id
+    """)
+    return {tuple(row) for row in cursor}
+
+def insert_organizations_bulk(organizations):
+    """
+    Inserts many organizations (dicts with the insert_organization() arguments) with one executemany
+    in a single transaction. Names already in the table are skipped (INSERT OR IGNORE).
+    Returns the number of rows inserted.
+    """
+    with transaction() as conn:
+        return _insert_organizations(conn, organizations)
+
+def _insert_organizations(conn, organizations):
+    changes_before = conn.total_changes
+    conn.executemany("""
+        INSERT OR IGNORE INTO Organizations (name, industry, phone, email, address, description, name_normalized)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(
+        org['name'], org.get('industry'), org.get('phone'), org.get('email'), org.get('address'), org.get('description'),
+        normalize_persian_text(org['name'])
+    ) for org in organizations])
+    return conn.total_changes - changes_before
+
+def insert_contacts_bulk(contacts, organizations=()):
+    """
+    Inserts many contacts (dicts with the insert_contact() arguments) with one executemany, in one
+    transaction together with insert_organizations_bulk(organizations). A contact whose
+    organization_id is None but which has an 'organization_name' is attached to the organization of
+    that (normalized) name, so it can refer to one inserted in the same call. Raises on failure.
+    Returns (organizations inserted, contacts inserted).
+    """
+    with transaction() as conn:
+        organizations_added = _insert_organizations(conn, organizations) if organizations else 0
+        conn.executemany("""
+            INSERT INTO Contacts (organization_id, first_name, last_name, title, phone, email, notes, first_name_normalized, last_name_normalized, title_normalized)
+            VALUES (COALESCE(?, (SELECT id FROM Organizations WHERE name_normalized = ? ORDER BY id LIMIT 1)), ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(
+            contact.get('organization_id'),
+            normalize_persian_text(contact['organization_name']) if contact.get('organization_name') else None,
+            contact['first_name'], contact['last_name'], contact.get('title'), contact.get('phone'), contact.get('email'), contact.get('notes'),
+            normalize_persian_text(contact['first_name']), normalize_persian_text(contact['last_name']), normalize_persian_text(contact.get('title'))
+        ) for contact in contacts])
+    return organizations_added, len(contacts)
+
+# Every function above reports its calls and latency to the query stats (see query_stats)
+instrument_module_functions(globals())
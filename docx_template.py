@@ -0,0 +1,318 @@
+import copy
+import os
+import re
+import struct
+import threading
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+from lxml import etree
+
+PLACEHOLDER_PATTERN = re.compile(r"\[\[[A-Z0-9_]+\]\]")
+
+# Rendering backends, selectable in the settings
+RENDER_BACKEND_PYTHON_DOCX = "python-docx"
+RENDER_BACKEND_STREAMING = "streaming"
+RENDER_BACKENDS = (RENDER_BACKEND_PYTHON_DOCX, RENDER_BACKEND_STREAMING)
+
+# Parts of the package the streaming backend fills in; every other member is copied as is
+STREAMED_PART_PATTERN = re.compile(r"word/(document|header\d*|footer\d*)\.xml")
+
+
+def iter_story_paragraphs(document):
+    """
+    Yields every paragraph of the document: body, tables (nested ones too), text boxes,
+    and each header/footer part exactly once (sections linked to the previous one share a part).
+    Walks the XML directly, so no header/footer definitions are added to the document.
+    """
+    story_elements = [document.element.body]
+    for rel in document.part.rels.values():
+        if rel.reltype in (RT.HEADER, RT.FOOTER) and not rel.is_external:
+            story_elements.append(rel.target_part.element)
+    for element in story_elements:
+        for p in element.iter(qn('w:p')):
+            yield Paragraph(p, None)
+
+
+def isolate_placeholders(paragraph):
+    """
+    Moves every [[PLACEHOLDER]] of the paragraph into a run of its own, keeping the formatting
+    of the run it started in, even when Word had split it across several runs.
+    Returns (placeholder, run) pairs.
+    """
+    full_text = "".join(run.text for run in paragraph.runs)
+    if "[[" not in full_text:
+        return []
+    # Last match first, so the character offsets of earlier matches stay valid
+    return [(match.group(0), _isolate(paragraph, match.group(0), match.start(), match.end()))
+            for match in reversed(list(PLACEHOLDER_PATTERN.finditer(full_text)))]
+
+def _isolate(paragraph, placeholder, start, end):
+    """Rewrites the runs covering full_text[start:end] so the placeholder is alone in one run."""
+    runs = paragraph.runs
+    offsets = []
+    position = 0
+    for run in runs:
+        offsets.append(position)
+        position += len(run.text)
+
+    first = next(i for i in range(len(runs)) if offsets[i] + len(runs[i].text) > start)
+    last = next(i for i in range(first, len(runs)) if offsets[i] + len(runs[i].text) >= end)
+
+    first_run, last_run = runs[first], runs[last]
+    prefix = first_run.text[:start - offsets[first]]
+    suffix = last_run.text[end - offsets[last]:]
+
+    slot_element = copy.deepcopy(first_run._r)
+    first_run._r.addnext(slot_element)
+    slot_run = Run(slot_element, paragraph)
+    slot_run.text = placeholder
+
+    if last == first:
+        if suffix:
+            suffix_element = copy.deepcopy(first_run._r)
+            slot_element.addnext(suffix_element)
+            Run(suffix_element, paragraph).text = suffix
+    else:
+        for run in runs[first + 1:last]:
+            run._r.getparent().remove(run._r)
+        if suffix:
+            last_run.text = suffix
+        else:
+            last_run._r.getparent().remove(last_run._r)
+
+    if prefix:
+        first_run.text = prefix
+    else:
+        first_run._r.getparent().remove(first_run._r)
+    return slot_run
+
+
+class CompiledTemplate:
+    """
+    A letterhead template parsed once and ready to be filled many times.
+
+    On compile every [[PLACEHOLDER]] in the body, tables, headers and footers is moved into a
+    run of its own (see isolate_placeholders). Rendering then only sets the text of those runs
+    and saves the document, instead of re-opening the file and searching every paragraph for
+    every placeholder.
+    """
+
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self.document = Document(template_path)
+        self.slots = {} # placeholder -> list of Runs holding it
+        self._lock = threading.Lock() # The document is shared, so renders run one at a time
+
+        for paragraph in iter_story_paragraphs(self.document):
+            for placeholder, slot_run in isolate_placeholders(paragraph):
+                self.slots.setdefault(placeholder, []).append(slot_run)
+
+    def render(self, output_path, replacements):
+        """Fills the placeholders from replacements and writes the letter to output_path.
+        Placeholders missing from replacements are left as they are in the template."""
+        with self._lock:
+            for placeholder, runs in self.slots.items():
+                value = replacements.get(placeholder, placeholder)
+                for run in runs:
+                    run.text = str(value)
+            try:
+                self.document.save(output_path)
+            except Exception:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+
+
+def _run_content_xml(text):
+    """
+    The XML python-docx writes for run.text = text: tabs become <w:tab/>, each \r or \n a <w:br/>,
+    and text with leading/trailing spaces gets xml:space="preserve".
+    """
+    pieces = []
+    for index, line in enumerate(re.split(r"[\r\n]", text)):
+        if index:
+            pieces.append("<w:br/>")
+        for tab_index, segment in enumerate(line.split("\t")):
+            if tab_index:
+                pieces.append("<w:tab/>")
+            if segment:
+                preserve = ' xml:space="preserve"' if len(segment.strip()) < len(segment) else ""
+                pieces.append(f"<w:t{preserve}>{escape(segment)}</w:t>")
+    return "".join(pieces).encode("utf-8")
+
+
+class _ZipMember:
+    def __init__(self, info, raw_data=None, chunks=None):
+        self.info = info
+        self.raw_data = raw_data # Compressed bytes exactly as stored in the template
+        self.chunks = chunks # For streamed parts: literal bytes alternating with placeholder names
+
+
+class StreamingTemplate:
+    """
+    Template backend that renders without building a python-docx Document per letter.
+
+    On compile the document, header and footer parts are parsed once, their placeholders isolated
+    exactly as CompiledTemplate does, and the serialized XML is split into literal byte chunks around
+    the placeholder slots. Every other zip member is kept as its raw compressed bytes.
+    Rendering streams the parts into the new zip, writing the filled-in values between the chunks,
+    and copies the other members byte for byte without decompressing them. The XML written is the
+    same as the python-docx backend's.
+    """
+
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self.members = []
+
+        with open(template_path, "rb") as template_file, zipfile.ZipFile(template_file) as template_zip:
+            for info in template_zip.infolist():
+                if STREAMED_PART_PATTERN.fullmatch(info.filename):
+                    self.members.append(_ZipMember(info, chunks=self._compile_part(template_zip.read(info))))
+                else:
+                    self.members.append(_ZipMember(info, raw_data=_read_raw_member(template_file, info)))
+        self._placeholders = {chunk for member in self.members if member.chunks for chunk in member.chunks[1::2]}
+
+    def _compile_part(self, part_xml):
+        root = parse_xml(part_xml)
+        marker_prefix = f"slot-{uuid.uuid4().hex}-"
+        slot_names = []
+        for p in root.iter(qn('w:p')):
+            for placeholder, slot_run in isolate_placeholders(Paragraph(p, None)):
+                slot_run.text = f"{marker_prefix}{len(slot_names)}"
+                slot_names.append(placeholder)
+
+        # Serialized the way python-docx saves a part
+        xml_bytes = etree.tostring(root, encoding="UTF-8", standalone=True)
+        slot_pattern = re.compile(rb"<w:t(?: [^>]*)?>" + re.escape(marker_prefix.encode()) + rb"(\d+)</w:t>")
+        chunks = []
+        position = 0
+        for match in slot_pattern.finditer(xml_bytes):
+            chunks.append(xml_bytes[position:match.start()])
+            chunks.append(slot_names[int(match.group(1))])
+            position = match.end()
+        chunks.append(xml_bytes[position:])
+        return chunks
+
+    def render(self, output_path, replacements):
+        """Writes the letter to output_path; placeholders missing from replacements are left as they are."""
+        values = {placeholder: _run_content_xml(str(replacements.get(placeholder, placeholder))) for placeholder in self._placeholders}
+        try:
+            with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as output_zip:
+                for member in self.members:
+                    if member.chunks is None:
+                        _write_raw_member(output_zip, member.info, member.raw_data)
+                        continue
+                    part_info = zipfile.ZipInfo(member.info.filename, member.info.date_time)
+                    part_info.compress_type = zipfile.ZIP_DEFLATED
+                    with output_zip.open(part_info, "w") as part_stream:
+                        for piece in _fill_chunks(member.chunks, values):
+                            part_stream.write(piece)
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+
+def _fill_chunks(chunks, values):
+    """Puts the values between the literal chunks (even positions are XML, odd ones placeholder names)."""
+    pieces = [memoryview(chunk) if index % 2 == 0 else values[chunk] for index, chunk in enumerate(chunks)]
+    for index in range(1, len(pieces), 2):
+        if not pieces[index] and pieces[index - 1][-5:] == b"<w:r>" and pieces[index + 1][:6] == b"</w:r>":
+            # A run left with no children is serialized by lxml as <w:r/>
+            pieces[index - 1] = pieces[index - 1][:-5]
+            pieces[index] = b"<w:r/>"
+            pieces[index + 1] = pieces[index + 1][6:]
+    return pieces
+
+def _read_raw_member(template_file, info):
+    """Reads the still-compressed data of a zip member, skipping its local file header."""
+    template_file.seek(info.header_offset)
+    header = template_file.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    template_file.seek(info.header_offset + 30 + name_length + extra_length)
+    return template_file.read(info.compress_size)
+
+def _write_raw_member(output_zip, info, raw_data):
+    """Appends a member to output_zip from its already-compressed bytes (zipfile has no public API for this)."""
+    info = copy.copy(info)
+    info.flag_bits &= ~0x08 # Sizes and CRC go in the local header; no data descriptor follows the data
+    info.extra = b""
+    info.header_offset = output_zip.fp.tell()
+    output_zip.fp.write(info.FileHeader())
+    output_zip.fp.write(raw_data)
+    output_zip.filelist.append(info)
+    output_zip.NameToInfo[info.filename] = info
+    output_zip.start_dir = output_zip.fp.tell()
+    output_zip._didModify = True
+
+
+_TEMPLATE_CLASSES = {
+    RENDER_BACKEND_PYTHON_DOCX: CompiledTemplate,
+    RENDER_BACKEND_STREAMING: StreamingTemplate,
+}
+
+# Compiled templates keyed on (absolute path, backend); an entry is recompiled when the file's mtime changes
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+def get_compiled_template(template_path, backend=RENDER_BACKEND_PYTHON_DOCX):
+    """Returns the compiled template for template_path, compiling it on first use or after it changed on disk."""
+    template_class = _TEMPLATE_CLASSES.get(backend, CompiledTemplate)
+    path = os.path.abspath(template_path)
+    mtime = os.path.getmtime(path)
+    with _template_cache_lock:
+        cached = _template_cache.get((path, template_class))
+        if cached and cached[0] == mtime:
+            return cached[1]
+    compiled = template_class(path)
+    with _template_cache_lock:
+        _template_cache[(path, template_class)] = (mtime, compiled)
+    return compiled
+
+def clear_template_cache():
+    with _template_cache_lock:
+        _template_cache.clear()
+
+def render_docx_template(template_path, output_path, replacements, backend=RENDER_BACKEND_PYTHON_DOCX):
+    """Writes a new document at output_path from the (cached) template with the placeholders filled in."""
+    get_compiled_template(template_path, backend).render(output_path, replacements)
+
+def render_docx_template_atomic(template_path, output_path, replacements, backend=RENDER_BACKEND_PYTHON_DOCX):
+    """
+    Like render_docx_template, but output_path only ever holds a complete document: the letter is
+    written to a temporary file next to it, flushed to disk, and then renamed over output_path.
+    """
+    temp_path = f"{output_path}.partial"
+    try:
+        render_docx_template(template_path, temp_path, replacements, backend)
+        with open(temp_path, "rb+") as written_file:
+            os.fsync(written_file.fileno())
+        os.replace(temp_path, output_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _fsync_directory(os.path.dirname(os.path.abspath(output_path)))
+
+def _fsync_directory(directory):
+    # Makes the rename itself durable; directories can't be opened for fsync on Windows
+    try:
+        directory_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(directory_fd)
@@ -0,0 +1,106 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+from connection_manager import get_connection
+
+# Rows kept per table; the least recently used are evicted first
+ENTITY_CACHE_SIZE = 1000
+
+
+class EntityCache:
+    """
+    Keeps recently read Organizations, Contacts and Users rows by id, so lookups of rows that rarely
+    change don't go to SQLite every time.
+
+    Coherence:
+    - database.py invalidates rows after committing a change to them (write-through).
+    - Changes committed through any other connection, including another instance of the application
+      on the same database file, are detected with PRAGMA data_version, which SQLite increments on a
+      connection whenever some other connection has committed: the whole cache is then dropped.
+    - A row read while an invalidation happens is not stored, so a lookup racing with a write never
+      caches the old row.
+    Only rows that exist are cached, so inserts need no invalidation.
+    """
+
+    def __init__(self, max_size=ENTITY_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._data_versions = weakref.WeakKeyDictionary()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table, entity_id, load):
+        """Returns a copy of the row of table with entity_id, calling load(entity_id) on a miss (None if there is none)."""
+        self._check_data_version()
+        key = _cache_key(entity_id)
+        with self._lock:
+            rows = self._tables.setdefault(table, OrderedDict())
+            row = rows.get(key)
+            if row is not None:
+                rows.move_to_end(key)
+                self.hits += 1
+                return dict(row)
+            self.misses += 1
+            generation = self._generation
+
+        row = load(entity_id)
+        if row is not None:
+            with self._lock:
+                if generation == self._generation:
+                    rows[key] = dict(row)
+                    if len(rows) > self.max_size:
+                        rows.popitem(last=False)
+        return row
+
+    def invalidate(self, table, entity_id=None):
+        """Drops one row of table, or the whole table when entity_id is None."""
+        with self._lock:
+            self._generation += 1
+            rows = self._tables.get(table)
+            if rows is None:
+                return
+            if entity_id is None:
+                rows.clear()
+            else:
+                rows.pop(_cache_key(entity_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._tables.clear()
+
+    def _check_data_version(self):
+        conn = get_connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        with self._lock:
+            # data_version is per connection: compare with what this connection reported last time.
+            # A connection seen for the first time can't tell what changed before it was opened, so when no
+            # other open connection has been watching (e.g. after the pool was closed) the cache is dropped.
+            previous = self._data_versions.get(conn)
+            stale = previous != data_version if previous is not None else not self._data_versions
+            self._data_versions[conn] = data_version
+        if stale:
+            self.clear()
+
+
+def _cache_key(entity_id):
+    # Ids come as ints from the database and as strings from Treeview values
+    try:
+        return int(entity_id)
+    except (TypeError, ValueError):
+        return entity_id
+
+
+_default_cache = EntityCache()
+
+def get_entity_cache():
+    return _default_cache
+
+def cached_entity(table, entity_id, load):
+    return _default_cache.get(table, entity_id, load)
+
+def invalidate_entity(table, entity_id=None):
+    _default_cache.invalidate(table, entity_id)
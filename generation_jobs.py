@@ -0,0 +1,271 @@
+import itertools
+import os
+import queue
+import threading
+import traceback
+import tkinter as tk
+from datetime import datetime
+from tkinter import ttk, messagebox
+
+from connection_manager import release_connection
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_STATE_LABELS = {
+    JOB_QUEUED: "در صف",
+    JOB_RUNNING: "در حال تولید",
+    JOB_DONE: "انجام شد",
+    JOB_FAILED: "ناموفق",
+}
+
+POLL_INTERVAL_MS = 100
+SHUTDOWN_WAIT_SECONDS = 30
+
+
+class GenerationJob:
+    """
+    One queued call. file_path_of(result), if given, names the file a finished job produced;
+    it is stored as file_path, which the jobs panel shows and opens (None for jobs without a file).
+    """
+
+    def __init__(self, job_id, description, func, args, kwargs, on_done, on_error, file_path_of=None):
+        self.id = job_id
+        self.description = description
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.file_path_of = file_path_of
+        self.state = JOB_QUEUED
+        self.result = None
+        self.file_path = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+
+    def _set_result(self, result):
+        self.result = result
+        if self.file_path_of:
+            self.file_path = self.file_path_of(result)
+
+
+class GenerationJobQueue:
+    """
+    Runs letter generation jobs in the background so the UI never waits for them.
+
+    Jobs run one at a time, in submission order, on a single worker thread, so letters are numbered in
+    the order they were requested. A job holds no lock while its letter is rendered: the number is
+    reserved, the file written and the record stored in separate short steps (generation_pipeline).
+    State changes (queued -> running -> done/failed) are handed to the Tk thread by polling with
+    after(); listeners and the jobs' on_done/on_error callbacks always run there.
+    """
+
+    def __init__(self, root, status_bar_ref=None):
+        self.root = root
+        self.status_bar_ref = status_bar_ref
+        self._jobs = []
+        self._pending = queue.Queue()
+        self._events = queue.Queue()
+        self._listeners = []
+        self._ids = itertools.count(1)
+        self._stopped = False
+
+        self._worker = threading.Thread(target=self._worker_loop, name="letter-generation", daemon=True)
+        self._worker.start()
+        self._poll_id = self.root.after(POLL_INTERVAL_MS, self._poll_events)
+
+    def add_listener(self, callback):
+        """callback(job) is called on the Tk thread whenever a job is added or changes state."""
+        self._listeners.append(callback)
+
+    def submit(self, description, func, *args, on_done=None, on_error=None, file_path_of=None, **kwargs):
+        """Queues func(*args, **kwargs) and returns the GenerationJob right away (file_path_of: see GenerationJob)."""
+        job = GenerationJob(next(self._ids), description, func, args, kwargs, on_done, on_error, file_path_of)
+        self._jobs.append(job)
+        self._pending.put(job)
+        self._notify(job)
+        return job
+
+    def jobs(self):
+        return list(self._jobs)
+
+    def active_count(self):
+        return sum(1 for job in self._jobs if job.state in (JOB_QUEUED, JOB_RUNNING))
+
+    def clear_finished(self):
+        """Forgets jobs that are done or failed (the jobs panel's clear button)."""
+        self._jobs = [job for job in self._jobs if job.state in (JOB_QUEUED, JOB_RUNNING)]
+
+    def _worker_loop(self):
+        while True:
+            job = self._pending.get()
+            if job is None:
+                release_connection()
+                return
+            self._events.put((job, JOB_RUNNING, None, None))
+            try:
+                result = job.func(*job.args, **job.kwargs)
+                self._events.put((job, JOB_DONE, result, None))
+            except Exception as e:
+                traceback.print_exc()
+                self._events.put((job, JOB_FAILED, None, e))
+
+    def _poll_events(self):
+        while True:
+            try:
+                job, state, result, error = self._events.get_nowait()
+            except queue.Empty:
+                break
+            job.state = state
+            if state in (JOB_DONE, JOB_FAILED):
+                job._set_result(result)
+                job.error = error
+                job.finished_at = datetime.now()
+            self._notify(job)
+            try:
+                if state == JOB_DONE and job.on_done:
+                    job.on_done(result)
+                elif state == JOB_FAILED and job.on_error:
+                    job.on_error(error)
+            except Exception:
+                traceback.print_exc()
+        if not self._stopped:
+            self._poll_id = self.root.after(POLL_INTERVAL_MS, self._poll_events)
+
+    def _notify(self, job):
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception:
+                traceback.print_exc()
+        if self.status_bar_ref:
+            active = self.active_count()
+            if job.state == JOB_FAILED:
+                self.status_bar_ref.config(text=f"تولید نامه ناموفق بود: {job.description}")
+            elif active:
+                self.status_bar_ref.config(text=f"در حال تولید نامه... ({active} کار در صف)")
+            elif job.state == JOB_DONE:
+                self.status_bar_ref.config(text=f"نامه تولید شد: {job.description}")
+
+    def shutdown(self):
+        """Lets the running job finish (up to SHUTDOWN_WAIT_SECONDS); jobs still queued are dropped."""
+        self._stopped = True
+        try:
+            self.root.after_cancel(self._poll_id)
+        except Exception:
+            pass
+        while True:
+            try:
+                self._pending.get_nowait()
+            except queue.Empty:
+                break
+        self._pending.put(None)
+        self._worker.join(timeout=SHUTDOWN_WAIT_SECONDS)
+
+
+# The queue the UI modules submit to; installed by the App once the root window exists.
+_default_job_queue = None
+
+def set_default_job_queue(job_queue):
+    global _default_job_queue
+    _default_job_queue = job_queue
+
+def get_default_job_queue():
+    return _default_job_queue
+
+def submit_generation_job(description, func, *args, on_done=None, on_error=None, file_path_of=None, **kwargs):
+    """
+    Queues func on the default generation queue and returns the job.
+    Without a queue (e.g. before the App exists) the job runs synchronously before returning.
+    """
+    if _default_job_queue is not None:
+        return _default_job_queue.submit(description, func, *args, on_done=on_done, on_error=on_error, file_path_of=file_path_of, **kwargs)
+    job = GenerationJob(0, description, func, args, kwargs, on_done, on_error, file_path_of)
+    try:
+        job._set_result(func(*args, **kwargs))
+        job.state = JOB_DONE
+    except Exception as e:
+        job.error = e
+        job.state = JOB_FAILED
+        if not on_error:
+            raise
+        on_error(e)
+        return job
+    if on_done:
+        on_done(job.result)
+    return job
+
+
+class GenerationJobsPanel(ttk.LabelFrame):
+    """Lists the generation jobs with their state; lets the user open a finished letter."""
+
+    def __init__(self, parent, job_queue):
+        super().__init__(parent, text="کارهای تولید نامه", padding="5")
+        self.job_queue = job_queue
+
+        self.treeview = ttk.Treeview(self, columns=("id", "description", "state", "time", "detail"), show="headings", height=4)
+        self.treeview.heading("id", text="#")
+        self.treeview.heading("description", text="شرح")
+        self.treeview.heading("state", text="وضعیت")
+        self.treeview.heading("time", text="زمان")
+        self.treeview.heading("detail", text="فایل / خطا")
+        self.treeview.column("id", width=40, stretch=tk.NO)
+        self.treeview.column("description", width=250)
+        self.treeview.column("state", width=100, stretch=tk.NO)
+        self.treeview.column("time", width=70, stretch=tk.NO)
+        self.treeview.column("detail", width=350)
+        self.treeview.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.treeview.bind("<Double-1>", lambda event: self._open_selected())
+
+        button_frame = ttk.Frame(self)
+        button_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=5)
+        ttk.Button(button_frame, text="باز کردن فایل", command=self._open_selected).pack(fill=tk.X, pady=2)
+        ttk.Button(button_frame, text="پاک کردن موارد پایان‌یافته", command=self._clear_finished).pack(fill=tk.X, pady=2)
+
+        job_queue.add_listener(self._on_job_changed)
+        for job in job_queue.jobs():
+            self._on_job_changed(job)
+
+    def _on_job_changed(self, job):
+        if not self.treeview.winfo_exists():
+            return
+        if job.state == JOB_DONE:
+            detail = job.file_path or ""
+        elif job.state == JOB_FAILED:
+            detail = str(job.error)
+        else:
+            detail = ""
+        values = (job.id, job.description, JOB_STATE_LABELS[job.state], job.created_at.strftime("%H:%M:%S"), detail)
+        iid = str(job.id)
+        if self.treeview.exists(iid):
+            self.treeview.item(iid, values=values)
+        else:
+            self.treeview.insert("", 0, iid=iid, values=values)
+
+    def _open_selected(self):
+        selected_item = self.treeview.focus()
+        if not selected_item:
+            messagebox.showwarning("انتخاب کار", "لطفاً یک کار را انتخاب کنید.")
+            return
+        job = next((job for job in self.job_queue.jobs() if str(job.id) == selected_item), None)
+        if job is None or job.state != JOB_DONE:
+            messagebox.showwarning("باز کردن فایل", "فایل این کار هنوز آماده نیست.")
+            return
+        if not job.file_path:
+            messagebox.showinfo("باز کردن فایل", "این کار فایلی تولید نمی‌کند.")
+            return
+        try:
+            os.startfile(job.file_path)
+        except Exception as e:
+            messagebox.showerror("خطا", f"خطا در باز کردن فایل: {e}")
+
+    def _clear_finished(self):
+        self.job_queue.clear_finished()
+        remaining = {str(job.id) for job in self.job_queue.jobs()}
+        for iid in self.treeview.get_children():
+            if iid not in remaining:
+                self.treeview.delete(iid)
@@ -0,0 +1,124 @@
+"""
+Crash-safe letter generation, in three steps:
+
+1. reserve_journaled_letters: the letter numbers are reserved and the letters recorded as pending
+   in GenerationJournal, in one transaction.
+2. write_letter_file: the .docx is written to a temporary file, fsynced and renamed into place,
+   so the final path never holds a half-written document.
+3. finalize_letters: the Letters rows are inserted and the journal rows removed, in one transaction.
+
+If the application dies anywhere in between, recover_generation_journal() finishes the pending
+letters on the next start: letters whose file is already in place only get their Letters row,
+the rest are rendered again from the journaled data. Completed work is never redone and no
+reserved number is lost. Journal rows belong to the process that wrote them, which keeps their
+lease alive from a heartbeat thread; recovery only takes over rows whose lease has run out, so
+an instance starting up never finishes letters another running instance is still writing.
+
+A letter is a dict with the Letters fields (letter_code_prefix, letter_code_number,
+letter_code_persian, type, date_shamsi_persian, subject, body, organization_id, contact_id,
+file_path, user_id) plus 'replacements' for the template.
+"""
+
+import os
+import threading
+import time
+import traceback
+import zipfile
+
+from connection_manager import transaction
+from database import (JOURNAL_LEASE_SECONDS, allocate_letter_numbers, add_journal_entries, renew_journal_leases, claim_expired_journal_entries,
+                      release_journal_entries, count_expired_journal_entries, commit_journal_entries, abandon_journal_entry)
+from docx_template import render_docx_template_atomic
+
+
+_heartbeat_lock = threading.Lock()
+_heartbeat_thread = None
+
+def _renew_leases_forever():
+    while True:
+        time.sleep(JOURNAL_LEASE_SECONDS / 4)
+        try:
+            renew_journal_leases()
+        except Exception:
+            # e.g. the database is busy: the next beat is still well within the lease
+            traceback.print_exc()
+
+def _start_heartbeat():
+    """Starts, once per process, the daemon thread that keeps this process's journal leases alive."""
+    global _heartbeat_thread
+    with _heartbeat_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_renew_leases_forever, name="journal-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+def reserve_journaled_letters(prefix, year, count, build_letter, template_path, render_backend):
+    """
+    Reserves count consecutive numbers for (prefix, year) and journals the letters
+    build_letter(index, sequence_number) returns for them, all in one transaction.
+    Returns the letters, each with its 'journal_id' set.
+    """
+    _start_heartbeat()
+    with transaction("IMMEDIATE"):
+        first_number = allocate_letter_numbers(prefix, year, count)
+        letters = [build_letter(index, first_number + index) for index in range(count)]
+        add_journal_entries(letters, year, template_path, render_backend)
+    for letter in letters:
+        letter.update(letter_year=year, template_path=template_path, render_backend=render_backend)
+    return letters
+
+def write_letter_file(letter):
+    """Writes the letter's .docx atomically (temporary file, fsync, rename)."""
+    render_docx_template_atomic(letter['template_path'], letter['file_path'], letter['replacements'], letter['render_backend'])
+
+def finalize_letters(letters):
+    """Stores the Letters rows of letters whose files are written and clears them from the journal."""
+    if letters:
+        commit_journal_entries(letters)
+
+def abandon_letters(failures):
+    """
+    Gives up on letters that could not be written, given as (letter, error) pairs: their journal
+    rows are dropped or marked abandoned and their files removed. Handled from the highest number
+    down, so failures at the end of a range give their numbers back. A letter another instance has
+    taken over is left alone, file included.
+    """
+    for letter, error in sorted(failures, key=lambda failure: failure[0]['letter_code_number'], reverse=True):
+        if abandon_journal_entry(letter, letter['letter_year'], error) and os.path.exists(letter['file_path']):
+            os.remove(letter['file_path'])
+
+def _is_complete_docx(file_path):
+    # Files only reach their final path by an atomic rename, but a file copied there by hand could be anything
+    if not os.path.exists(file_path) or not zipfile.is_zipfile(file_path):
+        return False
+    with zipfile.ZipFile(file_path) as docx_zip:
+        return "word/document.xml" in docx_zip.namelist()
+
+def has_pending_letters():
+    """True if letters left by an instance that is no longer running wait for recovery."""
+    return count_expired_journal_entries() > 0
+
+def recover_generation_journal():
+    """
+    Finishes the letters left pending by an interrupted run (journal rows whose lease expired),
+    claiming each first. Returns (recovered, failed): the recovered letters and (letter, error)
+    pairs for letters that still could not be finished (they go back to pending and are retried
+    on the next start).
+    """
+    _start_heartbeat()
+    recovered = []
+    failed = []
+    for letter in claim_expired_journal_entries():
+        try:
+            if not _is_complete_docx(letter['file_path']):
+                save_directory = os.path.dirname(letter['file_path'])
+                if save_directory and not os.path.exists(save_directory):
+                    os.makedirs(save_directory)
+                write_letter_file(letter)
+            finalize_letters([letter])
+            recovered.append(letter)
+        except Exception as e:
+            print(f"DEBUG: Could not recover letter {letter['letter_code_persian']}: {e}")
+            failed.append((letter, e))
+    if failed:
+        release_journal_entries([letter for letter, _ in failed])
+    return recovered, failed
@@ -1,7 +1,10 @@
 import os
+import re
+import bisect
 from tkinter import messagebox, Toplevel, ttk, Label, SUNKEN, W # Importing required Tkinter components
 from docx import Document
 from docx.shared import Inches # این را اگر لازم داشتید نگه دارید، فعلاً برای جایگزینی مستقیم لازم نیست
+from docx_template import iter_story_paragraphs
 import jdatetime # For Persian date conversion
 from datetime import datetime # For Gregorian year in filename
 import tkinter as tk # For tk.END etc.
@@ -21,75 +24,70 @@ def convert_numbers_to_persian(text):
     mapping = str.maketrans(english_numbers, persian_numbers)
     return text.translate(mapping)
 
+def _replace_in_paragraph(paragraph, pattern, replacements):
+    """
+    Replaces every match of pattern in one paragraph, touching only the runs that hold it.
+    The run texts are merged once and matched in one regex pass; each match is mapped back to
+    its runs, the replacement goes into the run where the match starts (keeping its formatting)
+    and the rest of the match is cut out of the runs after it.
+    """
+    runs = paragraph.runs
+    if not runs:
+        return
+    texts = [run.text for run in runs]
+    full_text = "".join(texts)
+    matches = list(pattern.finditer(full_text))
+    if not matches:
+        return
+
+    run_starts = []
+    position = 0
+    for text in texts:
+        run_starts.append(position)
+        position += len(text)
+
+    changed = set()
+    # Last match first: edits only happen at or after the current match, so the offsets of earlier ones stay valid
+    for match in reversed(matches):
+        start, end = match.span()
+        first = bisect.bisect_right(run_starts, start) - 1
+        last = bisect.bisect_right(run_starts, end - 1) - 1
+        # Empty runs share a start offset with the run after them; step over them
+        while not texts[first] and first < last:
+            first += 1
+
+        new_text = replacements[match.group(0)]
+        if first == last:
+            offset = start - run_starts[first]
+            texts[first] = texts[first][:offset] + new_text + texts[first][offset + end - start:]
+        else:
+            texts[first] = texts[first][:start - run_starts[first]] + new_text
+            for i in range(first + 1, last):
+                texts[i] = ""
+            texts[last] = texts[last][end - run_starts[last]:]
+            changed.update(range(first + 1, last + 1))
+        changed.add(first)
+
+    for i in changed:
+        runs[i].text = texts[i]
+
 # CHANGED: More robust text replacement function for DOCX
 def replace_text_in_docx(doc_path, replacements):
     """
     Finds and replaces text in a .docx document including headers, footers, and tables.
-    Handles placeholders that might be split across multiple runs within a paragraph/cell.
+    Handles placeholders that might be split across multiple runs within a paragraph/cell,
+    and keeps the formatting of the runs around them.
+    All placeholders are found in one pass per paragraph, so the cost grows with the size of
+    the document rather than with paragraphs x placeholders.
     """
     try:
         document = Document(doc_path)
-
-        def _replace_in_paragraph(paragraph, replacements_dict):
-            """Helper to replace text in a single paragraph, handling runs."""
-            full_text = paragraph.text
-            for old_text, new_text in replacements_dict.items():
-                if old_text in full_text:
-                    # Simple replacement on paragraph.text if the whole placeholder is there
-                    # This might lose formatting across runs if the placeholder was split.
-                    # For more complex cases, iterating and rebuilding runs is needed.
-                    # For now, let's assume placeholders are mostly contiguous.
-                    
-                    # A more robust approach for fragmented placeholders:
-                    # 1. Collect all runs' text.
-                    # 2. Join them to form the full paragraph text.
-                    # 3. Perform replacement on the full text.
-                    # 4. Clear existing runs.
-                    # 5. Add new run(s) with the replaced text, trying to preserve some formatting.
-                    
-                    # Simplified approach (might lose some formatting for split placeholders but more likely to replace)
-                    for run in paragraph.runs:
-                        if old_text in run.text: # If a run itself contains the old_text
-                            run.text = run.text.replace(old_text, new_text)
-                        # More complex: if placeholder spans across runs, we need to handle it differently
-                        # For now, we rely on the paragraph.text replacement or partial run replacement.
-                        
-                    # After checking individual runs, try full paragraph text replacement as a fallback/primary
-                    # This often works because paragraph.text concatenates all run texts
-                    paragraph.text = paragraph.text.replace(old_text, new_text)
-
-
-        # Replace in main document body paragraphs
-        for paragraph in document.paragraphs:
-            _replace_in_paragraph(paragraph, replacements)
-
-        # Replace in tables within the main body
-        for table in document.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        _replace_in_paragraph(paragraph, replacements)
-
-        # Replace in headers and footers
-        for section in document.sections:
-            # Header
-            if section.header:
-                for paragraph in section.header.paragraphs:
-                    _replace_in_paragraph(paragraph, replacements)
-                for table in section.header.tables: # Headers can have tables too
-                    for row in table.rows:
-                        for cell in row.cells:
-                            for paragraph in cell.paragraphs:
-                                _replace_in_paragraph(paragraph, replacements)
-            # Footer
-            if section.footer:
-                for paragraph in section.footer.paragraphs:
-                    _replace_in_paragraph(paragraph, replacements)
-                for table in section.footer.tables: # Footers can have tables too
-                    for row in table.rows:
-                        for cell in row.cells:
-                            for paragraph in cell.paragraphs:
-                                _replace_in_paragraph(paragraph, replacements)
+        replacements = {old_text: str(new_text) for old_text, new_text in replacements.items() if old_text}
+        if replacements:
+            # Longest first, so a key that is a prefix of another can't shadow it
+            pattern = re.compile("|".join(re.escape(old_text) for old_text in sorted(replacements, key=len, reverse=True)))
+            for paragraph in iter_story_paragraphs(document):
+                _replace_in_paragraph(paragraph, pattern, replacements)
 
         document.save(doc_path)
         return True
@@ -98,28 +96,18 @@ def replace_text_in_docx(doc_path, replacements):
         return False
 
 
-def sort_column(tree, col, reverse):
-    """Sorts a Treeview column."""
-    l = [(tree.set(k, col), k) for k in tree.get_children('')]
-
-    if col == "date": # Assuming 'date' is the column with Shamsi dates
-        def sort_shamsi_date(item):
-            try:
-                parts = item[0].split('/')
-                # Return a tuple (year, month, day) for correct sorting
-                return (int(parts[0]), int(parts[1]), int(parts[2]))
-            except (ValueError, IndexError):
-                # Handle cases where date format is unexpected, place them at the beginning or end
-                return (0, 0, 0) if reverse else (9999, 12, 31)
-        l.sort(key=sort_shamsi_date, reverse=reverse)
-    elif col == "id": # Treat ID as integer for numeric sort
-        l.sort(key=lambda x: int(x[0]) if str(x[0]).isdigit() else (0 if reverse else float('inf')), reverse=reverse)
-    else: # Default string sort for others
-        l.sort(key=lambda x: x[0].lower() if isinstance(x[0], str) else x[0], reverse=reverse) # Corrected lambda
-
-    # Rearrange items in the Treeview
-    for index, (val, k) in enumerate(l):
-        tree.move(k, '', index)
+_SORT_ARROWS = (" ▲", " ▼")
+
+def show_sort_indicator(tree, col, descending):
+    """Marks col's heading with the sort direction (▲ ascending, ▼ descending) and clears the other headings' marks."""
+    for column in tree["columns"]:
+        text = tree.heading(column, "text")
+        for arrow in _SORT_ARROWS:
+            if text.endswith(arrow):
+                text = text[:-len(arrow)]
+        if column == col:
+            text += _SORT_ARROWS[1] if descending else _SORT_ARROWS[0]
+        tree.heading(column, text=text)
 
 # progress_window and show/hide functions (already provided in your helpers.py)
 progress_window = None
@@ -0,0 +1,101 @@
+from persian_text import normalize_persian_text
+
+DEBOUNCE_MS = 300
+
+# Keys that don't change the entry text and shouldn't trigger a search
+_NAVIGATION_KEYS = {
+    "Left", "Right", "Up", "Down", "Home", "End", "Prior", "Next", "Tab",
+    "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R", "Escape",
+}
+
+
+class LiveSearch:
+    """
+    Search-as-you-type for an Entry.
+    Typing (re)starts a debounce timer; search_callback(term) runs once the user pauses
+    for debounce_ms, or immediately on <Return>. Repeated fires with an unchanged term are skipped.
+    Cancelling an in-flight query is left to search_callback (query_executor channels do that).
+    """
+
+    def __init__(self, entry, search_callback, debounce_ms=DEBOUNCE_MS):
+        self.entry = entry
+        self.search_callback = search_callback
+        self.debounce_ms = debounce_ms
+        self._after_id = None
+        self._last_term = entry.get()
+
+        entry.bind("<KeyRelease>", self._on_key_release, add="+")
+        entry.bind("<Return>", lambda event: self.fire_now(), add="+")
+        entry.bind("<<Paste>>", lambda event: self._schedule(), add="+")
+        entry.bind("<<Cut>>", lambda event: self._schedule(), add="+")
+
+    def _on_key_release(self, event):
+        if event.keysym in _NAVIGATION_KEYS or event.keysym == "Return":
+            return
+        self._schedule()
+
+    def _schedule(self):
+        self._cancel_timer()
+        self._after_id = self.entry.after(self.debounce_ms, self._fire)
+
+    def _cancel_timer(self):
+        if self._after_id is not None:
+            self.entry.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _fire(self, force=False):
+        self._after_id = None
+        if not self.entry.winfo_exists():
+            return
+        term = self.entry.get().strip()
+        if term == self._last_term and not force:
+            return
+        self._last_term = term
+        self.search_callback(term)
+
+    def fire_now(self):
+        """Runs the search right away (used by <Return> and the search buttons)."""
+        self._cancel_timer()
+        self._fire(force=True)
+
+
+class NarrowingCache:
+    """
+    Remembers the last complete result set of a search box so that typing more characters
+    can be answered by filtering it in memory instead of re-querying.
+    A new term narrows the cached one when it starts with it; the cached rows are then
+    filtered with matcher(row, term), which must agree with the query's own matching rule.
+    'scope' holds any other filter the result depends on (e.g. an organization id).
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.term = None
+        self.scope = None
+        self.rows = None
+
+    def store(self, term, rows, scope=None):
+        self.term = term
+        self.rows = rows
+        self.scope = scope
+
+    def clear(self):
+        self.term = None
+        self.rows = None
+        self.scope = None
+
+    def narrow(self, term, scope=None):
+        """Returns the rows matching term filtered from the cache, or None if a query is needed."""
+        if self.rows is None or scope != self.scope or term == self.term or not term.startswith(self.term):
+            return None
+        rows = [row for row in self.rows if self.matcher(row, term)]
+        self.store(term, rows, scope)
+        return rows
+
+
+def prefix_matcher(*fields):
+    """Matcher reproducing the database searches: the normalized term starts one of fields, normalized (see persian_text)."""
+    def _matches(row, term):
+        prefix = normalize_persian_text(term)
+        return any(normalize_persian_text(row[field]).startswith(prefix) for field in fields)
+    return _matches
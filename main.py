@@ -9,17 +9,31 @@ from ttkthemes import ThemedTk
 from datetime import datetime
 import sys 
 import traceback 
+import multiprocessing
 
 # Import logical modules
-from database import create_tables, get_db_connection, insert_letter, get_letters_from_db, get_letter_by_code, get_all_users, add_user, verify_password 
+from database import get_organization_by_id, get_contact_by_id, get_organization_choices, get_contact_choices, insert_letter, get_letters_from_db, get_letter_by_code, get_all_users, add_user, verify_password 
 from settings_manager import load_settings, save_settings, company_name, full_company_name, default_save_path, letterhead_template_path, set_default_settings
+import settings_manager
+from docx_template import RENDER_BACKENDS
 # Import the new dialog classes from crm_logic
-from crm_logic import populate_organizations_treeview, populate_contacts_treeview, on_edit_organization_button, on_delete_organization_button, on_edit_contact_button, on_delete_contact_button, on_organization_select, on_contact_select, AddOrganizationDialog, AddContactDialog 
+from crm_logic import populate_organizations_treeview, populate_contacts_treeview, on_edit_organization_button, on_delete_organization_button, on_edit_contact_button, on_delete_contact_button, on_organization_select, on_contact_select, AddOrganizationDialog, AddContactDialog, sort_treeview 
 from letter_generation_logic import on_generate_letter, generate_letter_number
-from archive_logic import update_history_treeview, on_search_archive_button, on_open_letter_button
+from batch_generation_logic import BatchGenerationDialog
+from crm_import_logic import CrmImportDialog
+from generation_jobs import GenerationJobQueue, GenerationJobsPanel, set_default_job_queue
+from generation_pipeline import has_pending_letters, recover_generation_journal
+from archive_logic import update_history_treeview, on_search_archive_button, on_open_letter_button, sort_history_treeview, get_history_query, ArchiveFilterPanel
+from archive_export_logic import ArchiveExportDialog, ask_export_path
 
 # Import LoginWindow
 from login_manager import LoginWindow 
+from connection_manager import close_all_connections
+from schema_migrations import migrate_database
+from query_executor import QueryExecutor, set_default_executor
+from query_stats import QueryDiagnosticsWindow, set_slow_query_threshold
+from live_search import LiveSearch
+from autocomplete import AutocompleteEntry, get_organization_index, get_contact_index
 
 # --- Global Configurations (can be loaded from settings_manager) ---
 BASE_FONT = ("Arial", 10)
@@ -45,6 +59,25 @@ def check_and_create_initial_admin(root_window):
     print("DEBUG: check_and_create_initial_admin پایان یافت.")
 
 
+def _organization_index_entry(org):
+    """(id, search text, sort key, row) of an organization for the autocomplete index."""
+    return org['id'], org['name'], (org['name'],), {'id': org['id'], 'name': org['name'], 'industry': org['industry']}
+
+def _contact_index_entry(contact, org_data_map):
+    """(id, search text, sort key, row) of a contact for the autocomplete index; contacts are also found by organization name and title."""
+    org_name = org_data_map.get(contact['organization_id'])
+    row = {'id': contact['id'], 'first_name': contact['first_name'], 'last_name': contact['last_name'],
+           'title': contact['title'], 'org_name': org_name, 'organization_id': contact['organization_id']}
+    text = " ".join(part for part in (contact['first_name'], contact['last_name'], contact['title'], org_name) if part)
+    return contact['id'], text, (contact['last_name'] or "", contact['first_name'] or ""), row
+
+def _in_organization(organization_id):
+    """accept() for AutocompleteIndex.search limiting contacts to one organization (None: no limit)."""
+    if organization_id is None:
+        return None
+    return lambda contact: str(contact['organization_id']) == str(organization_id)
+
+
 class App:
     def __init__(self, root, user_id, user_role, login_window_instance): 
         self.root = root
@@ -59,6 +92,19 @@ class App:
         self.status_bar = tk.Label(self.root, text="آماده به کار", bd=1, relief=tk.SUNKEN, anchor=tk.W, font=("Arial", 9))
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
+        # پرس‌وجوهای کندتر از این آستانه در گزارش پرس‌وجوهای کند ثبت می‌شوند
+        set_slow_query_threshold(settings_manager.slow_query_threshold_ms)
+
+        # --- اجرای پرس‌وجوهای پایگاه داده در پس‌زمینه تا رابط کاربری قفل نشود ---
+        self.query_executor = QueryExecutor(self.root, self.status_bar)
+        set_default_executor(self.query_executor)
+
+        # --- صف تولید نامه: نامه‌ها در پس‌زمینه تولید می‌شوند و وضعیت آن‌ها در پنل کارها نمایش داده می‌شود ---
+        self.generation_jobs = GenerationJobQueue(self.root, self.status_bar)
+        set_default_job_queue(self.generation_jobs)
+        self.jobs_panel = GenerationJobsPanel(self.root, self.generation_jobs)
+        self.jobs_panel.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
+
         # --- نوت‌بوک (رابط تب‌دار) را ابتدا مقداردهی اولیه کنید ---
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(expand=True, fill="both", padx=10, pady=10)
@@ -96,6 +142,27 @@ class App:
         self.selected_contact_id = None
         self.selected_contact_name = None
 
+        # نامه‌هایی که در اجرای قبلی (مثلاً به‌دلیل بسته‌شدن ناگهانی برنامه) نیمه‌کاره ماندند تکمیل شوند
+        self._recover_pending_letters()
+
+    def _recover_pending_letters(self):
+        """Queues the journal recovery pass if an earlier run left letters unfinished."""
+        if not has_pending_letters():
+            return
+
+        def _on_done(result):
+            recovered, failed = result
+            message = f"{len(recovered)} نامه نیمه‌کاره از اجرای قبلی تکمیل و در آرشیو ثبت شد."
+            if failed:
+                message += f"\n{len(failed)} نامه هنوز قابل تکمیل نیست و در اجرای بعدی دوباره بررسی می‌شود:\n"
+                message += "\n".join(f"{letter['letter_code_persian']}: {error}" for letter, error in failed[:10])
+                messagebox.showwarning("بازیابی نامه‌ها", message, parent=self.root)
+            else:
+                messagebox.showinfo("بازیابی نامه‌ها", message, parent=self.root)
+            self.update_history_treeview(letter_types_map=self.letter_types)
+
+        self.generation_jobs.submit("بازیابی نامه‌های نیمه‌کاره", recover_generation_journal, on_done=_on_done)
+
     def apply_user_permissions(self):
         """محدودیت‌های UI را بر اساس نقش کاربر اعمال می‌کند."""
         if self.user_role == 'user':
@@ -152,17 +219,18 @@ class App:
         ttk.Label(org_search_frame, text="جستجوی سازمان:").pack(side=tk.RIGHT, padx=5)
         self.org_search_entry = ttk.Entry(org_search_frame)
         self.org_search_entry.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
-        self.org_search_entry.bind("<Return>", lambda event: populate_organizations_treeview(self.org_search_entry.get(), self.org_treeview, self.status_bar))
-        ttk.Button(org_search_frame, text="جستجو", command=lambda: populate_organizations_treeview(self.org_search_entry.get(), self.org_treeview, self.status_bar)).pack(side=tk.RIGHT, padx=5)
+        self.org_live_search = LiveSearch(self.org_search_entry, lambda term: populate_organizations_treeview(term, self.org_treeview, self.status_bar))
+        ttk.Button(org_search_frame, text="جستجو", command=self.org_live_search.fire_now).pack(side=tk.RIGHT, padx=5)
 
         # Buttons for Organizations (Add, Edit, Delete)
         org_buttons_frame = ttk.Frame(org_frame)
         org_buttons_frame.pack(fill=tk.X, pady=5)
         # Modified "Add Organization" button to open the dialog
-        ttk.Button(org_buttons_frame, text="افزودن سازمان", command=lambda: AddOrganizationDialog(self.root, populate_organizations_treeview, self.populate_org_contact_combos, self.org_treeview, self.status_bar)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(org_buttons_frame, text="افزودن سازمان", command=lambda: AddOrganizationDialog(self.root, populate_organizations_treeview, self.apply_crm_change, self.org_treeview, self.status_bar)).pack(side=tk.RIGHT, padx=5)
         # Note: Edit and Delete buttons will still operate on treeview selection
         ttk.Button(org_buttons_frame, text="ویرایش سازمان", command=lambda: self._open_edit_organization_dialog()).pack(side=tk.RIGHT, padx=5)
-        ttk.Button(org_buttons_frame, text="حذف سازمان", command=lambda: on_delete_organization_button(self.root, self.org_treeview, self.contact_treeview, self.status_bar, self.populate_org_contact_combos)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(org_buttons_frame, text="حذف سازمان", command=lambda: on_delete_organization_button(self.root, self.org_treeview, self.contact_treeview, self.status_bar, self.apply_crm_change)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(org_buttons_frame, text="ورود از فایل...", command=lambda: CrmImportDialog(self.root, self.status_bar, self._on_crm_import_finished)).pack(side=tk.RIGHT, padx=5)
 
 
         # Organizations Treeview
@@ -176,13 +244,13 @@ class App:
         org_scrollbar.config(command=self.org_treeview.yview)
 
         # Define columns and headings
-        self.org_treeview.heading("id", text="شناسه", command=lambda: self._sort_column(self.org_treeview, "id", False))
-        self.org_treeview.heading("name", text="نام سازمان", command=lambda: self._sort_column(self.org_treeview, "name", False))
-        self.org_treeview.heading("industry", text="صنعت", command=lambda: self._sort_column(self.org_treeview, "industry", False))
-        self.org_treeview.heading("phone", text="تلفن", command=lambda: self._sort_column(self.org_treeview, "phone", False))
-        self.org_treeview.heading("email", text="ایمیل", command=lambda: self._sort_column(self.org_treeview, "email", False))
-        self.org_treeview.heading("address", text="آدرس", command=lambda: self._sort_column(self.org_treeview, "address", False))
-        self.org_treeview.heading("description", text="توضیحات", command=lambda: self._sort_column(self.org_treeview, "description", False))
+        self.org_treeview.heading("id", text="شناسه", command=lambda: self._sort_column(self.org_treeview, "id"))
+        self.org_treeview.heading("name", text="نام سازمان", command=lambda: self._sort_column(self.org_treeview, "name"))
+        self.org_treeview.heading("industry", text="صنعت", command=lambda: self._sort_column(self.org_treeview, "industry"))
+        self.org_treeview.heading("phone", text="تلفن", command=lambda: self._sort_column(self.org_treeview, "phone"))
+        self.org_treeview.heading("email", text="ایمیل", command=lambda: self._sort_column(self.org_treeview, "email"))
+        self.org_treeview.heading("address", text="آدرس", command=lambda: self._sort_column(self.org_treeview, "address"))
+        self.org_treeview.heading("description", text="توضیحات", command=lambda: self._sort_column(self.org_treeview, "description"))
 
         # Set column widths (adjust as needed)
         self.org_treeview.column("id", width=30, stretch=tk.NO)
@@ -219,17 +287,17 @@ class App:
         ttk.Label(contact_search_frame, text="جستجوی مخاطب:").pack(side=tk.RIGHT, padx=5)
         self.contact_search_entry = ttk.Entry(contact_search_frame)
         self.contact_search_entry.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
-        self.contact_search_entry.bind("<Return>", lambda event: populate_contacts_treeview(None, self.contact_search_entry.get(), self.contact_treeview, self.status_bar))
-        ttk.Button(contact_search_frame, text="جستجو", command=lambda: populate_contacts_treeview(None, self.contact_search_entry.get(), self.contact_treeview, self.status_bar)).pack(side=tk.RIGHT, padx=5)
+        self.contact_live_search = LiveSearch(self.contact_search_entry, lambda term: populate_contacts_treeview(None, term, self.contact_treeview, self.status_bar))
+        ttk.Button(contact_search_frame, text="جستجو", command=self.contact_live_search.fire_now).pack(side=tk.RIGHT, padx=5)
 
         # Buttons for Contacts (Add, Edit, Delete)
         contact_buttons_frame = ttk.Frame(contact_frame)
         contact_buttons_frame.pack(fill=tk.X, pady=5)
         # Modified "Add Contact" button to open the dialog
-        ttk.Button(contact_buttons_frame, text="افزودن مخاطب", command=lambda: AddContactDialog(self.root, populate_contacts_treeview, self.populate_org_contact_combos, self.contact_treeview, self.status_bar)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(contact_buttons_frame, text="افزودن مخاطب", command=lambda: AddContactDialog(self.root, populate_contacts_treeview, self.apply_crm_change, self.contact_treeview, self.status_bar)).pack(side=tk.RIGHT, padx=5)
         # Note: Edit and Delete buttons will still operate on treeview selection
         ttk.Button(contact_buttons_frame, text="ویرایش مخاطب", command=lambda: self._open_edit_contact_dialog()).pack(side=tk.RIGHT, padx=5)
-        ttk.Button(contact_buttons_frame, text="حذف مخاطب", command=lambda: on_delete_contact_button(self.root, self.contact_treeview, self.status_bar, self.populate_org_contact_combos)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(contact_buttons_frame, text="حذف مخاطب", command=lambda: on_delete_contact_button(self.root, self.contact_treeview, self.status_bar, self.apply_crm_change)).pack(side=tk.RIGHT, padx=5)
 
         # Contacts Treeview
         contact_tree_frame = ttk.Frame(contact_frame)
@@ -242,14 +310,14 @@ class App:
         contact_scrollbar.config(command=self.contact_treeview.yview)
 
         # Define columns and headings
-        self.contact_treeview.heading("id", text="شناسه", command=lambda: self._sort_column(self.contact_treeview, "id", False))
-        self.contact_treeview.heading("organization_id", text="شناسه سازمان", command=lambda: self._sort_column(self.contact_treeview, "organization_id", False))
-        self.contact_treeview.heading("first_name", text="نام", command=lambda: self._sort_column(self.contact_treeview, "first_name", False))
-        self.contact_treeview.heading("last_name", text="نام خانوادگی", command=lambda: self._sort_column(self.contact_treeview, "last_name", False))
-        self.contact_treeview.heading("title", text="عنوان", command=lambda: self._sort_column(self.contact_treeview, "title", False))
-        self.contact_treeview.heading("phone", text="تلفن", command=lambda: self._sort_column(self.contact_treeview, "phone", False))
-        self.contact_treeview.heading("email", text="ایمیل", command=lambda: self._sort_column(self.contact_treeview, "email", False))
-        self.contact_treeview.heading("notes", text="یادداشت‌ها", command=lambda: self._sort_column(self.contact_treeview, "notes", False))
+        self.contact_treeview.heading("id", text="شناسه", command=lambda: self._sort_column(self.contact_treeview, "id"))
+        self.contact_treeview.heading("organization_id", text="شناسه سازمان", command=lambda: self._sort_column(self.contact_treeview, "organization_id"))
+        self.contact_treeview.heading("first_name", text="نام", command=lambda: self._sort_column(self.contact_treeview, "first_name"))
+        self.contact_treeview.heading("last_name", text="نام خانوادگی", command=lambda: self._sort_column(self.contact_treeview, "last_name"))
+        self.contact_treeview.heading("title", text="عنوان", command=lambda: self._sort_column(self.contact_treeview, "title"))
+        self.contact_treeview.heading("phone", text="تلفن", command=lambda: self._sort_column(self.contact_treeview, "phone"))
+        self.contact_treeview.heading("email", text="ایمیل", command=lambda: self._sort_column(self.contact_treeview, "email"))
+        self.contact_treeview.heading("notes", text="یادداشت‌ها", command=lambda: self._sort_column(self.contact_treeview, "notes"))
 
         # Set column widths (adjust as needed)
         self.contact_treeview.column("id", width=30, stretch=tk.NO)
@@ -335,8 +403,11 @@ class App:
         self.btn_paste_body.pack(pady=5, padx=5, anchor=tk.W)
 
 
-        # Generate Button
-        ttk.Button(letter_frame, text="تولید نامه", command=self.on_generate_letter_wrapper).pack(pady=10) 
+        # Generate Buttons
+        generate_buttons_frame = ttk.Frame(letter_frame)
+        generate_buttons_frame.pack(pady=10)
+        ttk.Button(generate_buttons_frame, text="تولید نامه", command=self.on_generate_letter_wrapper).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(generate_buttons_frame, text="تولید گروهی برای چند گیرنده", command=self.on_batch_generate_wrapper).pack(side=tk.RIGHT, padx=5)
 
     # Method to paste text into the letter body
     def paste_text_to_body(self):
@@ -371,10 +442,14 @@ class App:
         search_frame = ttk.Frame(dialog_frame)
         search_frame.pack(fill=tk.X, pady=5)
         ttk.Label(search_frame, text="جستجو:").pack(side=tk.RIGHT, padx=5)
-        self.org_dialog_search_entry = ttk.Entry(search_frame)
-        self.org_dialog_search_entry.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
-        self.org_dialog_search_entry.bind("<Return>", lambda event: self._populate_org_dialog_treeview(self.org_dialog_search_entry.get()))
-        ttk.Button(search_frame, text="جستجو", command=lambda: self._populate_org_dialog_treeview(self.org_dialog_search_entry.get())).pack(side=tk.RIGHT, padx=5)
+        # Typing shows the best matches in a dropdown at once; the treeview below follows after a pause
+        org_autocomplete = AutocompleteEntry(search_frame, get_organization_index(),
+                                             on_select=lambda org: self._apply_org_selection(org['id'], org['name'], dialog),
+                                             display=lambda org: org['name'])
+        org_autocomplete.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
+        self.org_dialog_search_entry = org_autocomplete.entry
+        org_dialog_live_search = LiveSearch(self.org_dialog_search_entry, self._populate_org_dialog_treeview)
+        ttk.Button(search_frame, text="جستجو", command=org_dialog_live_search.fire_now).pack(side=tk.RIGHT, padx=5)
 
         # Treeview for organizations
         tree_frame = ttk.Frame(dialog_frame)
@@ -415,24 +490,13 @@ class App:
         self.root.wait_window(dialog)
 
     def _populate_org_dialog_treeview(self, search_term=""):
-        """Populates the organization selection dialog's treeview."""
+        """Populates the organization selection dialog's treeview from the in-memory organization index."""
+        if not self.org_dialog_treeview.winfo_exists():
+            return
         for i in self.org_dialog_treeview.get_children():
             self.org_dialog_treeview.delete(i)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        query = "SELECT id, name, industry FROM Organizations"
-        params = []
-        if search_term:
-            query += " WHERE name LIKE ?"
-            params.append(f"%{search_term}%")
-        query += " ORDER BY name"
-
-        cursor.execute(query, params)
-        organizations = cursor.fetchall()
-        conn.close()
-
-        for org in organizations:
+        for org in get_organization_index().search(search_term, limit=None):
             self.org_dialog_treeview.insert("", tk.END, values=(org['id'], org['name'], org['industry']))
 
     def _select_org_from_dialog(self, dialog):
@@ -440,25 +504,29 @@ class App:
         selected_item = self.org_dialog_treeview.focus()
         if selected_item:
             values = self.org_dialog_treeview.item(selected_item, 'values')
-            self.selected_org_id = values[0] 
-            self.selected_org_name = values[1]
+            self._apply_org_selection(values[0], values[1], dialog)
+        else:
+            messagebox.showwarning("انتخاب سازمان", "لطفاً یک سازمان را انتخاب کنید.", parent=dialog)
 
-            # Update the main entry field
-            self.entry_org_letter.config(state="normal")
-            self.entry_org_letter.delete(0, tk.END)
-            self.entry_org_letter.insert(0, self.selected_org_name)
-            self.entry_org_letter.config(state="readonly")
+    def _apply_org_selection(self, org_id, org_name, dialog):
+        """Sets the letter's organization (from the dialog's treeview or its autocomplete dropdown)."""
+        self.selected_org_id = org_id
+        self.selected_org_name = org_name
 
-            # Clear previous contact selection as organization changed
-            self.selected_contact_id = None
-            self.selected_contact_name = None
-            self.entry_contact_letter.config(state="normal")
-            self.entry_contact_letter.delete(0, tk.END)
-            self.entry_contact_letter.config(state="readonly")
+        # Update the main entry field
+        self.entry_org_letter.config(state="normal")
+        self.entry_org_letter.delete(0, tk.END)
+        self.entry_org_letter.insert(0, self.selected_org_name)
+        self.entry_org_letter.config(state="readonly")
 
-            dialog.destroy()
-        else:
-            messagebox.showwarning("انتخاب سازمان", "لطفاً یک سازمان را انتخاب کنید.", parent=dialog)
+        # Clear previous contact selection as organization changed
+        self.selected_contact_id = None
+        self.selected_contact_name = None
+        self.entry_contact_letter.config(state="normal")
+        self.entry_contact_letter.delete(0, tk.END)
+        self.entry_contact_letter.config(state="readonly")
+
+        dialog.destroy()
 
     # --- New: Modal Dialog for Contact Selection ---
     def _open_contact_selection_dialog(self):
@@ -482,10 +550,14 @@ class App:
         search_frame = ttk.Frame(dialog_frame)
         search_frame.pack(fill=tk.X, pady=5)
         ttk.Label(search_frame, text="جستجو:").pack(side=tk.RIGHT, padx=5)
-        self.contact_dialog_search_entry = ttk.Entry(search_frame)
-        self.contact_dialog_search_entry.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
-        self.contact_dialog_search_entry.bind("<Return>", lambda event: self._populate_contact_dialog_treeview(self.contact_dialog_search_entry.get(), self.selected_org_id))
-        ttk.Button(search_frame, text="جستجو", command=lambda: self._populate_contact_dialog_treeview(self.contact_dialog_search_entry.get(), self.selected_org_id)).pack(side=tk.RIGHT, padx=5)
+        contact_autocomplete = AutocompleteEntry(search_frame, get_contact_index(),
+                                                 on_select=lambda contact: self._apply_contact_selection(contact['id'], contact['first_name'], contact['last_name'], contact['organization_id'], dialog),
+                                                 display=lambda contact: " - ".join(part for part in (f"{contact['first_name']} {contact['last_name']}", contact['title'], contact['org_name']) if part),
+                                                 accept=_in_organization(self.selected_org_id))
+        contact_autocomplete.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
+        self.contact_dialog_search_entry = contact_autocomplete.entry
+        contact_dialog_live_search = LiveSearch(self.contact_dialog_search_entry, lambda term: self._populate_contact_dialog_treeview(term, self.selected_org_id))
+        ttk.Button(search_frame, text="جستجو", command=contact_dialog_live_search.fire_now).pack(side=tk.RIGHT, padx=5)
 
         # Treeview for contacts
         tree_frame = ttk.Frame(dialog_frame)
@@ -529,38 +601,14 @@ class App:
         self.root.wait_window(dialog)
 
     def _populate_contact_dialog_treeview(self, search_term="", organization_id=None):
-        """Populates the contact selection dialog's treeview, optionally filtered by search term and organization_id."""
+        """Populates the contact selection dialog's treeview from the in-memory contact index,
+        optionally filtered by search term and organization_id."""
+        if not self.contact_dialog_treeview.winfo_exists():
+            return
         for i in self.contact_dialog_treeview.get_children():
             self.contact_dialog_treeview.delete(i)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        query = """
-            SELECT c.id, c.first_name, c.last_name, c.title, o.name AS org_name, c.organization_id
-            FROM Contacts c
-            LEFT JOIN Organizations o ON c.organization_id = o.id
-        """
-        params = []
-        conditions = []
-
-        if search_term:
-            conditions.append("(c.first_name LIKE ? OR c.last_name LIKE ? OR c.title LIKE ? OR o.name LIKE ?)")
-            params.extend([f"%{search_term}%", f"%{search_term}%", f"%{search_term}%", f"%{search_term}%"])
-
-        if organization_id is not None:
-            conditions.append("c.organization_id = ?")
-            params.append(organization_id)
-
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-
-        query += " ORDER BY c.last_name, c.first_name"
-
-        cursor.execute(query, params)
-        contacts = cursor.fetchall()
-        conn.close()
-
-        for contact in contacts:
+        for contact in get_contact_index().search(search_term, limit=None, accept=_in_organization(organization_id)):
             self.contact_dialog_treeview.insert("", tk.END, values=(
                 contact['id'],
                 contact['first_name'],
@@ -575,63 +623,84 @@ class App:
         selected_item = self.contact_dialog_treeview.focus()
         if selected_item:
             values = self.contact_dialog_treeview.item(selected_item, 'values')
-            self.selected_contact_id = values[0]
-            self.selected_contact_name = f"{values[1]} {values[2]}" 
-
-            selected_contact_org_id = values[5] 
-            if self.selected_org_id is None or self.selected_org_id != selected_contact_org_id:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM Organizations WHERE id = ?", (selected_contact_org_id,))
-                org_name = cursor.fetchone()
-                conn.close()
-                if org_name:
-                    self.selected_org_id = selected_contact_org_id
-                    self.selected_org_name = org_name['name']
-                    self.entry_org_letter.config(state="normal")
-                    self.entry_org_letter.delete(0, tk.END)
-                    self.entry_org_letter.insert(0, self.selected_org_name)
-                    self.entry_org_letter.config(state="readonly")
+            self._apply_contact_selection(values[0], values[1], values[2], values[5], dialog)
+        else:
+            messagebox.showwarning("انتخاب مخاطب", "لطفاً یک مخاطب را انتخاب کنید.", parent=dialog)
 
+    def _apply_contact_selection(self, contact_id, first_name, last_name, contact_org_id, dialog):
+        """Sets the letter's contact, and its organization if different (from the dialog's treeview or its autocomplete dropdown)."""
+        self.selected_contact_id = contact_id
+        self.selected_contact_name = f"{first_name} {last_name}" 
 
-            self.entry_contact_letter.config(state="normal")
-            self.entry_contact_letter.delete(0, tk.END)
-            self.entry_contact_letter.insert(0, self.selected_contact_name)
-            self.entry_contact_letter.config(state="readonly")
+        if self.selected_org_id is None or str(self.selected_org_id) != str(contact_org_id):
+            organization = get_organization_by_id(contact_org_id) if contact_org_id else None
+            if organization:
+                self.selected_org_id = contact_org_id
+                self.selected_org_name = organization['name']
+                self.entry_org_letter.config(state="normal")
+                self.entry_org_letter.delete(0, tk.END)
+                self.entry_org_letter.insert(0, self.selected_org_name)
+                self.entry_org_letter.config(state="readonly")
 
-            dialog.destroy()
-        else:
-            messagebox.showwarning("انتخاب مخاطب", "لطفاً یک مخاطب را انتخاب کنید.", parent=dialog)
+
+        self.entry_contact_letter.config(state="normal")
+        self.entry_contact_letter.delete(0, tk.END)
+        self.entry_contact_letter.insert(0, self.selected_contact_name)
+        self.entry_contact_letter.config(state="readonly")
+
+        dialog.destroy()
 
     def populate_org_contact_combos(self):
-        """Populates organization and contact comboboxes for CRM tab."""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id, name FROM Organizations ORDER BY name")
-        organizations = cursor.fetchall()
-        org_names = ["---"]
-        self.org_data_map = {"---": None}
-        for org in organizations:
-            org_names.append(org['name'])
-            self.org_data_map[org['name']] = org['id']
-
-        cursor.execute("SELECT id, first_name, last_name, organization_id, title FROM Contacts ORDER BY first_name, last_name")
-        contacts = cursor.fetchall()
-        contact_full_names = ["---"]
-        self.all_contacts_data = {"---": None}
-        for contact in contacts:
-            full_name = f"{contact['first_name']} {contact['last_name']}"
-            contact_full_names.append(full_name)
-            self.all_contacts_data[full_name] = {
-                'id': contact['id'],
-                'first_name': contact['first_name'],
-                'last_name': contact['last_name'],
-                'organization_id': contact['organization_id'],
-                'title': contact['title']
-            }
-
-        conn.close()
+        """
+        Loads every organization and contact into org_data_map ({id: name}), all_contacts_data
+        ({id: contact}) and the autocomplete indexes of the selection dialogs. Done once at startup;
+        after that the CRM dialogs report each change to apply_crm_change, which updates only the changed row.
+        """
+        organizations = get_organization_choices()
+        self.org_data_map = {org['id']: org['name'] for org in organizations}
+        get_organization_index().build(_organization_index_entry(org) for org in organizations)
+
+        self.all_contacts_data = {contact['id']: dict(contact) for contact in get_contact_choices()}
+        get_contact_index().build(_contact_index_entry(contact, self.org_data_map) for contact in self.all_contacts_data.values())
+
+    def _on_crm_import_finished(self):
+        # An import adds rows by the thousand: reload everything rather than applying them one by one
+        self.populate_org_contact_combos()
+        populate_organizations_treeview(self.org_search_entry.get().strip(), self.org_treeview, self.status_bar)
+        populate_contacts_treeview(None, self.contact_search_entry.get().strip(), self.contact_treeview, self.status_bar)
+
+    def apply_crm_change(self, table, entity_id, deleted=False):
+        """Applies one added, edited or deleted organization or contact to org_data_map / all_contacts_data and the autocomplete indexes."""
+        entity_id = int(entity_id)
+        if table == "Organizations":
+            if deleted:
+                self.org_data_map.pop(entity_id, None)
+                get_organization_index().remove(entity_id)
+                # Mirrors the ON DELETE SET NULL of Contacts.organization_id
+                for contact in self.all_contacts_data.values():
+                    if contact['organization_id'] == entity_id:
+                        contact['organization_id'] = None
+                        get_contact_index().add(*_contact_index_entry(contact, self.org_data_map))
+                return
+            organization = get_organization_by_id(entity_id)
+            if organization:
+                renamed = self.org_data_map.get(entity_id) != organization['name']
+                self.org_data_map[entity_id] = organization['name']
+                get_organization_index().add(*_organization_index_entry(organization))
+                if renamed:
+                    # Contacts are also found by their organization's name
+                    for contact in self.all_contacts_data.values():
+                        if contact['organization_id'] == entity_id:
+                            get_contact_index().add(*_contact_index_entry(contact, self.org_data_map))
+        elif table == "Contacts":
+            if deleted:
+                self.all_contacts_data.pop(entity_id, None)
+                get_contact_index().remove(entity_id)
+                return
+            contact = get_contact_by_id(entity_id)
+            if contact:
+                self.all_contacts_data[entity_id] = {field: contact[field] for field in ('id', 'first_name', 'last_name', 'organization_id', 'title')}
+                get_contact_index().add(*_contact_index_entry(self.all_contacts_data[entity_id], self.org_data_map))
 
     def update_history_treeview(self, search_term="", treeview_widget=None, status_bar_ref=None, letter_types_map=None):
         # Pass letter_types_map to the imported function
@@ -681,10 +750,21 @@ class App:
         self.entry_template_path.insert(0, letterhead_template_path)
         ttk.Button(settings_frame, text="انتخاب فایل", command=self._select_template_file).grid(row=3, column=2, padx=5, pady=5)
 
+        # Letter rendering backend ("streaming" skips python-docx's object model, for high-volume generation)
+        ttk.Label(settings_frame, text="روش ساخت فایل Word:").grid(row=4, column=0, sticky=tk.E, padx=5, pady=5)
+        self.render_backend_var = tk.StringVar(value=settings_manager.docx_render_backend)
+        ttk.Combobox(settings_frame, textvariable=self.render_backend_var, values=list(RENDER_BACKENDS), state="readonly", width=20).grid(row=4, column=1, sticky=tk.E, padx=5, pady=5)
+
+        # Slow query threshold and the database diagnostics window
+        ttk.Label(settings_frame, text="آستانه پرس‌وجوی کند (میلی‌ثانیه):").grid(row=5, column=0, sticky=tk.E, padx=5, pady=5)
+        self.slow_query_threshold_var = tk.StringVar(value=str(settings_manager.slow_query_threshold_ms))
+        ttk.Spinbox(settings_frame, from_=1, to=60000, increment=50, textvariable=self.slow_query_threshold_var, width=10).grid(row=5, column=1, sticky=tk.E, padx=5, pady=5)
+        ttk.Button(settings_frame, text="گزارش کارایی پایگاه داده", command=self._open_query_diagnostics).grid(row=5, column=2, padx=5, pady=5)
+
         # -------------------------------------------------------------------
         # کد جدید: فریم برای مدیریت حساب کاربری
         user_mgmt_frame = ttk.LabelFrame(settings_frame, text="مدیریت حساب کاربری", padding=10)
-        user_mgmt_frame.grid(row=4, column=0, columnspan=3, pady=10, padx=10, sticky="ew") 
+        user_mgmt_frame.grid(row=6, column=0, columnspan=3, pady=10, padx=10, sticky="ew") 
 
         # دکمه مدیریت کاربران (فقط برای ادمین)
         self.user_management_button = ttk.Button(
@@ -704,14 +784,14 @@ class App:
         # -------------------------------------------------------------------
 
         # Save Settings Button 
-        ttk.Button(settings_frame, text="ذخیره تنظیمات", command=self._save_settings_from_ui).grid(row=5, column=1, columnspan=2, pady=20) 
+        ttk.Button(settings_frame, text="ذخیره تنظیمات", command=self._save_settings_from_ui).grid(row=7, column=1, columnspan=2, pady=20) 
 
         # Configure column weights for resizing
         settings_frame.grid_columnconfigure(1, weight=1)
 
     def on_generate_letter_wrapper(self):
-        """Wrapper method to collect data and call on_generate_letter."""
-        self.show_progress("در حال تولید نامه...")
+        """Wrapper method to collect data and call on_generate_letter.
+        The letter is queued and generated in the background; the form is cleared as soon as it is queued."""
         try:
             letter_type = self.letter_type_var.get()
             subject = self.subject_entry.get()
@@ -729,7 +809,7 @@ class App:
                 messagebox.showwarning("ورودی ناقص", "لطفاً متن نامه را وارد کنید.")
                 return
 
-            on_generate_letter(
+            job = on_generate_letter(
                 root_window_ref=self.root,
                 status_bar_ref=self.status_bar,
                 letter_type_display=letter_type, # Changed parameter name for clarity
@@ -740,8 +820,11 @@ class App:
                 save_path=default_save_path, 
                 letterhead_template=letterhead_template_path, 
                 user_id=self.user_id,
-                letter_types_map=self.letter_types # Pass the full map
+                letter_types_map=self.letter_types, # Pass the full map
+                on_generated_callback=lambda file_path: self.update_history_treeview(letter_types_map=self.letter_types)
             )
+            if job is None:
+                return
 
             self.letter_type_var.set(list(self.letter_types.values())[0]) 
             self.subject_entry.delete(0, tk.END)
@@ -757,15 +840,42 @@ class App:
             self.entry_contact_letter.delete(0, tk.END)
             self.entry_contact_letter.config(state="readonly")
 
-
-            self.update_history_treeview(letter_types_map=self.letter_types) 
-
         except Exception as e:
             messagebox.showerror("خطا در تولید نامه", f"خطایی رخ داد: {e}")
-        finally:
-            self.hide_progress()
 
 
+    def on_batch_generate_wrapper(self):
+        """Opens the batch generation dialog for the letter currently filled in on the letter tab."""
+        letter_type = self.letter_type_var.get()
+        subject = self.subject_entry.get()
+        body = self.text_letter_body.get("1.0", tk.END).strip()
+
+        if not letter_type:
+            messagebox.showwarning("ورودی ناقص", "لطفاً نوع نامه را انتخاب کنید.")
+            return
+        if not subject:
+            messagebox.showwarning("ورودی ناقص", "لطفاً موضوع نامه را وارد کنید.")
+            return
+        if not body:
+            messagebox.showwarning("ورودی ناقص", "لطفاً متن نامه را وارد کنید.")
+            return
+        if not letterhead_template_path or not os.path.exists(letterhead_template_path):
+            messagebox.showerror("خطا", "مسیر فایل الگوی سربرگ (Word) در تنظیمات مشخص نشده یا فایل وجود ندارد. لطفاً در تب 'تنظیمات' آن را تنظیم کنید.", parent=self.root)
+            return
+
+        BatchGenerationDialog(
+            self.root,
+            letter_type_display=letter_type,
+            subject=subject,
+            body_content=body,
+            letter_types_map=self.letter_types,
+            save_path=default_save_path,
+            letterhead_template=letterhead_template_path,
+            user_id=self.user_id,
+            status_bar_ref=self.status_bar,
+            on_finished_callback=lambda: self.update_history_treeview(letter_types_map=self.letter_types)
+        )
+
     def _select_save_path(self):
         """Opens a directory dialog to select the default save path."""
         folder_selected = filedialog.askdirectory(parent=self.root)
@@ -790,10 +900,24 @@ class App:
         full_company_name = self.entry_full_company_name.get().strip()
         default_save_path = self.entry_save_path.get().strip()
         letterhead_template_path = self.entry_template_path.get().strip()
+        settings_manager.docx_render_backend = self.render_backend_var.get()
+        try:
+            slow_query_threshold_ms = int(self.slow_query_threshold_var.get())
+            if slow_query_threshold_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showwarning("ورودی نامعتبر", "آستانه پرس‌وجوی کند باید یک عدد صحیح مثبت باشد.", parent=self.root)
+            return
+        settings_manager.slow_query_threshold_ms = slow_query_threshold_ms
+        set_slow_query_threshold(slow_query_threshold_ms)
         save_settings()
         messagebox.showinfo("تنظیمات", "تنظیمات با موفقیت ذخیره شد.", parent=self.root)
         if self.status_bar: self.status_bar.config(text="تنظیمات ذخیره شد.")
 
+    def _open_query_diagnostics(self):
+        """Opens the window with the database query statistics and the recent slow queries."""
+        QueryDiagnosticsWindow(self.root)
+
     # Helper method for context menu - Re-added Paste command
     def _show_text_context_menu(self, event):
         """Displays a right-click context menu for Text widgets."""
@@ -825,6 +949,12 @@ class App:
 
 
     # --- Archive Tab Setup ---
+    def _export_archive(self):
+        """Exports the letters of the archive tab's current search, filters and sort to a file."""
+        path = ask_export_path(self.root)
+        if path:
+            ArchiveExportDialog(self.root, path, get_history_query(self.history_treeview), self.letter_types, self.status_bar)
+
     def _setup_archive_tab(self):
         archive_frame = ttk.LabelFrame(self.tab_archive, text="آرشیو نامه‌ها", padding="10 10 10 10")
         archive_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -837,7 +967,8 @@ class App:
         self.archive_search_entry = ttk.Entry(search_frame)
         self.archive_search_entry.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=5)
         # Pass self.letter_types to on_search_archive_button
-        ttk.Button(search_frame, text="جستجو", command=lambda: on_search_archive_button(self.archive_search_entry.get(), self.history_treeview, self.status_bar, self.letter_types)).pack(side=tk.RIGHT, padx=5)
+        self.archive_live_search = LiveSearch(self.archive_search_entry, lambda term: on_search_archive_button(term, self.history_treeview, self.status_bar, self.letter_types))
+        ttk.Button(search_frame, text="جستجو", command=self.archive_live_search.fire_now).pack(side=tk.RIGHT, padx=5)
 
         # Letter History Treeview
         history_tree_frame = ttk.Frame(archive_frame)
@@ -846,15 +977,16 @@ class App:
         history_scrollbar = ttk.Scrollbar(history_tree_frame, orient="vertical")
         history_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-        self.history_treeview = ttk.Treeview(history_tree_frame, columns=("code", "type", "date", "subject", "organization", "contact"), show="headings", yscrollcommand=history_scrollbar.set)
+        self.history_treeview = ttk.Treeview(history_tree_frame, columns=("code", "type", "date", "subject", "organization", "contact", "snippet"), show="headings", yscrollcommand=history_scrollbar.set)
         history_scrollbar.config(command=self.history_treeview.yview)
 
-        self.history_treeview.heading("code", text="کد نامه", command=lambda: self._sort_column(self.history_treeview, "code", False))
-        self.history_treeview.heading("type", text="نوع نامه", command=lambda: self._sort_column(self.history_treeview, "type", False))
-        self.history_treeview.heading("date", text="تاریخ", command=lambda: self._sort_column(self.history_treeview, "date", False))
-        self.history_treeview.heading("subject", text="موضوع", command=lambda: self._sort_column(self.history_treeview, "subject", False))
-        self.history_treeview.heading("organization", text="سازمان", command=lambda: self._sort_column(self.history_treeview, "organization", False))
-        self.history_treeview.heading("contact", text="مخاطب", command=lambda: self._sort_column(self.history_treeview, "contact", False))
+        self.history_treeview.heading("code", text="کد نامه", command=lambda: self._sort_column(self.history_treeview, "code"))
+        self.history_treeview.heading("type", text="نوع نامه", command=lambda: self._sort_column(self.history_treeview, "type"))
+        self.history_treeview.heading("date", text="تاریخ", command=lambda: self._sort_column(self.history_treeview, "date"))
+        self.history_treeview.heading("subject", text="موضوع", command=lambda: self._sort_column(self.history_treeview, "subject"))
+        self.history_treeview.heading("organization", text="سازمان", command=lambda: self._sort_column(self.history_treeview, "organization"))
+        self.history_treeview.heading("contact", text="مخاطب", command=lambda: self._sort_column(self.history_treeview, "contact"))
+        self.history_treeview.heading("snippet", text="متن یافت‌شده")
 
         self.history_treeview.column("code", width=100, stretch=tk.NO)
         self.history_treeview.column("type", width=80, stretch=tk.NO)
@@ -862,37 +994,41 @@ class App:
         self.history_treeview.column("subject", width=250)
         self.history_treeview.column("organization", width=150)
         self.history_treeview.column("contact", width=150)
+        self.history_treeview.column("snippet", width=250)
 
         self.history_treeview.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
+        # Type, date, organization and author filters, between the search box and the list
+        self.archive_filter_panel = ArchiveFilterPanel(archive_frame, self.history_treeview, self.letter_types, self.status_bar)
+        self.archive_filter_panel.pack(fill=tk.X, pady=5, before=history_tree_frame)
+
         # Buttons for archive actions
         archive_buttons_frame = ttk.Frame(archive_frame)
         archive_buttons_frame.pack(fill=tk.X, pady=5)
         ttk.Button(archive_buttons_frame, text="باز کردن نامه", command=lambda: on_open_letter_button(self.history_treeview, self.root, self.status_bar)).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(archive_buttons_frame, text="خروجی (CSV / JSONL / Excel)...", command=self._export_archive).pack(side=tk.RIGHT, padx=5)
 
         # Pass self.letter_types to update_history_treeview during initial setup of archive tab
         self.update_history_treeview(treeview_widget=self.history_treeview, status_bar_ref=self.status_bar, letter_types_map=self.letter_types)
 
-    # --- Sort column helper for Treeviews (moved from helpers to App class) ---
-    def _sort_column(self, treeview, col, reverse):
-        l = [(treeview.set(k, col), k) for k in treeview.get_children('')]
-        l.sort(key=lambda t: t[0], reverse=reverse)
-
-        for index, (val, k) in enumerate(l):
-            treeview.move(k, '', index)
-
-        treeview.heading(col, command=lambda: self._sort_column(treeview, col, not reverse))
-
+    # --- Column header sorting: the rows are re-queried in the chosen order ---
+    def _sort_column(self, treeview, col):
+        if treeview is self.history_treeview:
+            sort_history_treeview(treeview, col)
+        else:
+            sort_treeview(treeview, col)
 
 if __name__ == "__main__":
+    # Batch generation renders letters in worker processes; needed when running as a frozen executable
+    multiprocessing.freeze_support()
     try:
         print("DEBUG: تنظیمات اولیه برنامه آغاز شد.")
         # Create the main Tkinter root window
         root = ThemedTk(theme="clam") 
         print("DEBUG: پنجره اصلی Tkinter ایجاد شد.") 
 
-        # Create database tables if they don't exist (call once at the very beginning)
-        create_tables() 
+        # Bring the database schema up to date (only reads PRAGMA user_version when it already is)
+        migrate_database()
         print("DEBUG: جداول دیتابیس بررسی/ایجاد شدند.")
 
         # Check and create initial admin user if needed, using the root as parent for messageboxes
@@ -912,6 +1048,9 @@ if __name__ == "__main__":
             app = App(root, logged_in_user_id, logged_in_user_role, login_window) 
             root.mainloop()
             print("DEBUG: حلقه اصلی به پایان رسید.")
+            app.generation_jobs.shutdown()
+            app.query_executor.shutdown()
+            close_all_connections()
         else:
             print("DEBUG: ورود لغو یا ناموفق بود. در حال خروج از برنامه.")
             root.destroy()
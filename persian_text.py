@@ -0,0 +1,88 @@
+import re
+
+ZWNJ = "\u200c"
+
+# Arabic letter forms that Persian keyboards and pasted text mix up, mapped to the Persian letter
+_LETTER_FORMS = {
+    "ي": "ی",  # Arabic yeh
+    "ى": "ی",  # alef maksura
+    "ك": "ک",  # Arabic kaf
+    "ة": "ه",  # teh marbuta
+    "ۀ": "ه",  # heh with yeh above
+    "أ": "ا",  # alef with hamza above
+    "إ": "ا",  # alef with hamza below
+    "ٱ": "ا",  # alef wasla
+    "ؤ": "و",  # waw with hamza
+}
+_CHARACTER_MAP = str.maketrans({
+    **_LETTER_FORMS,
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Persian digits
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+})
+# Only the letters that have one standard Persian spelling; ۀ, أ etc. are correct in stored text
+_STORED_LETTER_MAP = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک"})
+# Direction marks and BOMs that pasted and exported text carries
+_INVISIBLE_CHARACTERS = re.compile("[\u200e\u200f\u202a-\u202e\ufeff]")
+
+# Harakat, superscript alef, tatweel and invisible direction marks carry no meaning for searching
+_IGNORED_CHARACTERS = re.compile("[\u064b-\u065f\u0670\u0640\u200d\u200e\u200f\ufeff]")
+_WHITESPACE = re.compile(r"\s+")
+# Anything but letters, digits and ZWNJ ends a word
+_WORD_SEPARATORS = re.compile(r"[^\w\u200c]+")
+
+
+def normalize_persian_text(text):
+    """
+    Returns text in the form used for searching: one spelling for ی/ک and other Arabic variants,
+    ASCII digits, no ZWNJ (نیم‌فاصله) or diacritics, case-folded, single spaces.
+    """
+    if not text:
+        return ""
+    text = _IGNORED_CHARACTERS.sub("", str(text).translate(_CHARACTER_MAP))
+    return _WHITESPACE.sub(" ", text.replace(ZWNJ, "")).strip().casefold()
+
+
+def clean_persian_text(text):
+    """
+    Returns text tidied for storing: Arabic yeh and kaf written as Persian ی and ک, no direction marks,
+    single spaces, no surrounding whitespace. Unlike normalize_persian_text it keeps ZWNJ, digits and case.
+    """
+    if text is None:
+        return ""
+    text = _INVISIBLE_CHARACTERS.sub("", str(text).translate(_STORED_LETTER_MAP))
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def search_words(text):
+    """Returns the normalized words of a search term; punctuation separates words."""
+    return normalize_persian_text(_WORD_SEPARATORS.sub(" ", str(text or ""))).split()
+
+
+def search_tokens(text):
+    """
+    Returns the set of normalized words of text, for indexing. A word written with a ZWNJ is kept
+    both joined and as its parts, so "پیش‌فاکتور" is found by "پیشفاکتور", "پیش فاکتور" and "فاکتور".
+    """
+    tokens = set()
+    for word in _WORD_SEPARATORS.split(_IGNORED_CHARACTERS.sub("", str(text or ""))):
+        tokens.update(search_words(word))
+        if ZWNJ in word:
+            for part in word.split(ZWNJ):
+                tokens.update(search_words(part))
+    return tokens
+
+
+_SHAMSI_DATE = re.compile(r"^(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})$")
+
+def parse_shamsi_date(text):
+    """
+    Parses a Shamsi date written year/month/day in any digits ("۱۴۰۳/۰۵/۱" or "1403-5-1").
+    Returns (year, month, day); raises ValueError if text is not such a date.
+    """
+    match = _SHAMSI_DATE.match(normalize_persian_text(text))
+    if not match:
+        raise ValueError(f"تاریخ نامعتبر: {text}")
+    year, month, day = (int(part) for part in match.groups())
+    if not (1 <= month <= 12 and 1 <= day <= (31 if month <= 6 else 30)):
+        raise ValueError(f"تاریخ نامعتبر: {text}")
+    return year, month, day
@@ -0,0 +1,186 @@
+import queue
+import sqlite3
+import threading
+import traceback
+
+from connection_manager import get_connection, release_connection
+
+WORKER_COUNT = 2
+POLL_INTERVAL_MS = 30
+
+
+class _Job:
+    def __init__(self, channel, generation, func, args, kwargs, on_done, on_error):
+        self.channel = channel
+        self.generation = generation
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.connection = None # Set by the worker while the job runs, so it can be interrupted
+
+
+class QueryExecutor:
+    """
+    Runs database reads on worker threads and hands the results back to the Tk mainloop.
+
+    Every query is submitted on a named channel (e.g. one per Treeview). Submitting a new
+    query on a channel supersedes the previous one: if it hasn't started it is skipped, if it
+    is running its SQLite statement is interrupted, and its result is never delivered.
+    Callbacks always run on the Tk thread, picked up by polling a result queue with after().
+    """
+
+    def __init__(self, root, status_bar_ref=None, worker_count=WORKER_COUNT):
+        self.root = root
+        self.status_bar_ref = status_bar_ref
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._running = {}
+        self._pending_count = 0
+        self._stopped = False
+
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"query-worker-{i}", daemon=True) for i in range(worker_count)]
+        for worker in self._workers:
+            worker.start()
+        self._poll_id = self.root.after(POLL_INTERVAL_MS, self._poll_results)
+
+    def submit(self, channel, func, *args, on_done=None, on_error=None, **kwargs):
+        """Queues func(*args, **kwargs) on a worker thread; on_done(result) is called on the Tk thread."""
+        with self._lock:
+            generation = self._generations.get(channel, 0) + 1
+            self._generations[channel] = generation
+            self._pending_count += 1
+            self._interrupt_running(channel)
+
+        self._jobs.put(_Job(channel, generation, func, args, kwargs, on_done, on_error))
+        self._update_status()
+
+    def cancel(self, channel):
+        """Drops whatever is queued or running on channel without starting anything new."""
+        with self._lock:
+            self._generations[channel] = self._generations.get(channel, 0) + 1
+            self._interrupt_running(channel)
+
+    def _interrupt_running(self, channel):
+        # Called with self._lock held, so the job can't hand its connection to another job meanwhile
+        running_job = self._running.get(channel)
+        if running_job is not None and running_job.connection is not None:
+            running_job.connection.interrupt()
+
+    def _is_current(self, job):
+        with self._lock:
+            return self._generations.get(job.channel) == job.generation
+
+    def _worker_loop(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                release_connection()
+                return
+            if not self._is_current(job):
+                self._results.put((job, None, None, True))
+                continue
+
+            with self._lock:
+                job.connection = get_connection()
+                self._running[job.channel] = job
+            try:
+                result = job.func(*job.args, **job.kwargs)
+                self._results.put((job, result, None, False))
+            except sqlite3.OperationalError as e:
+                # An interrupted (superseded) query ends up here; it is simply dropped
+                self._results.put((job, None, e, not self._is_current(job)))
+            except Exception as e:
+                traceback.print_exc()
+                self._results.put((job, None, e, False))
+            finally:
+                with self._lock:
+                    if self._running.get(job.channel) is job:
+                        del self._running[job.channel]
+                    job.connection = None
+
+    def _poll_results(self):
+        while True:
+            try:
+                job, result, error, superseded = self._results.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._pending_count -= 1
+            if superseded or not self._is_current(job):
+                continue
+            try:
+                if error is not None:
+                    self._report_error(job, error)
+                elif job.on_done:
+                    job.on_done(result)
+            except Exception:
+                traceback.print_exc()
+        self._update_status()
+        if not self._stopped:
+            self._poll_id = self.root.after(POLL_INTERVAL_MS, self._poll_results)
+
+    def _report_error(self, job, error):
+        if job.on_error:
+            job.on_error(error)
+            return
+        print(f"DEBUG: Error in background query '{job.channel}': {error}")
+        if self.status_bar_ref:
+            self.status_bar_ref.config(text=f"خطا در بازیابی اطلاعات: {error}")
+
+    def _update_status(self):
+        with self._lock:
+            pending = self._pending_count
+        if self.status_bar_ref and pending > 0:
+            self.status_bar_ref.config(text=f"در حال بازیابی اطلاعات... ({pending} درخواست در جریان)")
+
+    def shutdown(self):
+        """Stops the workers; queued jobs that haven't started are dropped."""
+        self._stopped = True
+        with self._lock:
+            self._generations = {channel: generation + 1 for channel, generation in self._generations.items()}
+        try:
+            self.root.after_cancel(self._poll_id)
+        except Exception:
+            pass
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join(timeout=1)
+
+
+# The executor the UI modules submit to; installed by the App once the root window exists.
+_default_executor = None
+
+def set_default_executor(executor):
+    global _default_executor
+    _default_executor = executor
+
+def get_default_executor():
+    return _default_executor
+
+def run_query(channel, func, *args, on_done=None, on_error=None, **kwargs):
+    """
+    Runs func in the background through the default executor and passes its result to on_done on the Tk thread.
+    Without an executor (e.g. before the App exists) the query runs synchronously.
+    """
+    if _default_executor is not None:
+        _default_executor.submit(channel, func, *args, on_done=on_done, on_error=on_error, **kwargs)
+        return
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if on_error:
+            on_error(e)
+            return
+        raise
+    if on_done:
+        on_done(result)
+
+def cancel_query(channel):
+    """Drops any background query queued or running on channel (no-op without an executor)."""
+    if _default_executor is not None:
+        _default_executor.cancel(channel)
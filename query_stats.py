@@ -0,0 +1,423 @@
+import inspect
+import json
+import re
+import sqlite3
+import threading
+import time
+import functools
+import tkinter as tk
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from tkinter import ttk, messagebox, filedialog
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket holds everything slower
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 200
+SLOW_QUERY_LOG = "slow_queries.log"
+RECENT_SLOW_QUERIES = 200
+# Parameters longer than this are cut in the slow-query log
+MAX_LOGGED_PARAMETER_LENGTH = 200
+
+KIND_STATEMENT = "sql"
+KIND_FUNCTION = "function"
+
+_COMMENT = re.compile(r"--[^\n]*")
+_WHITESPACE = re.compile(r"\s+")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def normalize_statement(sql):
+    """Collapses whitespace and IN (?, ?, ...) lists, so one query in a loop or in chunks counts as one statement."""
+    return _PARAMETER_LIST.sub("(?, ...)", _WHITESPACE.sub(" ", _COMMENT.sub("", sql)).strip())
+
+
+class QueryStats:
+    """
+    Aggregated timings of database statements and database.py functions, per statement text or function name:
+    call count, total/max latency, a latency histogram and the number of rows returned or changed.
+    Statements slower than the threshold are also appended to SLOW_QUERY_LOG with their
+    parameters and query plan, and kept in memory for the diagnostics window.
+    """
+
+    def __init__(self, slow_query_threshold_ms=DEFAULT_SLOW_QUERY_THRESHOLD_MS, slow_query_log=SLOW_QUERY_LOG):
+        self.slow_query_threshold_ms = slow_query_threshold_ms
+        self.slow_query_log = slow_query_log
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._slow_queries = deque(maxlen=RECENT_SLOW_QUERIES)
+        self.started_at = datetime.now()
+
+    def record(self, kind, name, seconds, rows):
+        with self._lock:
+            entry = self._entries.get((kind, name))
+            if entry is None:
+                entry = {'kind': kind, 'name': name, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                         'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+                self._entries[(kind, name)] = entry
+            milliseconds = seconds * 1000
+            entry['count'] += 1
+            entry['total_ms'] += milliseconds
+            entry['max_ms'] = max(entry['max_ms'], milliseconds)
+            entry['rows'] += rows
+            entry['histogram'][_bucket_index(milliseconds)] += 1
+
+    def record_slow_query(self, sql, parameters, seconds, rows, plan):
+        slow_query = {
+            'time': datetime.now().isoformat(timespec="seconds"),
+            'ms': round(seconds * 1000, 2),
+            'rows': rows,
+            'sql': normalize_statement(sql),
+            'parameters': _loggable_parameters(sql, parameters),
+            'plan': plan,
+        }
+        with self._lock:
+            self._slow_queries.append(slow_query)
+            if self.slow_query_log:
+                try:
+                    with open(self.slow_query_log, "a", encoding="utf-8") as log_file:
+                        log_file.write(json.dumps(slow_query, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"DEBUG: Could not write the slow query log: {e}")
+
+    def snapshot(self):
+        """Returns the aggregated entries (with 'mean_ms'), slowest in total first."""
+        with self._lock:
+            entries = [dict(entry, histogram=list(entry['histogram'])) for entry in self._entries.values()]
+        for entry in entries:
+            entry['mean_ms'] = entry['total_ms'] / entry['count']
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow_queries)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._slow_queries.clear()
+            self.started_at = datetime.now()
+
+    def to_dict(self):
+        return {
+            'since': self.started_at.isoformat(timespec="seconds"),
+            'dumped_at': datetime.now().isoformat(timespec="seconds"),
+            'slow_query_threshold_ms': self.slow_query_threshold_ms,
+            'latency_buckets_ms': list(LATENCY_BUCKETS_MS),
+            'entries': self.snapshot(),
+            'slow_queries': self.slow_queries(),
+        }
+
+    def dump(self, path):
+        """Writes the statistics and the recent slow queries to path as JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def _bucket_index(milliseconds):
+    for index, upper_bound in enumerate(LATENCY_BUCKETS_MS):
+        if milliseconds <= upper_bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+def _loggable_parameters(sql, parameters):
+    if parameters is None:
+        return None
+    # Never write password hashes to the log
+    if "password" in sql.lower():
+        return "<redacted>"
+    values = parameters.values() if isinstance(parameters, dict) else parameters
+    logged = []
+    for value in values:
+        if isinstance(value, str) and len(value) > MAX_LOGGED_PARAMETER_LENGTH:
+            value = value[:MAX_LOGGED_PARAMETER_LENGTH] + "…"
+        elif isinstance(value, bytes):
+            value = f"<{len(value)} bytes>"
+        logged.append(value)
+    return logged
+
+def format_histogram(histogram):
+    labels = [f"≤{bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    return " ".join(f"{label}:{count}" for label, count in zip(labels, histogram) if count)
+
+
+# The statistics every instrumented connection and function reports to
+_default_stats = QueryStats()
+
+def get_query_stats():
+    return _default_stats
+
+def set_slow_query_threshold(milliseconds):
+    _default_stats.slow_query_threshold_ms = milliseconds
+
+def dump_query_stats(path):
+    _default_stats.dump(path)
+
+
+_recording = threading.local()
+
+@contextmanager
+def record_statements():
+    """
+    Collects (sql, parameters) of every statement this thread runs inside the block, in order
+    (parameters is None for executemany). Used by benchmarks.query_plans to EXPLAIN the real queries.
+    """
+    statements = []
+    outer = getattr(_recording, 'statements', None)
+    _recording.statements = statements
+    try:
+        yield statements
+    finally:
+        _recording.statements = outer
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times each statement, including fetching its rows, and reports it to the query stats
+    when it is finished: when all rows are fetched, the cursor runs another statement or is closed or dropped.
+    """
+    _sql = None
+
+    def _start(self, sql, parameters, many=False):
+        self._finish()
+        self._sql = sql
+        self._parameters = None if many else parameters
+        self._elapsed = 0.0
+        self._rows = 0
+        statements = getattr(_recording, 'statements', None)
+        if statements is not None:
+            statements.append((sql, self._parameters))
+
+    def _finish(self):
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        rows = self._rows
+        if self.description is None and self.rowcount > 0:
+            rows = self.rowcount
+        _default_stats.record(KIND_STATEMENT, normalize_statement(sql), self._elapsed, rows)
+        if self._elapsed * 1000 >= _default_stats.slow_query_threshold_ms:
+            _default_stats.record_slow_query(sql, self._parameters, self._elapsed, rows, self._query_plan(sql))
+
+    def _query_plan(self, sql):
+        if self._parameters is None and "?" in sql or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        try:
+            # Straight to sqlite3, so the EXPLAIN itself is not instrumented
+            rows = sqlite3.Connection.execute(self.connection, "EXPLAIN QUERY PLAN " + sql, self._parameters or ()).fetchall()
+            return [row[3] for row in rows]
+        except sqlite3.Error as e:
+            return [f"EXPLAIN failed: {e}"]
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        try:
+            self._timed(super().execute, sql, parameters)
+        except BaseException:
+            self._finish()
+            raise
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None, many=True)
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if self._sql is not None:
+            self._rows += len(rows)
+        if len(rows) < (self.arraysize if size is None else size):
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._sql is not None:
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements all run on InstrumentedCursor (pass as factory= to sqlite3.connect)."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _timed_function(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        rows = 0
+        try:
+            result = func(*args, **kwargs)
+            if isinstance(result, (list, dict)):
+                rows = len(result)
+            return result
+        finally:
+            _default_stats.record(KIND_FUNCTION, name, time.perf_counter() - started, rows)
+    return wrapper
+
+def instrument_module_functions(module_globals):
+    """
+    Replaces every function defined in a module with a wrapper that reports its calls to the query stats.
+    Call it at the end of the module with globals(); names imported from the module afterwards get the wrappers.
+    Context managers and other already-wrapped functions are left alone.
+    """
+    module_name = module_globals['__name__']
+    for name, obj in list(module_globals.items()):
+        if inspect.isfunction(obj) and obj.__module__ == module_name and not hasattr(obj, '__wrapped__'):
+            module_globals[name] = _timed_function(f"{module_name}.{name}", obj)
+
+
+class QueryDiagnosticsWindow(tk.Toplevel):
+    """Shows the aggregated query statistics and the recent slow queries; can save them as JSON."""
+
+    REFRESH_MS = 2000
+
+    def __init__(self, parent, stats=None):
+        super().__init__(parent)
+        self.stats = stats or _default_stats
+        self.title("گزارش کارایی پایگاه داده")
+        self.geometry("1100x650")
+        self._refresh_id = None
+        self._slow_queries = []
+        self._create_widgets()
+        self.refresh()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _create_widgets(self):
+        top_frame = ttk.Frame(self, padding=5)
+        top_frame.pack(fill=tk.X)
+        ttk.Button(top_frame, text="بروزرسانی", command=self.refresh).pack(side=tk.RIGHT, padx=3)
+        ttk.Button(top_frame, text="صفر کردن آمار", command=self._reset).pack(side=tk.RIGHT, padx=3)
+        ttk.Button(top_frame, text="ذخیره به صورت JSON", command=self._dump).pack(side=tk.RIGHT, padx=3)
+        self.summary_label = ttk.Label(top_frame, text="")
+        self.summary_label.pack(side=tk.LEFT, padx=5)
+
+        stats_frame = ttk.LabelFrame(self, text="آمار پرس‌وجوها و توابع", padding=5)
+        stats_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        columns = ("kind", "count", "total", "mean", "max", "rows", "histogram", "name")
+        self.stats_treeview = ttk.Treeview(stats_frame, columns=columns, show="headings", height=12)
+        for column, heading, width in (("kind", "نوع", 70), ("count", "تعداد", 70), ("total", "مجموع (ms)", 90), ("mean", "میانگین (ms)", 90),
+                                       ("max", "بیشینه (ms)", 90), ("rows", "ردیف‌ها", 80), ("histogram", "توزیع زمان (ms)", 220), ("name", "دستور / تابع", 450)):
+            self.stats_treeview.heading(column, text=heading)
+            self.stats_treeview.column(column, width=width, stretch=(column == "name"))
+        stats_scrollbar = ttk.Scrollbar(stats_frame, orient=tk.VERTICAL, command=self.stats_treeview.yview)
+        self.stats_treeview.configure(yscrollcommand=stats_scrollbar.set)
+        stats_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.stats_treeview.pack(fill=tk.BOTH, expand=True)
+
+        slow_frame = ttk.LabelFrame(self, text="پرس‌وجوهای کند اخیر", padding=5)
+        slow_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.slow_treeview = ttk.Treeview(slow_frame, columns=("time", "ms", "rows", "sql"), show="headings", height=6)
+        for column, heading, width in (("time", "زمان", 150), ("ms", "مدت (ms)", 80), ("rows", "ردیف‌ها", 70), ("sql", "دستور", 700)):
+            self.slow_treeview.heading(column, text=heading)
+            self.slow_treeview.column(column, width=width, stretch=(column == "sql"))
+        self.slow_treeview.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.slow_treeview.bind("<<TreeviewSelect>>", self._show_slow_query_details)
+        self.slow_details = tk.Text(slow_frame, height=6, wrap=tk.WORD)
+        self.slow_details.pack(side=tk.TOP, fill=tk.X)
+
+    def refresh(self):
+        if self._refresh_id is not None:
+            self.after_cancel(self._refresh_id)
+        entries = self.stats.snapshot()
+        self.stats_treeview.delete(*self.stats_treeview.get_children())
+        for entry in entries:
+            self.stats_treeview.insert("", tk.END, values=(
+                entry['kind'], entry['count'], f"{entry['total_ms']:.1f}", f"{entry['mean_ms']:.2f}", f"{entry['max_ms']:.1f}",
+                entry['rows'], format_histogram(entry['histogram']), entry['name']))
+
+        self._slow_queries = self.stats.slow_queries()[::-1]
+        selected = self.slow_treeview.selection()
+        self.slow_treeview.delete(*self.slow_treeview.get_children())
+        for index, slow_query in enumerate(self._slow_queries):
+            self.slow_treeview.insert("", tk.END, iid=str(index), values=(slow_query['time'], slow_query['ms'], slow_query['rows'], slow_query['sql']))
+        if selected and self.slow_treeview.exists(selected[0]):
+            self.slow_treeview.selection_set(selected[0])
+
+        statements = sum(entry['count'] for entry in entries if entry['kind'] == KIND_STATEMENT)
+        self.summary_label.config(text=f"از {self.stats.started_at:%H:%M:%S}: {statements} دستور، {len(self._slow_queries)} پرس‌وجوی کند (آستانه {self.stats.slow_query_threshold_ms} ms)")
+        self._refresh_id = self.after(self.REFRESH_MS, self.refresh)
+
+    def _show_slow_query_details(self, event=None):
+        selected = self.slow_treeview.selection()
+        if not selected:
+            return
+        slow_query = self._slow_queries[int(selected[0])]
+        details = f"{slow_query['sql']}\n\nپارامترها: {slow_query['parameters']}\n\nطرح اجرا:\n" + "\n".join(slow_query['plan'] or ["-"])
+        self.slow_details.delete("1.0", tk.END)
+        self.slow_details.insert("1.0", details)
+
+    def _reset(self):
+        self.stats.reset()
+        self.slow_details.delete("1.0", tk.END)
+        self.refresh()
+
+    def _dump(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".json", filetypes=[("JSON", "*.json")],
+                                            initialfile=f"query_stats_{datetime.now():%Y%m%d_%H%M%S}.json")
+        if not path:
+            return
+        try:
+            self.stats.dump(path)
+            messagebox.showinfo("ذخیره آمار", f"آمار در فایل زیر ذخیره شد:\n{path}", parent=self)
+        except OSError as e:
+            messagebox.showerror("خطا", f"خطا در ذخیره آمار: {e}", parent=self)
+
+    def _on_close(self):
+        if self._refresh_id is not None:
+            self.after_cancel(self._refresh_id)
+        self.destroy()
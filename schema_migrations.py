@@ -0,0 +1,212 @@
+"""
+Versioned schema migrations for the CRM database.
+
+Every schema change is a numbered step in MIGRATIONS. The database records the last step applied
+in PRAGMA user_version, so at startup migrate_database() reads one header field and returns when
+the schema is current; only databases behind the latest version run DDL. Each step runs in its own
+transaction together with the user_version bump, so an interrupted upgrade leaves the database at
+the previous version and the step is simply retried on the next start.
+
+The first steps only use CREATE ... IF NOT EXISTS, so databases created before versioning
+(user_version 0) are adopted without changes.
+
+    python schema_migrations.py [--database crm.db] [--dry-run]
+
+prints the current and latest versions and applies the pending steps with their timings
+(with --dry-run every step runs and is then rolled back).
+"""
+import argparse
+import time
+
+from connection_manager import get_connection, transaction, set_database_path
+from database import _create_letters_fts, _create_letter_sequences, _create_generation_journal, _add_normalized_columns, _create_sort_indexes, _create_filter_indexes, _add_letter_date_columns, _index_letter_date_key, _add_journal_leases
+
+
+def _create_base_tables(cursor):
+    # Create Organizations table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Organizations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            industry TEXT,
+            phone TEXT,
+            email TEXT,
+            address TEXT,
+            description TEXT
+        )
+    """)
+
+    # Create Contacts table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            organization_id INTEGER,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            title TEXT,
+            phone TEXT,
+            email TEXT,
+            notes TEXT,
+            FOREIGN KEY (organization_id) REFERENCES Organizations(id) ON DELETE SET NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_organization_id ON Contacts (organization_id);")
+
+    # Create Letters table - Ensure this matches the columns being inserted
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            letter_code_prefix TEXT NOT NULL,
+            letter_code_number INTEGER NOT NULL,
+            letter_code_persian TEXT NOT NULL UNIQUE,
+            type TEXT NOT NULL,
+            date_shamsi_persian TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            organization_id INTEGER,
+            contact_id INTEGER,
+            file_path TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_id INTEGER,
+            FOREIGN KEY (organization_id) REFERENCES Organizations(id) ON DELETE SET NULL,
+            FOREIGN KEY (contact_id) REFERENCES Contacts(id) ON DELETE SET NULL,
+            FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE SET NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_user_id ON Letters (user_id);")
+    # Supports the archive ORDER BY and the keyset pagination in get_letters_page
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_date_shamsi ON Letters (date_shamsi_persian);")
+
+
+    # Create Users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'user'
+        )
+    """)
+
+
+def _create_query_indexes(cursor):
+    """
+    Indexes for the ORDER BY and lookup columns of the application's queries
+    (see benchmarks/query_plans.py, which checks that none of them scans or sorts).
+    """
+    # Contact lists: by name, optionally for one organization; also serves the Contacts.organization_id foreign key
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_org_name ON Contacts (organization_id, last_name, first_name);")
+    cursor.execute("DROP INDEX IF EXISTS idx_contacts_organization_id;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_last_name ON Contacts (last_name, first_name);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_first_name ON Contacts (first_name, last_name, organization_id, title);")
+    # Organization pickers read id, name and industry in name order straight from the index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_organizations_name_industry ON Organizations (name, industry);")
+    # The LettersFTS triggers and the ON DELETE SET NULL foreign keys look letters up by organization and contact
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_organization_id ON Letters (organization_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_letters_contact_id ON Letters (contact_id);")
+    # Recovery reads the pending letters in number order
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_journal_pending ON GenerationJournal (state, letter_code_prefix, letter_year, letter_code_number);")
+    cursor.execute("DROP INDEX IF EXISTS idx_generation_journal_state;")
+
+
+# (version, description, step); a step receives a cursor inside the migration's transaction.
+# Never edit or reorder a released step: add a new one with the next version instead.
+MIGRATIONS = [
+    (1, "جداول اصلی (سازمان‌ها، مخاطبین، نامه‌ها، کاربران)", _create_base_tables),
+    (2, "نمایه جستجوی متن کامل آرشیو (LettersFTS)", _create_letters_fts),
+    (3, "شمارنده شماره نامه‌ها (LetterSequences)", _create_letter_sequences),
+    (4, "دفتر ثبت تولید نامه (GenerationJournal)", _create_generation_journal),
+    (5, "نمایه‌های پرس‌وجوهای پرکاربرد", _create_query_indexes),
+    (6, "ستون‌های نرمال‌شده برای جستجو (ی/ک، ارقام، نیم‌فاصله)", _add_normalized_columns),
+    (7, "نمایه‌های مرتب‌سازی ستون‌های آرشیو و مشتریان", _create_sort_indexes),
+    (8, "نمایه‌های فیلتر آرشیو بر اساس سازمان و نویسنده", _create_filter_indexes),
+    (9, "ستون‌های عددی تاریخ نامه‌ها (شمسی و میلادی)", _add_letter_date_columns),
+    (10, "نمایه‌های تاریخ برای نامه‌های بدون تاریخ معتبر", _index_letter_date_key),
+    (11, "مالک و مهلت ردیف‌های دفتر ثبت تولید نامه", _add_journal_leases),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class _DryRunRollback(Exception):
+    pass
+
+
+def get_schema_version():
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def pending_migrations(current_version=None):
+    """Returns the MIGRATIONS steps newer than current_version (default: the database's version)."""
+    if current_version is None:
+        current_version = get_schema_version()
+    return [migration for migration in MIGRATIONS if migration[0] > current_version]
+
+def migrate_database(dry_run=False):
+    """
+    Brings the database schema up to SCHEMA_VERSION and returns a report: one dict per step run,
+    with 'version', 'description' and 'seconds'. Returns an empty list without running any DDL
+    when the schema is already current.
+    With dry_run=True all pending steps run in a single transaction that is rolled back at the end,
+    which checks that they apply and shows how long they take without changing the database.
+    Raises RuntimeError if the database was created by a newer version of the application.
+    """
+    current_version = get_schema_version()
+    if current_version == SCHEMA_VERSION:
+        return []
+    if current_version > SCHEMA_VERSION:
+        raise RuntimeError(f"نسخه پایگاه داده ({current_version}) از نسخه پشتیبانی‌شده توسط این برنامه ({SCHEMA_VERSION}) جدیدتر است. لطفاً برنامه را به‌روزرسانی کنید.")
+
+    report = []
+    if dry_run:
+        try:
+            with transaction("IMMEDIATE") as conn:
+                for version, description, step in pending_migrations(current_version):
+                    report.append(_run_step(conn, version, description, step))
+                raise _DryRunRollback()
+        except _DryRunRollback:
+            pass
+        return report
+
+    for version, description, step in pending_migrations(current_version):
+        with transaction("IMMEDIATE") as conn:
+            # Another instance may have applied this step while we waited for the write lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            report.append(_run_step(conn, version, description, step))
+        print(f"DEBUG: مهاجرت پایگاه داده به نسخه {version} انجام شد ({description}) در {report[-1]['seconds']:.3f} ثانیه.")
+    return report
+
+def _run_step(conn, version, description, step):
+    started = time.perf_counter()
+    step(conn.cursor())
+    # PRAGMA does not accept bound parameters; version is always an int from MIGRATIONS
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+    return {'version': version, 'description': description, 'seconds': time.perf_counter() - started}
+
+def format_migration_report(report):
+    lines = [f"  {entry['version']:>3}  {entry['seconds'] * 1000:9.1f} ms  {entry['description']}" for entry in report]
+    total = sum(entry['seconds'] for entry in report)
+    lines.append(f"  total {total * 1000:9.1f} ms, {len(report)} step(s)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="path of the database file (default: the application's database)")
+    parser.add_argument("--dry-run", action="store_true", help="run the pending steps and roll them back")
+    args = parser.parse_args()
+
+    if args.database:
+        set_database_path(args.database)
+    current_version = get_schema_version()
+    print(f"schema version: {current_version}, latest: {SCHEMA_VERSION}")
+    report = migrate_database(dry_run=args.dry_run)
+    if report:
+        print(("dry run (rolled back):" if args.dry_run else "applied:"))
+        print(format_migration_report(report))
+    else:
+        print("schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
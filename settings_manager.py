@@ -7,10 +7,12 @@ company_name = "NGRR" # Default company abbreviation for letter numbering
 full_company_name = "" # New: Default full company name for letter footer
 default_save_path = "" # Default path to save generated letters
 letterhead_template_path = "" # Path to the Word document template for letterhead
+docx_render_backend = "python-docx" # How letters are rendered from the template: "python-docx" or "streaming" (see docx_template)
+slow_query_threshold_ms = 200 # Database statements slower than this are written to the slow query log (see query_stats)
 
 def set_default_settings():
     """Sets default application settings and saves them."""
-    global company_name, full_company_name, default_save_path, letterhead_template_path
+    global company_name, full_company_name, default_save_path, letterhead_template_path, docx_render_backend, slow_query_threshold_ms
     
     # Set sensible defaults
     company_name = "NGRR"
@@ -27,6 +29,8 @@ def set_default_settings():
         default_save_path = os.getcwd()
     
     letterhead_template_path = "" # User will need to set this via UI
+    docx_render_backend = "python-docx"
+    slow_query_threshold_ms = 200
 
     save_settings() # Immediately save defaults to file
     
@@ -34,7 +38,7 @@ def load_settings():
     """Loads application settings from 'settings.txt'.
     If the file doesn't exist or is incomplete, it sets default settings.
     """
-    global company_name, full_company_name, default_save_path, letterhead_template_path
+    global company_name, full_company_name, default_save_path, letterhead_template_path, docx_render_backend, slow_query_threshold_ms
 
     # Ensure default paths are handled initially if the file doesn't exist
     # (This block is primarily for initial setup if default_save_path is not yet in settings.txt)
@@ -53,11 +57,17 @@ def load_settings():
                 # Index 1: full_company_name
                 # Index 2: default_save_path
                 # Index 3: letterhead_template_path
+                # Index 4: docx_render_backend (optional, files from older versions don't have it)
+                # Index 5: slow_query_threshold_ms (optional)
                 if len(settings) >= 4:
                     company_name = settings[0].strip()
                     full_company_name = settings[1].strip() 
                     default_save_path = settings[2].strip()
                     letterhead_template_path = settings[3].strip()
+                    if len(settings) >= 5 and settings[4].strip():
+                        docx_render_backend = settings[4].strip()
+                    if len(settings) >= 6 and settings[5].strip().isdigit():
+                        slow_query_threshold_ms = int(settings[5].strip())
                 else:
                     # If file exists but is incomplete (e.g., old version), load defaults and save
                     set_default_settings() 
@@ -76,6 +86,8 @@ def save_settings():
             file.write(f"{full_company_name}\n") 
             file.write(f"{default_save_path}\n")
             file.write(f"{letterhead_template_path}\n")
+            file.write(f"{docx_render_backend}\n")
+            file.write(f"{slow_query_threshold_ms}\n")
     except Exception as e:
         messagebox.showerror("خطا در ذخیره", f"خطا در ذخیره تنظیمات: {e}")
 
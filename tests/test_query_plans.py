@@ -0,0 +1,16 @@
+"""The hot queries (benchmarks.query_plans.HOT_QUERIES) must not scan a table or sort in a temporary B-tree."""
+import pytest
+
+from benchmarks.query_plans import HOT_QUERIES, hot_query_regressions, scratch_database
+
+
+@pytest.fixture(scope="module")
+def plans_database(tmp_path_factory):
+    with scratch_database(str(tmp_path_factory.mktemp("plans") / "plans.db")):
+        yield
+
+
+@pytest.mark.parametrize("name, source, call, accepted", HOT_QUERIES, ids=[query[0] for query in HOT_QUERIES])
+def test_query_plan_uses_indexes(plans_database, name, source, call, accepted):
+    plan, regressions = hot_query_regressions(source, call, accepted)
+    assert not regressions, f"{name} ({source}):\n" + "\n".join(plan or regressions)